@@ -0,0 +1,61 @@
+'''
+Twitter bot that runs its hooks in the background
+'''
+
+import threading
+from multiprocessing.pool import ThreadPool
+
+from twitterbot import TwitterBot
+
+class AsyncTwitterBot(TwitterBot):
+   '''
+   A twitter bot whose hooks run off the polling loop.
+
+   Each feed ('watched', 'home', 'replies', 'mentions', 'dms') gets its own worker thread for its
+   hooks, so the hooks of one feed still run one at a time and in order (command processing runs
+   before on_mentions), but a slow hook no longer holds up the other feeds or the next update.
+
+   Posts are sent in the background by the bot's post queue, so the posting helpers (tweet, reply,
+   tweet_image, etc.) never block a hook; they return a handle whose wait() returns the posted
+   status.
+   '''
+
+   def __init__(self,*args,**kwargs):
+      # single-threaded pools running the hooks of each feed, keyed by feed name
+      self._hook_lanes={}
+      # guards creation and shutdown of the hook lanes
+      self._pool_lock=threading.Lock()
+
+      super(AsyncTwitterBot,self).__init__(*args,**kwargs)
+
+   def shutdown(self):
+      # hooks may still make posts, so they finish before the post queue is shut down
+      self.drain()
+      super(AsyncTwitterBot,self).shutdown()
+
+   def drain(self):
+      '''
+      Waits for all outstanding hooks to finish, then stops the hook threads.
+      '''
+      with self._pool_lock:
+         lanes=self._hook_lanes.values()
+         self._hook_lanes={}
+      for lane in lanes:
+         lane.close()
+         lane.join()
+
+   def dispatch_hook(self,feed,hook,*args):
+      self._hook_lane(feed).apply_async(self._run_hook,(hook,args))
+
+   def _hook_lane(self,feed):
+      with self._pool_lock:
+         if feed not in self._hook_lanes:
+            self._hook_lanes[feed]=ThreadPool(1)
+         return self._hook_lanes[feed]
+
+   def _run_hook(self,hook,args):
+      try:
+         self.run_hook(hook,*args)
+      except Exception:
+         # nobody waits on a hook, so report the error here rather than losing it
+         self._log.exception('hook_failed',"exception in hook",hook=hook.__name__)
@@ -0,0 +1,127 @@
+import json
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from StringIO import StringIO
+import botlog
+import fakeapi
+from asynctwitterbot import AsyncTwitterBot
+from testutils import FakeClock, make_bot
+
+class RecordingBot(AsyncTwitterBot):
+   '''
+   Bot that records which hooks ran, in which order and on which thread.  The home timeline hook
+   waits until home_release is set, and the mentions hook raises while mentions_fail is set.
+   '''
+   def on_subclass_init(self,**kwargs):
+      self._do_process_home_timeline = True
+      self.calls = []
+      self.threads = {}
+      self.home_release = threading.Event()
+      self.mentions_fail = False
+      self.lock = threading.Lock()
+
+   def record(self,hook,statuses):
+      with self.lock:
+         self.calls.append((hook,[status.id for status in statuses]))
+         self.threads.setdefault(hook,set()).add(threading.current_thread())
+
+   def process_commands(self,mentions):
+      self.record('process_commands',mentions)
+
+   def on_mentions(self,statuses):
+      self.record('on_mentions',statuses)
+      if self.mentions_fail:
+         raise ValueError("broken hook")
+
+   def on_home_timeline(self,statuses):
+      self.home_release.wait(10)
+      self.record('on_home_timeline',statuses)
+
+class TestAsyncTwitterBot(unittest.TestCase):
+   def setUp(self):
+      self.directory = tempfile.mkdtemp()
+      self.clock = FakeClock(time.time())
+      self.api = fakeapi.FakeApi(rates={'home':2,'mentions':2},seed=1,clock=self.clock)
+      self.output = StringIO()
+      self.bot = make_bot(RecordingBot,self.api,self.directory,
+         log=botlog.open_log(self.output))
+      self.bot.start()
+
+   def tearDown(self):
+      self.bot.home_release.set()
+      self.bot.shutdown()
+      shutil.rmtree(self.directory)
+
+   def tick(self):
+      self.clock.now += 5.0
+      self.bot.tick()
+
+   def calls(self,hook):
+      with self.bot.lock:
+         return [ids for name,ids in self.bot.calls if name == hook]
+
+   def test_lanes(self):
+      # a hook that blocks does not hold up the update, or the hooks of the other feeds
+      self.tick()
+      self.tick()
+      deadline = time.time()+10
+      while len(self.calls('on_mentions')) < 2 and time.time() < deadline:
+         time.sleep(0.01)
+      self.assertEqual(len(self.calls('on_mentions')),2)
+      self.assertEqual(self.calls('on_home_timeline'),[])
+
+      self.bot.home_release.set()
+      self.bot.drain()
+      self.assertEqual(len(self.calls('on_home_timeline')),2)
+      # each feed has its own thread, which is not the polling thread
+      threads = self.bot.threads
+      self.assertEqual(len(threads['on_home_timeline']),1)
+      self.assertEqual(threads['on_mentions'],threads['process_commands'])
+      self.assertNotEqual(threads['on_mentions'],threads['on_home_timeline'])
+      self.assertNotIn(threading.current_thread(),threads['on_mentions'])
+
+   def test_order(self):
+      self.bot.home_release.set()
+      for i in range(3):
+         self.tick()
+      self.bot.drain()
+
+      # within a lane, hooks run in the order they were dispatched: commands are processed before
+      # on_mentions sees the same statuses, and each update's statuses come after the last one's
+      mentions = [(name,ids) for name,ids in self.bot.calls
+                  if name in ('process_commands','on_mentions')]
+      self.assertEqual(len(mentions),6)
+      for index in range(0,6,2):
+         self.assertEqual(mentions[index][0],'process_commands')
+         self.assertEqual(mentions[index+1],('on_mentions',mentions[index][1]))
+      newest = [max(ids) for ids in self.calls('on_mentions')]
+      self.assertEqual(newest,sorted(newest))
+      newest = [max(ids) for ids in self.calls('on_home_timeline')]
+      self.assertEqual(len(newest),3)
+      self.assertEqual(newest,sorted(newest))
+
+   def test_error_isolation(self):
+      self.bot.home_release.set()
+      self.bot.mentions_fail = True
+      self.tick()
+      self.bot.drain()
+      self.bot.mentions_fail = False
+      self.tick()
+      self.bot.drain()
+
+      # the failure is logged, and neither the other feeds nor the next update are affected
+      self.assertEqual(len(self.calls('on_mentions')),2)
+      self.assertEqual(len(self.calls('on_home_timeline')),2)
+      self.bot._log.pipeline.close()
+      failures = [record for record in map(json.loads,self.output.getvalue().splitlines())
+                  if record['event'] == 'hook_failed']
+      self.assertEqual(len(failures),1)
+      self.assertEqual(failures[0]['hook'],'on_mentions')
+      self.assertIn("ValueError: broken hook",failures[0]['exception'])
+
+if __name__ == "__main__":
+   # run unit tests
+   unittest.main()
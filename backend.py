@@ -0,0 +1,133 @@
+'''
+Interface of the twitter API backend a bot talks to.
+'''
+
+import abc
+
+import twitter
+
+# methods every backend implements
+REQUIRED_METHODS=('VerifyCredentials','GetHomeTimeline','GetReplies','GetMentions',
+   'GetDirectMessages','GetUserTimeline','PostUpdate')
+
+# capabilities a backend can declare, each of which adds methods to the interface.  A backend has at
+# least one way of posting media: uploading media separately from posting (python-twitter 3.0+), or
+# posting media directly (older versions)
+UPLOAD_MEDIA='upload_media'
+POST_MEDIA='post_media'
+CAPABILITY_METHODS={UPLOAD_MEDIA:('UploadMediaSimple','UploadMediaChunked'),
+                    POST_MEDIA:('PostMedia','PostMultipleMedia')}
+
+class BackendError(Exception):
+   '''Raised for an object that cannot be used as a backend'''
+
+   @property
+   def message(self):
+      '''Returns the first argument used to construct this error.'''
+      return self.args[0]
+
+class Backend(object):
+   '''
+   The calls a bot makes to the twitter API.  python-twitter's twitter.Api (the default backend)
+   implements them; other backends (e.g. fakeapi.FakeApi) subclass Backend and implement the same
+   methods with the same arguments and results: lists of twitter.Status / twitter.DirectMessage
+   objects, newest first, for the timelines, and the posted twitter.Status for posts.  Errors are
+   raised as twitter.TwitterError, with the API's error codes.
+
+   The media methods depend on the backend's capabilities, which it lists in its capabilities
+   attribute:
+
+      UPLOAD_MEDIA -- UploadMediaSimple(media) and UploadMediaChunked(media) upload an image (a
+                      filename or file-like object) and return its media ID, which is then passed
+                      to PostUpdate
+      POST_MEDIA   -- PostMedia(status,media,in_reply_to_status_id=None) and
+                      PostMultipleMedia(status,media,in_reply_to_status_id=None) post a status with
+                      one image or a list of images
+
+   Backends may also keep the API's rate limit state in a rate_limit attribute, as twitter.Api does
+   (see ratelimit.RequestBudgeter.update_from_api).
+   '''
+   __metaclass__=abc.ABCMeta
+
+   # capabilities (keys of CAPABILITY_METHODS) of this backend
+   capabilities=frozenset()
+
+   @abc.abstractmethod
+   def VerifyCredentials(self):
+      '''Returns the twitter.User the backend is authenticated as.'''
+
+   @abc.abstractmethod
+   def GetHomeTimeline(self,count=None,since_id=None,max_id=None):
+      pass
+
+   @abc.abstractmethod
+   def GetReplies(self,since_id=None,count=None,max_id=None):
+      pass
+
+   @abc.abstractmethod
+   def GetMentions(self,count=None,since_id=None,max_id=None):
+      pass
+
+   @abc.abstractmethod
+   def GetDirectMessages(self,since_id=None,max_id=None,count=None):
+      pass
+
+   @abc.abstractmethod
+   def GetUserTimeline(self,user_id=None,screen_name=None,since_id=None,max_id=None,count=None):
+      pass
+
+   @abc.abstractmethod
+   def PostUpdate(self,status,media=None,in_reply_to_status_id=None):
+      '''Posts a status, with the media IDs of uploaded media if given.'''
+
+# twitter.Api cannot declare its capabilities, which depend on the version of python-twitter
+# installed: the media methods it has
+TWITTER_API_CAPABILITIES=frozenset(capability for capability,methods in CAPABILITY_METHODS.items()
+   if all(hasattr(twitter.Api,method) for method in methods))
+Backend.register(twitter.Api)
+
+def capabilities(api):
+   '''
+   Returns the capabilities of a backend.
+   '''
+   if isinstance(api,twitter.Api):
+      return TWITTER_API_CAPABILITIES
+   return frozenset(getattr(api,'capabilities',()))
+
+def uploads_media(api):
+   '''
+   Returns whether a backend uploads media separately from posting.
+   '''
+   return UPLOAD_MEDIA in capabilities(api)
+
+def missing_methods(api):
+   '''
+   Returns the names of the backend methods that an API object is missing: required methods, and
+   the methods of the capabilities it declares.
+   '''
+   methods=list(REQUIRED_METHODS)
+   for capability in sorted(capabilities(api)):
+      methods.extend(CAPABILITY_METHODS.get(capability,()))
+   return [method for method in methods if not callable(getattr(api,method,None))]
+
+def create(oauth_config=None,api_backend=None):
+   '''
+   Returns the backend a bot should use: api_backend if given (after checking that it implements
+   the Backend interface and a way of posting media), or else a twitter.Api authenticated with
+   oauth_config.
+   '''
+   if api_backend is None:
+      return twitter.Api(**(oauth_config or {}))
+   if not isinstance(api_backend,Backend):
+      raise BackendError("API backend does not implement backend.Backend: {0!r}".format(
+         api_backend))
+   unknown=capabilities(api_backend)-set(CAPABILITY_METHODS)
+   if unknown:
+      raise BackendError("API backend declares unknown capabilities: {0}".format(
+         ", ".join(sorted(unknown))))
+   if not capabilities(api_backend):
+      raise BackendError("API backend declares no way of posting media")
+   missing=missing_methods(api_backend)
+   if missing:
+      raise BackendError("API backend is missing methods: {0}".format(", ".join(missing)))
+   return api_backend
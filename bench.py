@@ -0,0 +1,359 @@
+'''
+Benchmark suite for the bot's hot paths, run on a synthetic (or recorded) status corpus, with
+machine-readable baselines to catch regressions.
+
+   python bench.py [--corpus FILE] [--record FILE] [--save FILE] [--compare FILE]
+                   [--tolerance 0.25] [--filter TEXT]
+
+--save writes the results (seconds per call of each case) as a JSON baseline; --compare runs the
+suite against a saved baseline and exits with status 1 if any case got slower than the baseline by
+more than the tolerance.  The synthetic corpus is generated by fakeapi.FakeApi from a fixed seed,
+so runs are comparable; --record saves it, and --corpus runs on a saved (or recorded) corpus, a
+JSON object of 'mentions' and 'home' lists of statuses as the API returns them.
+'''
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+import twitter
+
+import benchutils
+import botlog
+import command
+import command_bench
+import duration
+import duration_bench
+import fakeapi
+import imagebot
+import metrics
+import ratelimit
+import statusindex
+import storage
+import testutils
+import timeutils
+import timeutils_bench
+from twitterbot import LastIds, TwitterBot
+
+# screen name of the bot in the corpus, and of the boss sending commands
+BOT_NAME="benchbot"
+BOSS_NAME="boss"
+# number of watched timelines and size of the mention batch in the tick benchmark
+WATCHED_TIMELINES=10
+MENTION_BATCH=200
+# number of commands in the command throughput benchmark
+COMMAND_BATCH=100
+
+@command.register("benchnoop")
+def benchnoop(bot):
+   return None
+
+def synthetic_corpus(mentions=MENTION_BATCH,home=MENTION_BATCH,seed=1):
+   '''
+   Returns a corpus of synthetic statuses: a dictionary of 'mentions' and 'home' lists of
+   twitter.Status, newest first, created during the last hour.
+   '''
+   clock=[time.time()-3600]
+   api=fakeapi.FakeApi(screen_name=BOT_NAME,rates={'home':1.0,'mentions':1.0},seed=seed,
+      enforce_rate_limits=False,clock=lambda: clock[0])
+   corpus={'mentions':[],'home':[]}
+   while len(corpus['mentions']) < mentions or len(corpus['home']) < home:
+      clock[0]+=1.0
+      corpus['mentions'][:0]=api.GetMentions(count=fakeapi.MAX_COUNT,
+         since_id=corpus['mentions'][0].id if corpus['mentions'] else None)
+      corpus['home'][:0]=api.GetHomeTimeline(count=fakeapi.MAX_COUNT,
+         since_id=corpus['home'][0].id if corpus['home'] else None)
+   return {'mentions':corpus['mentions'][:mentions],'home':corpus['home'][:home]}
+
+def save_corpus(corpus,filename):
+   with open(filename,'w') as f:
+      json.dump(dict((name,[status.AsDict() for status in statuses])
+         for name,statuses in corpus.items()),f)
+
+def load_corpus(filename):
+   with open(filename) as f:
+      data=json.load(f)
+   return dict((name,[twitter.Status.NewFromJsonDict(status) for status in statuses])
+      for name,statuses in data.items())
+
+class CorpusApi(fakeapi.FakeApi):
+   '''
+   Fake API serving a fixed corpus: mentions and the home timeline return the corpus statuses, and
+   every watched timeline returns the newest home statuses.
+   '''
+
+   def __init__(self,corpus):
+      super(CorpusApi,self).__init__(screen_name=BOT_NAME,rates={'home':0,'mentions':0},
+         enforce_rate_limits=False)
+      self.corpus=corpus
+
+   def GetMentions(self,count=None,since_id=None,**kwargs):
+      self._call('GetMentions')
+      return self.corpus['mentions']
+
+   def GetHomeTimeline(self,count=None,since_id=None,**kwargs):
+      self._call('GetHomeTimeline')
+      return self.corpus['home']
+
+   def GetUserTimeline(self,screen_name=None,count=None,**kwargs):
+      self._call('GetUserTimeline')
+      return self.corpus['home'][:count or 1]
+
+def unlimited_rate_limits():
+   '''
+   Rate limits no benchmark runs out of.  Each case repeats an update thousands of times, which
+   would use up any real window; one update's worth of calls under the default limits is covered
+   by ratelimit_test.
+   '''
+   return dict((resource,(10**9,window)) for resource,(_,window) in
+      ratelimit.DEFAULT_LIMITS.items())
+
+def make_bot(bot_class,api,directory,**kwargs):
+   return testutils.make_bot(bot_class,api,directory,bosses=[BOSS_NAME],
+      rate_limits=unlimited_rate_limits(),**kwargs)
+
+class TickBot(TwitterBot):
+   def on_subclass_init(self,**kwargs):
+      self._do_process_home_timeline=True
+      self._watched_timelines=[("user{0}".format(i),20) for i in range(WATCHED_TIMELINES)]
+
+def tick_cases(corpus,directory):
+   '''
+   Per-update latency with WATCHED_TIMELINES watched timelines and a batch of MENTION_BATCH new
+   mentions (and as many home statuses) each update, with metrics disabled (the default) and
+   recorded.
+   '''
+   results=[]
+   for label,registry in (("",None),(", metrics",metrics.Registry())):
+      bot=make_bot(TickBot,CorpusApi(corpus),directory,metrics_registry=registry)
+      bot.start()
+      def tick():
+         # every update sees the whole corpus as new
+         bot._last_ids=LastIds()
+         bot._processed=statusindex.ProcessedIndex()
+         bot.tick()
+      try:
+         results.append(("tick: {0} watched, {1} mentions{2}".format(WATCHED_TIMELINES,
+            len(corpus['mentions']),label),benchutils.best_time(tick,repeat=3)))
+      finally:
+         bot.shutdown()
+   return results
+
+def command_cases(corpus,directory):
+   '''
+   Throughput of process_commands: seconds per command for a batch of commands from a boss, from
+   submission until every command has run and its reply (if any) is queued.
+   '''
+   bot=make_bot(TwitterBot,CorpusApi(corpus),directory)
+   bot.start()
+   boss=twitter.User(id=1,screen_name=BOSS_NAME)
+   commands=[]
+   for status in corpus['mentions'][:COMMAND_BATCH]:
+      commands.append(twitter.Status(id=status.id,created_at=status.created_at,user=boss,
+         text=u"@{0} ctl benchnoop".format(BOT_NAME)))
+   def process():
+      bot.process_commands(commands)
+      bot._command_engine.wait()
+   try:
+      return [("process_commands, per command",
+         benchutils.best_time(process,repeat=3)/len(commands))]
+   finally:
+      bot.shutdown()
+
+def parse_cases(corpus):
+   '''
+   Parse cost of the command path on the corpus mention texts, per text.
+   '''
+   texts=[status.text for status in corpus['mentions']]
+   command_texts=[u"@{0} @other ctl benchnoop".format(BOT_NAME)]*len(texts)
+   bot=TwitterBot.__new__(TwitterBot)
+   results=[]
+   results.append(("strip_at_symbols, per text",
+      benchutils.best_time(lambda: [bot.strip_at_symbols(t) for t in texts])/len(texts)))
+   results.append(("tokenize, per text",
+      benchutils.best_time(lambda: [command.tokenize(t) for t in texts])/len(texts)))
+   results.append(("tokenize + CommandFactory.create, per command",
+      benchutils.best_time(lambda: [command.CommandFactory.create(command.tokenize(t),None)
+         for t in command_texts])/len(command_texts)))
+   return results
+
+def time_cases(corpus):
+   statuses=corpus['mentions']
+   timestamp=statuses[0].created_at
+   return [("time_since",benchutils.best_time(lambda: timeutils.time_since(timestamp))),
+           ("actionable cutoff of {0} statuses".format(len(statuses)),
+            benchutils.best_time(lambda: timeutils.newer_than(statuses,time.time()-6*3600)))]
+
+def duration_cases():
+   return [("Duration: "+name,benchutils.best_time(function))
+      for name,function in duration_bench.cases(duration)]
+
+def metrics_cases():
+   '''
+   Cost of timing a block with metrics disabled (the bot's default) and recorded.
+   '''
+   def timed(registry):
+      def run():
+         with registry.timer('bench_seconds',stage='bench'):
+            pass
+      return run
+   return [("metrics timer, disabled",benchutils.best_time(timed(metrics.NULL_REGISTRY))),
+           ("metrics timer, recorded",benchutils.best_time(timed(metrics.Registry())))]
+
+def log_cases():
+   '''
+   Cost to the caller of logging a record (formatting and writing happen on the writer thread),
+   and of a record dropped by sampling.
+   '''
+   with open(os.devnull,'w') as devnull:
+      log=botlog.open_log(devnull,sampling={'status':10**9},queue_size=10**7).bind(bot=BOT_NAME)
+      try:
+         return [("log record, queued",benchutils.best_time(lambda: log.info('command',
+                     words=["benchnoop"],user=BOSS_NAME,status_id=1))),
+                 ("log record, sampled out",benchutils.best_time(lambda: log.debug('status',
+                     header="Mentions",index=1,user=BOSS_NAME,id=1,text=u"text")))]
+      finally:
+         log.pipeline.close()
+
+def storage_cases(directory):
+   '''
+   Saving and loading the largest state a bot keeps: a full processed status index.
+   '''
+   index=statusindex.ProcessedIndex()
+   ids=itertools.count(10**17)
+   for feed in ('home','mentions','dms'):
+      index.claim(feed,[twitter.Status(id=next(ids)) for _ in range(index._capacity)])
+   data=dict((name,feed.to_data()) for name,feed in index._feeds.items())
+   results=[]
+   for format in sorted(storage.SERIALIZERS):
+      filename=os.path.join(directory,"index.{0}".format(format))
+      results.append(("storage save ({0}, 15000 IDs)".format(format),
+         benchutils.best_time(lambda: storage.save_data(data,filename,format=format),repeat=3)))
+      with open(filename,'rb') as f:
+         source=f.read()
+      results.append(("storage parse ({0}, 15000 IDs)".format(format),
+         benchutils.best_time(lambda: storage.parse_data(source),repeat=3)))
+   results.append(("storage load (unchanged file, cached)",
+      benchutils.best_time(lambda: storage.load_data(filename))))
+   return results
+
+class BenchImageBot(imagebot.ImageBot):
+   def on_subclass_init(self,**kwargs):
+      super(BenchImageBot,self).on_subclass_init(**kwargs)
+      self._counter=itertools.count()
+
+   def generate(self):
+      from PIL import Image
+      # a different image each time, so that the media cache does not skip the upload
+      n=next(self._counter)
+      image=Image.new('RGB',(256,256),(n%256,(n//256)%256,128))
+      return (image,"benchmark image {0}".format(n))
+
+def imagebot_cases(corpus,directory):
+   '''
+   ImageBot.generate_and_tweet end to end: generating, encoding, uploading and posting an image.
+   Skipped if PIL is not installed.
+   '''
+   try:
+      import PIL
+   except ImportError:
+      return []
+   bot=make_bot(BenchImageBot,CorpusApi(corpus),directory)
+   bot.start()
+   # keep the post handles, to wait until each post has been sent
+   handles=[]
+   tweet_image=bot.tweet_image
+   bot.tweet_image=lambda media,message: handles.append(tweet_image(media,message))
+   def run():
+      bot.generate_and_tweet()
+      handles.pop().wait()
+   try:
+      return [("ImageBot.generate_and_tweet",benchutils.best_time(run,repeat=3))]
+   finally:
+      bot.shutdown()
+
+def run(corpus=None,filter=None):
+   '''
+   Runs the suite, returning a list of (name, seconds per call).
+   '''
+   if corpus is None:
+      corpus=synthetic_corpus()
+   directory=tempfile.mkdtemp(prefix="bench-")
+   for subdirectory in ("tick","commands","imagebot"):
+      os.makedirs(os.path.join(directory,subdirectory))
+   suites=[
+      ("tick",lambda: tick_cases(corpus,os.path.join(directory,"tick"))),
+      ("commands",lambda: command_cases(corpus,os.path.join(directory,"commands"))),
+      ("parse",lambda: parse_cases(corpus)),
+      ("parse (vs legacy)",lambda: [(name,seconds) for name,seconds,_ in command_bench.run()]),
+      ("time",lambda: time_cases(corpus)),
+      ("timeutils",lambda: [(name,seconds) for name,seconds,_ in timeutils_bench.run()]),
+      ("duration",duration_cases),
+      ("metrics",metrics_cases),
+      ("log",log_cases),
+      ("storage",lambda: storage_cases(directory)),
+      ("imagebot",lambda: imagebot_cases(corpus,os.path.join(directory,"imagebot"))),
+   ]
+   results=[]
+   try:
+      for name,suite in suites:
+         if filter is None or filter in name:
+            results.extend(suite())
+   finally:
+      shutil.rmtree(directory,ignore_errors=True)
+   return results
+
+def save_baseline(results,filename):
+   with open(filename,'w') as f:
+      json.dump({'python':platform.python_version(),'platform':platform.platform(),
+                 'created':time.strftime('%Y-%m-%dT%H:%M:%SZ',time.gmtime()),
+                 'results':dict(results)},f,indent=1,sort_keys=True)
+
+def load_baseline(filename):
+   with open(filename) as f:
+      return json.load(f)['results']
+
+def regressions(results,baseline,tolerance=0.25):
+   '''
+   Returns the (name, seconds, baseline seconds) of the cases that are slower than the baseline by
+   more than the tolerance (a fraction of the baseline time).
+   '''
+   return [(name,seconds,baseline[name]) for name,seconds in results
+      if name in baseline and seconds > baseline[name]*(1.0+tolerance)]
+
+def main(argv):
+   parser=argparse.ArgumentParser(description="Benchmarks of the bot's hot paths")
+   parser.add_argument('--corpus',help="run on a saved corpus instead of the synthetic one")
+   parser.add_argument('--record',help="save the corpus to this file")
+   parser.add_argument('--save',help="save the results as a baseline to this file")
+   parser.add_argument('--compare',help="compare the results against this baseline file")
+   parser.add_argument('--tolerance',type=float,default=0.25,
+      help="fraction by which a case may be slower than its baseline")
+   parser.add_argument('--filter',help="only run the suites whose name contains this text")
+   args=parser.parse_args(argv)
+
+   corpus=load_corpus(args.corpus) if args.corpus else synthetic_corpus()
+   if args.record:
+      save_corpus(corpus,args.record)
+   results=run(corpus,args.filter)
+   baseline=load_baseline(args.compare) if args.compare else {}
+   benchutils.print_results("bench",[(name,seconds,baseline.get(name))
+      for name,seconds in results])
+   if args.save:
+      save_baseline(results,args.save)
+   if args.compare:
+      slower=regressions(results,baseline,args.tolerance)
+      for name,seconds,base in slower:
+         print "REGRESSION: {0}: {1} (baseline {2})".format(name,benchutils.format_time(seconds),
+            benchutils.format_time(base))
+      return 1 if slower else 0
+   return 0
+
+if __name__ == "__main__":
+   sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,37 @@
+'''
+Helpers for the *_bench.py micro-benchmarks.
+'''
+
+import timeit
+
+def best_time(function,repeat=5,min_time=0.2):
+   '''
+   Returns the best time per call, in seconds, of a function taking no arguments over repeat runs.
+   Each run calls the function enough times to take at least min_time seconds.
+   '''
+   timer=timeit.Timer(function)
+   number=1
+   elapsed=timer.timeit(number)
+   while elapsed < min_time:
+      # scale up from the last run (by at most 10x), so that slow functions do not overshoot
+      number=int(number*min(10.0,1.2*min_time/max(elapsed,1e-9)))+1
+      elapsed=timer.timeit(number)
+   return min(timer.repeat(repeat,number))/number
+
+def format_time(seconds):
+   for unit,scale in (('s',1.0),('ms',1.0e3),('us',1.0e6)):
+      if seconds*scale >= 1.0:
+         return "{0:.3f} {1}".format(seconds*scale,unit)
+   return "{0:.1f} ns".format(seconds*1.0e9)
+
+def print_results(title,results):
+   '''
+   Prints a table of benchmark results, given as a list of (name, seconds per call, baseline
+   seconds per call or None).
+   '''
+   print "="*20,title,"="*20
+   for name,seconds,baseline in results:
+      line="{0:<40} {1:>12}".format(name,format_time(seconds))
+      if baseline is not None:
+         line+="   (baseline {0}, {1:.1f}x)".format(format_time(baseline),baseline/seconds)
+      print line
@@ -0,0 +1,130 @@
+'''
+Runs many twitter bots in a single process
+'''
+
+import heapq
+import itertools
+import threading
+from multiprocessing.pool import ThreadPool
+
+import storage
+import timeutils
+
+class BotHostError(Exception):
+   '''Base class for bot host errors'''
+
+   @property
+   def message(self):
+      '''Returns the first argument used to construct this error.'''
+      return self.args[0]
+
+class BotHost(object):
+   '''
+   Hosts any number of TwitterBot (or ImageBot, etc.) instances and runs all of their updates from
+   one shared scheduler, instead of each bot sleeping in its own run loop and process.
+
+   Updates are run on a shared pool of tick workers, and all bots fetch their feeds on one shared
+   fetch pool.  A single bot never runs two updates at the same time.  Each bot keeps its own last
+   IDs file, processed status index, post queue, media cache and allowed bosses list; registering
+   two bots that would write the same state file (see TwitterBot.state_files) is an error.  Giving
+   all bots the same state store (see sqlitestore) keeps their state apart automatically.
+
+   Example:
+
+      host = BotHost()
+      store = SqliteStore("bots.db")
+      host.add(MyBot("mybot.oauth",state_store=store))
+      host.add(MyOtherBot("otherbot.oauth",state_store=store))
+      host.run()
+   '''
+
+   def __init__(self,tick_workers=4,fetch_workers=8):
+      # number of bot updates that can run at the same time
+      self._tick_workers=tick_workers
+      # number of threads shared by all bots for fetching feeds
+      self._fetch_workers=fetch_workers
+      # registered bots
+      self._bots=[]
+      # whether or not the host should keep running
+      self._running=False
+      # guards the schedule; notified whenever an update finishes
+      self._condition=threading.Condition()
+
+   def add(self,bot):
+      '''
+      Registers a bot with this host.  Bots must be added before the host is run.
+      '''
+      for other in self._bots:
+         other_files=other.state_files()
+         for description,target in bot.state_files().items():
+            if storage.target_id(other_files[description]) == storage.target_id(target):
+               raise BotHostError("Bots {0} and {1} both use {2} file '{3}'".format(
+                  other._me.screen_name,bot._me.screen_name,description,target))
+      self._bots.append(bot)
+
+   def run(self):
+      '''
+      Runs updates for all registered bots until every bot has stopped or stop() is called.
+      '''
+      self._running=True
+      fetch_pool=ThreadPool(self._fetch_workers)
+      tick_pool=ThreadPool(self._tick_workers)
+      # heap of (next update time, tie breaker, bot)
+      schedule=[]
+      counter=itertools.count()
+      active=[0]
+
+      def tick(bot):
+         try:
+            bot.tick()
+         except Exception:
+            # one broken bot should not take down the others
+            bot._log.exception('update_failed',"update failed; stopping the bot")
+            bot._running=False
+
+         with self._condition:
+            stopped=not (bot._running and self._running)
+            if not stopped:
+               heapq.heappush(schedule,(bot.schedule_next_tick(),next(counter),bot))
+         if stopped:
+            # outside the lock: shutting down waits for the bot's commands and posts, while the
+            # scheduler and the other bots' updates carry on
+            bot.shutdown()
+         with self._condition:
+            active[0]-=1
+            self._condition.notify()
+
+      now=timeutils.monotonic()
+      for bot in self._bots:
+         bot.start(fetch_pool)
+         heapq.heappush(schedule,(now,next(counter),bot))
+
+      try:
+         with self._condition:
+            while self._running and (schedule or active[0] > 0):
+               now=timeutils.monotonic()
+               while schedule and schedule[0][0] <= now:
+                  bot=heapq.heappop(schedule)[2]
+                  active[0]+=1
+                  tick_pool.apply_async(tick,(bot,))
+
+               # wake up periodically so that a keyboard interrupt is not blocked
+               timeout=1.0
+               if schedule:
+                  timeout=min(timeout,schedule[0][0]-now)
+               self._condition.wait(max(timeout,0.0))
+      finally:
+         self._running=False
+         tick_pool.close()
+         tick_pool.join()
+         for _,_,bot in schedule:
+            bot.shutdown()
+         fetch_pool.terminate()
+
+   def stop(self):
+      '''
+      Stops the host once the updates currently running have finished.
+      '''
+      with self._condition:
+         self._running=False
+         self._condition.notify()
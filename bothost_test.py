@@ -0,0 +1,130 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from StringIO import StringIO
+import botlog
+import fakeapi
+from bothost import BotHost, BotHostError
+from duration import Duration
+from testutils import make_bot
+from twitterbot import TwitterBot
+
+class CountingBot(TwitterBot):
+   '''
+   Bot that counts its updates, checks that they never overlap and records whether the host's
+   lock was free when it was shut down.
+   '''
+   def on_subclass_init(self,host=None,fail=False,**kwargs):
+      self.host = host
+      self.fail = fail
+      self.updates = 0
+      self.overlapped = False
+      self.updating = False
+      self.shutdowns = 0
+      self.lock_free_at_shutdown = None
+
+   def on_update_start(self):
+      if self.updating:
+         self.overlapped = True
+      self.updating = True
+      if self.fail:
+         self.updating = False
+         raise ValueError("broken bot")
+
+   def on_update_end(self):
+      self.updates += 1
+      self.updating = False
+
+   def shutdown(self):
+      self.shutdowns += 1
+      free = []
+      # try the lock from another thread, since the host's lock is reentrant
+      def try_lock():
+         acquired = self.host._condition.acquire(False)
+         if acquired:
+            self.host._condition.release()
+         free.append(acquired)
+      checker = threading.Thread(target=try_lock)
+      checker.start()
+      checker.join()
+      self.lock_free_at_shutdown = free[0]
+      TwitterBot.shutdown(self)
+
+class TestBotHost(unittest.TestCase):
+   def setUp(self):
+      self.directory = tempfile.mkdtemp()
+      self.host = BotHost(tick_workers=2,fetch_workers=2)
+
+   def tearDown(self):
+      shutil.rmtree(self.directory)
+
+   def bot(self,name,**kwargs):
+      directory = os.path.join(self.directory,name)
+      os.mkdir(directory)
+      api = fakeapi.FakeApi(screen_name=name,rates={'home':0,'mentions':1},seed=1)
+      return make_bot(CountingBot,api,directory,host=self.host,
+         check_period=Duration(milliseconds=20),**kwargs)
+
+   def run_until(self,condition,timeout=10):
+      thread = threading.Thread(target=self.host.run)
+      thread.start()
+      try:
+         deadline = time.time()+timeout
+         while not condition() and time.time() < deadline:
+            time.sleep(0.01)
+      finally:
+         self.host.stop()
+         thread.join(timeout)
+      self.assertFalse(thread.is_alive())
+
+   def test_scheduling(self):
+      bots = [self.bot("bot1"),self.bot("bot2"),self.bot("bot3")]
+      for bot in bots:
+         self.host.add(bot)
+      self.run_until(lambda: all(bot.updates >= 3 for bot in bots))
+      for bot in bots:
+         self.assertTrue(bot.updates >= 3)
+         self.assertFalse(bot.overlapped)
+
+   def test_shared_state_files(self):
+      self.host.add(self.bot("bot1"))
+      api = fakeapi.FakeApi(screen_name="bot2",seed=1)
+      with self.assertRaises(BotHostError):
+         self.host.add(make_bot(CountingBot,api,os.path.join(self.directory,"bot1")))
+
+   def test_shutdown(self):
+      bots = [self.bot("bot1"),self.bot("bot2")]
+      for bot in bots:
+         self.host.add(bot)
+      self.run_until(lambda: all(bot.updates >= 1 for bot in bots))
+      for bot in bots:
+         self.assertEqual(bot.shutdowns,1)
+         self.assertTrue(bot.lock_free_at_shutdown)
+         self.assertFalse(bot._running)
+
+   def test_failure_isolation(self):
+      output = StringIO()
+      log = botlog.open_log(output)
+      broken = self.bot("broken",fail=True,log=log)
+      working = self.bot("working")
+      self.host.add(broken)
+      self.host.add(working)
+      self.run_until(lambda: working.updates >= 3)
+      log.pipeline.close()
+
+      # the broken bot is stopped and shut down (outside the host's lock) after its first update,
+      # while the other bot keeps running
+      self.assertTrue(working.updates >= 3)
+      self.assertEqual(broken.updates,0)
+      self.assertEqual(broken.shutdowns,1)
+      self.assertTrue(broken.lock_free_at_shutdown)
+      events = [json.loads(line)['event'] for line in output.getvalue().splitlines()]
+      self.assertEqual(events.count('update_failed'),1)
+
+if __name__ == "__main__":
+   # run unit tests
+   unittest.main()
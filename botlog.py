@@ -0,0 +1,308 @@
+'''
+Structured logging that never blocks the caller.
+
+Log records go into a queue; a background thread turns them into JSON lines and writes them to a
+file (rotated by size) or a stream.  The calling thread only checks the level and sampling and
+queues the record, so a slow disk or a full pipe holds up the writer thread rather than the bot.
+
+   log = botlog.open_log("bot.log",max_bytes=10*1024*1024,sampling={'status':100})
+   log = log.bind(bot="mybot")
+   log.info('command',words=["sleep","5m"],user="boss")
+
+writes lines like
+
+   {"time": 1500000000.123, "level": "info", "event": "command", "bot": "mybot", ...}
+'''
+
+import atexit
+import collections
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+import traceback
+
+# log levels
+DEBUG=10
+INFO=20
+WARNING=30
+ERROR=40
+LEVEL_NAMES={DEBUG:'debug',INFO:'info',WARNING:'warning',ERROR:'error'}
+# number of records the queue holds before new records are dropped
+DEFAULT_QUEUE_SIZE=10000
+
+class RotatingFile(object):
+   '''
+   Append-only log file that is rotated once it would grow past max_bytes: filename becomes
+   filename.1, filename.1 becomes filename.2 and so on, keeping up to backups old files.  With
+   max_bytes of None the file is never rotated.
+   '''
+
+   def __init__(self,filename,max_bytes=None,backups=3):
+      self.filename=filename
+      self.max_bytes=max_bytes
+      self.backups=backups
+      self._file=open(filename,'ab')
+      self._size=self._file.tell()
+
+   def write(self,data):
+      if self.max_bytes is not None and self._size > 0 and self._size+len(data) > self.max_bytes:
+         self.rotate()
+      self._file.write(data)
+      self._size+=len(data)
+
+   def rotate(self):
+      self._file.close()
+      if self.backups > 0:
+         for index in range(self.backups-1,0,-1):
+            older="{0}.{1}".format(self.filename,index)
+            if os.path.exists(older):
+               os.rename(older,"{0}.{1}".format(self.filename,index+1))
+         os.rename(self.filename,self.filename+".1")
+         self._file=open(self.filename,'ab')
+      else:
+         self._file=open(self.filename,'wb')
+      self._size=0
+
+   def flush(self):
+      self._file.flush()
+
+   def close(self):
+      self._file.close()
+
+class FlushRequest(object):
+   '''
+   Queued behind the records to flush; the writer sets done once it reaches it.
+   '''
+   def __init__(self):
+      self.done=threading.Event()
+
+class LogPipeline(object):
+   '''
+   Queue of log records and the background thread that writes them.
+
+   Records below level are ignored.  sampling maps event names to n, to write only one in every n
+   records of that event (e.g. per-status debug dumps); sampled records carry a 'sampled' field
+   with n.  If the writer falls behind and the queue fills up, records are dropped rather than
+   blocking the caller, and a 'log_dropped' record with their number is written once it catches
+   up.
+
+   output is a filename (rotated as a RotatingFile, with max_bytes and backups) or a file-like
+   object (sys.stdout by default).
+   '''
+
+   def __init__(self,output=None,level=DEBUG,sampling=None,max_bytes=None,backups=3,
+         queue_size=DEFAULT_QUEUE_SIZE):
+      if output is None:
+         output=sys.stdout
+      if isinstance(output,basestring):
+         output=RotatingFile(output,max_bytes,backups)
+      self._output=output
+      self.level=level
+      self.sampling=dict(sampling or {})
+      # counters choosing which records of each sampled event are written
+      self._samples=collections.defaultdict(itertools.count)
+      # queued records.  deque appends and pops are atomic, so callers queue a record without taking
+      # a lock; the writer is only woken (through the event) when it has run out of records
+      self._records=collections.deque()
+      self._queue_size=queue_size
+      self._writer_idle=False
+      self._wakeup=threading.Event()
+      self._lock=threading.Lock()
+      # number of records written, and dropped because the queue was full
+      self.written=0
+      self.dropped=0
+      self._dropped_reported=0
+      self._closed=False
+      self._thread=threading.Thread(target=self._run,name="log writer")
+      self._thread.daemon=True
+      self._thread.start()
+
+   def submit(self,level,event,message,context,fields,exc_info=None):
+      '''
+      Queues a record, unless its level or sampling rule it out.  Never blocks.
+      '''
+      if level < self.level:
+         return
+      every=self.sampling.get(event)
+      if every is not None:
+         if next(self._samples[event])%every:
+            return
+         fields=dict(fields,sampled=every)
+      if len(self._records) >= self._queue_size:
+         with self._lock:
+            self.dropped+=1
+         return
+      self._records.append((time.time(),level,event,message,context,fields,exc_info))
+      if self._writer_idle:
+         self._wakeup.set()
+
+   def _put(self,item):
+      self._records.append(item)
+      self._wakeup.set()
+
+   def _next(self):
+      # returns the next queued item, waiting for one if there is none
+      while True:
+         try:
+            return self._records.popleft()
+         except IndexError:
+            pass
+         self._flush_output()
+         self._writer_idle=True
+         self._wakeup.clear()
+         # a record queued before the flag was set did not wake the writer
+         if not self._records:
+            self._wakeup.wait()
+         self._writer_idle=False
+
+   def flush(self,timeout=None):
+      '''
+      Waits up to timeout seconds (forever if None) until the records queued so far are written.
+      Returns whether they were.
+      '''
+      if self._closed:
+         return True
+      request=FlushRequest()
+      self._put(request)
+      return request.done.wait(timeout)
+
+   def close(self,timeout=None):
+      '''
+      Writes the records queued so far (waiting up to timeout seconds) and stops the writer.
+      '''
+      if self._closed:
+         return
+      self._closed=True
+      self._put(None)
+      self._thread.join(timeout)
+
+   def _run(self):
+      while True:
+         record=self._next()
+         if record is None:
+            break
+         if isinstance(record,FlushRequest):
+            self._flush_output()
+            record.done.set()
+            continue
+         try:
+            line=format_record(*record)
+         except Exception,e:
+            # e.g. a byte string that is not UTF-8; keep what can be kept
+            line=format_record(record[0],record[1],record[2],repr(record[3]),None,
+               {'fields':repr(record[5]),'format_error':repr(e)})
+         self._write(line)
+         with self._lock:
+            dropped=self.dropped-self._dropped_reported
+            self._dropped_reported=self.dropped
+         if dropped:
+            self._write(format_record(time.time(),WARNING,'log_dropped',None,None,
+               {'count':dropped}))
+      self._flush_output()
+      if isinstance(self._output,RotatingFile):
+         self._output.close()
+
+   def _write(self,line):
+      try:
+         self._output.write(line)
+         self.written+=1
+      except Exception:
+         # there is nowhere left to report the error; the record is lost
+         pass
+
+   def _flush_output(self):
+      try:
+         self._output.flush()
+      except Exception:
+         pass
+
+def format_record(created,level,event,message,context,fields,exc_info=None):
+   '''
+   Returns a record as a line of JSON.  Values that are not JSON serializable are written as their
+   repr().
+   '''
+   record=collections.OrderedDict()
+   record['time']=round(created,6)
+   record['level']=LEVEL_NAMES.get(level,level)
+   record['event']=event
+   if message is not None:
+      record['message']=message
+   if context:
+      record.update(context)
+   if fields:
+      record.update(fields)
+   if exc_info is not None:
+      record['exception']="".join(traceback.format_exception(*exc_info))
+   return json.dumps(record,default=repr)+"\n"
+
+class Logger(object):
+   '''
+   Writes records to a LogPipeline, each with the logger's context fields (e.g. the bot's screen
+   name) added.  bind() returns a logger with more context.
+   '''
+
+   def __init__(self,pipeline,context=None):
+      self.pipeline=pipeline
+      self.context=context or {}
+
+   def bind(self,**context):
+      '''
+      Returns a logger writing to the same pipeline with more context fields.
+      '''
+      merged=dict(self.context)
+      merged.update(context)
+      return Logger(self.pipeline,merged)
+
+   def enabled_for(self,level):
+      '''
+      Returns whether records of a level are written, so that callers can skip preparing them.
+      '''
+      return level >= self.pipeline.level
+
+   def log(self,level,event,message=None,**fields):
+      self.pipeline.submit(level,event,message,self.context,fields)
+
+   def debug(self,event,message=None,**fields):
+      self.pipeline.submit(DEBUG,event,message,self.context,fields)
+
+   def info(self,event,message=None,**fields):
+      self.pipeline.submit(INFO,event,message,self.context,fields)
+
+   def warning(self,event,message=None,**fields):
+      self.pipeline.submit(WARNING,event,message,self.context,fields)
+
+   def error(self,event,message=None,**fields):
+      self.pipeline.submit(ERROR,event,message,self.context,fields)
+
+   def exception(self,event,message=None,**fields):
+      '''
+      Logs an error with the traceback of the exception being handled.
+      '''
+      self.pipeline.submit(ERROR,event,message,self.context,fields,sys.exc_info())
+
+   def flush(self,timeout=None):
+      return self.pipeline.flush(timeout)
+
+def open_log(output=None,**kwargs):
+   '''
+   Returns a Logger writing to a new LogPipeline (see LogPipeline for the arguments).
+   '''
+   return Logger(LogPipeline(output,**kwargs))
+
+_default_logger=None
+_default_lock=threading.Lock()
+
+def default_logger():
+   '''
+   Returns the logger used when none is given: JSON lines on standard output.  Its records are
+   written out when the program exits.
+   '''
+   global _default_logger
+   with _default_lock:
+      if _default_logger is None:
+         _default_logger=open_log()
+         atexit.register(_default_logger.pipeline.close)
+      return _default_logger
@@ -0,0 +1,144 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from StringIO import StringIO
+import botlog
+import fakeapi
+from testutils import FakeClock, make_bot
+from twitterbot import TwitterBot
+
+class BlockedOutput(object):
+   '''
+   Output whose writes block until it is released, like a full pipe.
+   '''
+   def __init__(self):
+      self.released = threading.Event()
+      self.lines = []
+
+   def write(self,line):
+      self.released.wait()
+      self.lines.append(line)
+
+   def flush(self):
+      pass
+
+def records(output):
+   return [json.loads(line) for line in output.getvalue().splitlines()]
+
+class TestBotLog(unittest.TestCase):
+   def setUp(self):
+      self.directory = tempfile.mkdtemp()
+
+   def tearDown(self):
+      shutil.rmtree(self.directory)
+
+   def test_json_lines(self):
+      output = StringIO()
+      log = botlog.open_log(output,level=botlog.INFO).bind(bot="testbot")
+      log.debug('hidden')
+      log.info('command',words=["sleep","5m"])
+      log.bind(user="boss").warning('post_retry',"post failed; retrying",error=ValueError("x"))
+      log.error('fetch_failed',feed='home',error=[{'code':130}])
+      self.assertTrue(log.flush(5))
+      written = records(output)
+      self.assertEqual([r['event'] for r in written],['command','post_retry','fetch_failed'])
+      self.assertEqual([r['level'] for r in written],['info','warning','error'])
+      self.assertTrue(all(r['bot'] == "testbot" for r in written))
+      self.assertEqual(written[0]['words'],["sleep","5m"])
+      self.assertEqual(written[1]['message'],"post failed; retrying")
+      self.assertEqual((written[1]['user'],written[1]['error']),("boss","ValueError('x',)"))
+      self.assertEqual(written[2]['error'],[{'code':130}])
+      self.assertTrue(abs(written[0]['time']-time.time()) < 60)
+      self.assertTrue(log.enabled_for(botlog.INFO))
+      self.assertFalse(log.enabled_for(botlog.DEBUG))
+      log.pipeline.close()
+
+   def test_exception(self):
+      output = StringIO()
+      log = botlog.open_log(output)
+      try:
+         raise KeyError("missing")
+      except KeyError:
+         log.exception('hook_failed',"exception in hook",hook="on_mentions")
+      log.info('bad bytes',text="\xff")
+      log.pipeline.close()
+      written = records(output)
+      self.assertEqual(written[0]['hook'],"on_mentions")
+      self.assertIn("KeyError: 'missing'",written[0]['exception'])
+      self.assertIn('format_error',written[1])
+
+   def test_sampling(self):
+      output = StringIO()
+      log = botlog.open_log(output,sampling={'status':4})
+      for index in range(10):
+         log.debug('status',index=index)
+         log.debug('statuses',index=index)
+      log.pipeline.close()
+      written = records(output)
+      self.assertEqual([r['index'] for r in written if r['event'] == 'status'],[0,4,8])
+      self.assertTrue(all(r['sampled'] == 4 for r in written if r['event'] == 'status'))
+      self.assertEqual(len([r for r in written if r['event'] == 'statuses']),10)
+
+   def test_never_blocks(self):
+      output = BlockedOutput()
+      log = botlog.open_log(output,queue_size=5)
+      started = time.time()
+      for index in range(100):
+         log.info('flood',index=index)
+      self.assertTrue(time.time()-started < 1.0)
+      self.assertTrue(log.pipeline.dropped >= 90)
+      output.released.set()
+      log.pipeline.close(5)
+      written = [json.loads(line) for line in output.lines]
+      dropped = [r for r in written if r['event'] == 'log_dropped']
+      self.assertEqual(sum(r['count'] for r in dropped),log.pipeline.dropped)
+      self.assertEqual(len(written)-len(dropped)+log.pipeline.dropped,100)
+
+   def test_rotation(self):
+      filename = os.path.join(self.directory,"bot.log")
+      log = botlog.open_log(filename,max_bytes=1000,backups=2)
+      for index in range(100):
+         log.info('line',index=index)
+      log.pipeline.close()
+      self.assertEqual(sorted(os.listdir(self.directory)),["bot.log","bot.log.1","bot.log.2"])
+      indexes = []
+      for name in ("bot.log.2","bot.log.1","bot.log"):
+         path = os.path.join(self.directory,name)
+         self.assertTrue(os.path.getsize(path) <= 1000)
+         with open(path) as f:
+            indexes.extend(json.loads(line)['index'] for line in f)
+      # the newest records are kept, in order
+      self.assertEqual(indexes,range(100-len(indexes),100))
+
+   def test_bot_context(self):
+      clock = FakeClock(time.time())
+      api = fakeapi.FakeApi(rates={'home':0,'mentions':10},seed=1,clock=clock)
+      output = StringIO()
+      log = botlog.open_log(output,sampling={'status':3})
+      bot = make_bot(TwitterBot,api,self.directory,log=log)
+      bot._DEBUG = True
+      bot.start()
+      try:
+         clock.now += 1.0
+         bot.tick()
+      finally:
+         bot.shutdown()
+      log.pipeline.close()
+      mentions = api.GetMentions(count=200)
+      written = records(output)
+      self.assertTrue(all(r['bot'] == "fakebot" for r in written))
+      self.assertEqual(written[0]['event'],'bot_started')
+      self.assertIn({'header':"Mentions",'count':len(mentions)},
+         [dict((k,r.get(k)) for k in ('header','count')) for r in written
+          if r['event'] == 'statuses'])
+      statuses = [r for r in written if r['event'] == 'status']
+      self.assertEqual(len(statuses),(len(mentions)+2)//3)
+      self.assertEqual(statuses[0]['id'],mentions[0].id)
+
+if __name__ == "__main__":
+   # run unit tests
+   unittest.main()
@@ -1,3 +1,11 @@
+import collections
+import re
+import threading
+from multiprocessing.pool import ThreadPool
+
+import botlog
+import duration
+import timeutils
 
 class CommandError(Exception):
   '''Base class for twitterbot command errors'''
@@ -7,13 +15,146 @@ class CommandError(Exception):
     '''Returns the first argument used to construct this error.'''
     return self.args[0]
 
+class CommandTimeout(CommandError):
+   '''Raised (reported) when a command runs past its timeout'''
+   pass
+
+# default value of a required argument
+REQUIRED=object()
+
+# leading @mentions of a status (each an @ and the rest of its word)
+MENTIONS=ur'\s*(?:[@\uff20]\S*(?:\s+|$))*'
+LEADING_MENTIONS=re.compile(MENTIONS,re.UNICODE)
+# grammar of a command status, matched in a single scan: the leading mentions, then the 'ctl'
+# keyword (group 1) followed by the command words
+COMMAND_PREFIX=re.compile(MENTIONS+r'(?:(ctl)\s+)?',re.UNICODE)
+WORD=re.compile(r'\S+',re.UNICODE)
+# a screen name, with or without its @
+SCREEN_NAME=re.compile(ur'[@\uff20]?(\w{1,15})$',re.UNICODE)
+
+def strip_mentions(text,start=0):
+   '''
+   Returns text without its leading @mentions (looking for them from offset start).
+   '''
+   return text[LEADING_MENTIONS.match(text,start).end():]
+
+def tokenize(text,start=0):
+   '''
+   Returns the words of the command in a status text (the words following any leading @mentions
+   and the 'ctl' keyword), or None if the text is not a command.  start is the offset where the
+   leading mentions end, if already known (see leading_mentions_end).
+   '''
+   match=COMMAND_PREFIX.match(text,start)
+   if match.group(1) is None:
+      return None
+   return WORD.findall(text,match.end())
+
+def leading_mentions_end(status):
+   '''
+   Returns the offset in status.text where the leading @mentions end, according to the status's
+   mention entities, or 0 if it has none (tokenize then finds the mentions itself).
+   '''
+   spans=[]
+   for mention in getattr(status,'user_mentions',None) or ():
+      # python-twitter only keeps the indices of a mention in its raw JSON
+      indices=(getattr(mention,'_json',None) or {}).get('indices')
+      if indices:
+         spans.append(indices)
+   text=status.text or u''
+   end=0
+   for start,stop in sorted(spans):
+      # only whitespace may separate the mention from the previous one
+      if text[end:start].strip() or text[start:start+1] not in (u'@',u'\uff20'):
+         break
+      end=stop
+   return end
+
+def screen_name(word):
+   '''
+   Argument converter for a screen name, given with or without its @.
+   '''
+   match=SCREEN_NAME.match(word)
+   if match is None:
+      raise ValueError(u"not a screen name: {0}".format(word))
+   return match.group(1)
+
+class Argument(object):
+   '''
+   Description of a command argument: its name, a function converting the word given in the
+   command to the argument's value (e.g. int or duration.Duration), and the default value used if
+   the argument is left out (arguments without a default are required).  The last argument of a
+   command can be greedy, taking all the remaining words (joined by spaces).
+   '''
+   def __init__(self,name,convert=unicode,default=REQUIRED,greedy=False):
+      self.name=name
+      self.convert=convert
+      self.default=default
+      self.greedy=greedy
+
+   def parse(self,word):
+      try:
+         return self.convert(word)
+      except Exception:
+         raise CommandError(u"Invalid value for {0}: {1}".format(self.name,word))
+
+def parse_arguments(arguments,params):
+   '''
+   Parses the words following a command name against the command's list of Arguments, and returns
+   a dictionary of argument name -> value.
+   '''
+   values={}
+   for index,argument in enumerate(arguments):
+      if argument.greedy and index < len(params):
+         values[argument.name]=argument.parse(" ".join(params[index:]))
+         return values
+      if index < len(params):
+         values[argument.name]=argument.parse(params[index])
+      elif argument.default is REQUIRED:
+         raise CommandError(u"Missing argument: {0}".format(argument.name))
+      else:
+         values[argument.name]=argument.default
+   if len(params) > len(arguments):
+      raise CommandError(u"Too many arguments: {0}".format(u" ".join(params[len(arguments):])))
+   return values
+
 class Command(object):
+   # name the command was registered under
+   name=None
+   # list of Arguments the command words are parsed into (in self.args); None leaves the words
+   # unparsed (in self.params)
+   arguments=None
+   # how long the command may run (a duration.Duration) before it is cancelled; None for the
+   # engine's default
+   timeout=None
+   # set when the command is cancelled (e.g. after a timeout); long running commands should check
+   # it and stop early
+   cancelled=False
+
+   def __init__(self,params=None,context=None):
+      self.params=params or []
+      self.context=context
+      self.args={}
+      if self.arguments is not None:
+         self.args=parse_arguments(self.arguments,self.params)
+
+   def cancel(self):
+      self.cancelled=True
+
    def run(self):
       '''
       To be overriden
       '''
       pass
 
+class FunctionCommand(Command):
+   '''
+   Command running a function registered with the register decorator.
+   '''
+   function=None
+
+   def run(self):
+      return self.function(self.context,**self.args)
+
 class CommandFactory(object):
 
    # dictionary of commands
@@ -21,7 +162,13 @@ class CommandFactory(object):
 
    @staticmethod
    def create(command_text,context):
-      command_words=command_text.split(" ")
+      '''
+      Creates the command given as text (e.g. 'sleep 5m') or as its list of words (see tokenize).
+      '''
+      if isinstance(command_text,basestring):
+         command_words=WORD.findall(command_text)
+      else:
+         command_words=command_text
       if len(command_words) == 0:
          raise CommandError("Empty Command")
       command_name=command_words[0]
@@ -30,4 +177,169 @@ class CommandFactory(object):
       if command_name in CommandFactory.commands:
          return CommandFactory.commands[command_name](command_params,context)
 
-      raise CommandError("Unknown Command: {0}".format(command_name))
+      raise CommandError(u"Unknown Command: {0}".format(command_name))
+
+def register(name,aliases=(),arguments=None,timeout=None):
+   '''
+   Class and function decorator that registers a command under a name and any aliases.
+
+   A Command subclass is registered as is (arguments and timeout, if given, override its own).  A
+   function is called with the context (the bot) followed by the parsed arguments as keyword
+   arguments, and returns the response (or None for no response):
+
+      @register("sleep",aliases=["zz"],arguments=[Argument("time",duration.Duration)])
+      def sleep(bot,time):
+         ...
+   '''
+   def decorate(target):
+      if isinstance(target,type) and issubclass(target,Command):
+         command_class=target
+         if arguments is not None:
+            command_class.arguments=arguments
+         if timeout is not None:
+            command_class.timeout=timeout
+      else:
+         command_class=type(target.__name__,(FunctionCommand,),
+            {'function':staticmethod(target),'arguments':arguments or [],'timeout':timeout})
+      command_class.name=name
+      for command_name in [name]+list(aliases):
+         registered=CommandFactory.commands.get(command_name)
+         if registered is not None and registered.__name__ != command_class.__name__:
+            raise CommandError("Command already registered: {0}".format(command_name))
+         CommandFactory.commands[command_name]=command_class
+      return target
+   return decorate
+
+class CommandEngine(object):
+   '''
+   Runs commands on a bounded pool of worker threads.
+
+   The commands of one sender run one at a time, in the order they were submitted, and their
+   results are delivered in that order; commands of different senders run in parallel.  Each
+   result is delivered as soon as its command finishes, by calling respond(response, error) on the
+   worker thread.
+
+   A command that runs past its timeout is cancelled (see Command.cancelled), a CommandTimeout is
+   delivered in its place and the sender's next command is started.  Python threads cannot be
+   stopped from outside, so the worker is only freed once the command notices the cancellation (or
+   finishes anyway); its late result is dropped.
+   '''
+
+   def __init__(self,workers=4,timeout=duration.Duration(seconds=30),log=None):
+      self._workers=workers
+      self._timeout=timeout
+      # botlog.Logger for errors
+      self._log=log or botlog.default_logger()
+      self._lock=threading.Lock()
+      # signalled whenever a command finishes
+      self._finished=threading.Condition(self._lock)
+      # commands waiting for the running command of their sender, keyed by sender.  A sender has an
+      # entry while one of its commands is running
+      self._lanes={}
+      # number of commands submitted and not finished yet
+      self._pending=0
+      # worker pool (created when first needed)
+      self._pool=None
+
+   def __len__(self):
+      with self._lock:
+         return self._pending
+
+   def submit(self,sender,command_text,context,respond):
+      '''
+      Queues a command (its text, e.g. 'sleep 5m', or list of words, and the context it runs in)
+      sent by the given sender.  respond(response, error) is called with the command's response, or
+      with the error (e.g. a CommandError) it raised.
+      '''
+      job=(command_text,context,respond)
+      with self._lock:
+         self._pending+=1
+         if sender in self._lanes:
+            self._lanes[sender].append(job)
+         else:
+            self._lanes[sender]=collections.deque()
+            self._start(sender,job)
+
+   def _start(self,sender,job):
+      # called with the lock held
+      if self._pool is None:
+         self._pool=ThreadPool(self._workers)
+      self._pool.apply_async(self._run,(sender,job))
+
+   def _run(self,sender,job):
+      command_text,context,respond=job
+      # set by whichever of completion and timeout comes first
+      finished=[False]
+      try:
+         cmnd=CommandFactory.create(command_text,context)
+      except Exception,e:
+         self._finish(sender,respond,finished,None,e)
+         return
+
+      timeout=cmnd.timeout if cmnd.timeout is not None else self._timeout
+      timer=threading.Timer(timeout.seconds,self._time_out,
+         (sender,respond,finished,cmnd,command_text,timeout))
+      timer.daemon=True
+      timer.start()
+      response=None
+      error=None
+      try:
+         response=cmnd.run()
+      except Exception,e:
+         error=e
+      finally:
+         timer.cancel()
+      self._finish(sender,respond,finished,response,error)
+
+   def _time_out(self,sender,respond,finished,cmnd,command_text,timeout):
+      cmnd.cancel()
+      self._finish(sender,respond,finished,None,
+         CommandTimeout(u"Command timed out after {0}: {1}".format(timeout,
+            command_text if isinstance(command_text,basestring) else u" ".join(command_text))))
+
+   def _finish(self,sender,respond,finished,response,error):
+      with self._lock:
+         if finished[0]:
+            return
+         finished[0]=True
+
+      try:
+         respond(response,error)
+      except Exception:
+         self._log.exception('command_result_failed',"unable to deliver a command result")
+
+      with self._lock:
+         self._pending-=1
+         lane=self._lanes[sender]
+         if lane:
+            self._start(sender,lane.popleft())
+         else:
+            del self._lanes[sender]
+         self._finished.notify_all()
+
+   def wait(self,timeout=None):
+      '''
+      Waits up to timeout seconds (forever if None) for all submitted commands to finish.  Returns
+      whether they did.
+      '''
+      deadline=None if timeout is None else timeutils.monotonic()+timeout
+      with self._lock:
+         while self._pending > 0:
+            remaining=1.0 if deadline is None else deadline-timeutils.monotonic()
+            if remaining <= 0:
+               break
+            self._finished.wait(min(remaining,1.0))
+         return self._pending == 0
+
+   def close(self,timeout=None):
+      '''
+      Waits up to timeout seconds for the submitted commands to finish, then stops the workers.
+      The engine can still be used afterwards; new workers are started when needed.
+      '''
+      drained=self.wait(timeout)
+      with self._lock:
+         pool,self._pool=self._pool,None
+      if pool is not None:
+         pool.close()
+         if drained:
+            pool.join()
@@ -0,0 +1,39 @@
+'''
+Benchmarks of command tokenizing against the original strip_at_symbols / split based parsing, on
+texts with many leading mentions (as in long reply threads).
+'''
+
+import benchutils
+import command
+
+def legacy_tokenize(text):
+   # the original implementation: strip_at_symbols, the 'ctl ' check, then CommandFactory's split
+   while len(text) > 0 and text[0]=='@':
+      text=" ".join(text.split(" ")[1:])
+   if len(text) > 3 and text[:4]=="ctl ":
+      text=" ".join(text.split(" ")[1:])
+      return text.split(" ")
+   return None
+
+def mention_text(mentions,body="ctl sleep 5m"):
+   return u" ".join([u"@user_{0}".format(i) for i in range(mentions)]+[body])
+
+def run():
+   '''
+   Runs the benchmarks, returning a list of (name, seconds per call, baseline seconds per call).
+   '''
+   results = []
+   for mentions in (1,10,50):
+      text = mention_text(mentions)
+      assert command.tokenize(text) == legacy_tokenize(text)
+      results.append(("tokenize, {0} mentions".format(mentions),
+         benchutils.best_time(lambda: command.tokenize(text)),
+         benchutils.best_time(lambda: legacy_tokenize(text))))
+
+   text = mention_text(50,"thanks for the thread!")
+   results.append(("non-command, 50 mentions",benchutils.best_time(lambda: command.tokenize(text)),
+      benchutils.best_time(lambda: legacy_tokenize(text))))
+   return results
+
+if __name__ == "__main__":
+   benchutils.print_results("command",run())
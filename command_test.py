@@ -0,0 +1,186 @@
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import command
+import fakeapi
+import twitterbot
+from command import Argument, Command, CommandEngine, CommandError, CommandFactory, \
+   CommandTimeout, register
+from duration import Duration
+from testutils import FakeClock, Status, make_bot
+
+@register("add",aliases=["plus"],arguments=[Argument("a",int),Argument("b",int,default=1)])
+def add(context,a,b):
+   return a+b
+
+@register("wait",arguments=[Argument("time",Duration),Argument("label",default="",greedy=True)])
+def wait(context,time,label):
+   context.append(label)
+   threading.Event().wait(time.seconds)
+   return label
+
+@register("block",arguments=[Argument("user",command.screen_name),
+   Argument("time",Duration,default=Duration(days=1))])
+def block(context,user,time):
+   return (user,time)
+
+@register("say",arguments=[Argument("text",greedy=True)])
+def say(context,text):
+   return text
+
+@register("spin",timeout=Duration(milliseconds=50))
+class Spin(Command):
+   def run(self):
+      while not self.cancelled:
+         time.sleep(0.01)
+      return "stopped"
+
+# registered the old way, without register()
+class Legacy(Command):
+   def run(self):
+      return "legacy"
+
+CommandFactory.commands["legacy"] = Legacy
+
+class TestCommands(unittest.TestCase):
+   def test_registration(self):
+      self.assertEqual(CommandFactory.create("add 2 3",None).run(),5)
+      self.assertEqual(CommandFactory.create("plus 2",None).run(),3)
+      self.assertEqual(CommandFactory.create("wait 1ms hello there",[]).run(),"hello there")
+      with self.assertRaises(CommandError):
+         CommandFactory.create("add x",None)
+      with self.assertRaises(CommandError):
+         CommandFactory.create("add",None)
+      with self.assertRaises(CommandError):
+         CommandFactory.create("add 1 2 3",None)
+      with self.assertRaises(CommandError):
+         register("plus")(lambda context: None)
+
+   def test_command_name(self):
+      self.assertEqual(twitterbot.command_name(["add","1"]),"add")
+      self.assertEqual(twitterbot.command_name(["plus","1"]),"add")
+      self.assertEqual(twitterbot.command_name(["legacy"]),"legacy")
+      self.assertEqual(CommandFactory.create("legacy",None).run(),"legacy")
+      self.assertEqual(twitterbot.command_name(["nope"]),'unknown')
+      self.assertEqual(twitterbot.command_name([]),'unknown')
+
+   def test_tokenize(self):
+      self.assertEqual(command.tokenize(u"@bot @other ctl sleep  5m"),[u"sleep",u"5m"])
+      self.assertEqual(command.tokenize(u"ctl status"),[u"status"])
+      self.assertEqual(command.tokenize(u"\uff20bot ctl status"),[u"status"])
+      self.assertIsNone(command.tokenize(u"@bot hello ctl status"))
+      self.assertIsNone(command.tokenize(u"@bot ctl"))
+      self.assertEqual(command.tokenize(u"@bot ctl "),[])
+      self.assertIsNone(command.tokenize(u"@bot control"))
+      self.assertEqual(command.strip_mentions(u"@a @b hello @c"),u"hello @c")
+      self.assertEqual(command.strip_mentions(u"@a"),u"")
+
+   def test_leading_mentions_end(self):
+      status = Status(text=u"@bot  @other ctl add 1 @bot",
+         mention_indices=[(0,4),(26,30),(6,12)])
+      self.assertEqual(command.leading_mentions_end(status),12)
+      self.assertEqual(command.tokenize(status.text,12),[u"add",u"1",u"@bot"])
+      self.assertEqual(command.leading_mentions_end(Status(text=u"hi @bot",
+         mention_indices=[(3,7)])),0)
+      self.assertEqual(command.leading_mentions_end(Status(text=u"@bot ctl x")),0)
+
+   def test_converters(self):
+      self.assertEqual(command.screen_name("@some_user"),"some_user")
+      self.assertEqual(command.screen_name("other"),"other")
+      with self.assertRaises(ValueError):
+         command.screen_name("not-a-name")
+      self.assertEqual(CommandFactory.create(["add","2","3"],None).run(),5)
+      self.assertEqual(CommandFactory.create("add   2\t3",None).run(),5)
+      with self.assertRaises(CommandError):
+         CommandFactory.create(["block","@not-a-name"],None)
+      self.assertEqual(CommandFactory.create(["block","@someone","2h"],None).run(),
+         ("someone",Duration(hours=2)))
+      with self.assertRaises(CommandError):
+         CommandFactory.create("",None)
+
+   def test_non_ascii(self):
+      words = command.tokenize(u"@bot ctl say h\xe9llo w\xf6rld")
+      self.assertEqual(CommandFactory.create(words,None).run(),u"h\xe9llo w\xf6rld")
+      with self.assertRaises(CommandError) as raised:
+         CommandFactory.create([u"add",u"h\xe9llo"],None)
+      self.assertEqual(raised.exception.message,u"Invalid value for a: h\xe9llo")
+      with self.assertRaises(CommandError) as raised:
+         CommandFactory.create([u"add",u"1",u"2",u"\xe9"],None)
+      self.assertEqual(raised.exception.message,u"Too many arguments: \xe9")
+      with self.assertRaises(CommandError) as raised:
+         CommandFactory.create([u"h\xe9llo"],None)
+      self.assertEqual(raised.exception.message,u"Unknown Command: h\xe9llo")
+
+   def test_engine(self):
+      engine = CommandEngine(workers=4)
+      results = []
+      lock = threading.Lock()
+      def respond(sender):
+         def deliver(response,error):
+            with lock:
+               results.append((sender,response,type(error).__name__ if error else None))
+         return deliver
+
+      started = []
+      # bob's slow command does not hold up alice's, but bob's commands stay in order
+      engine.submit("bob","wait 200ms first",started,respond("bob"))
+      engine.submit("bob","add 1",started,respond("bob"))
+      engine.submit("alice","add 2 2",started,respond("alice"))
+      engine.submit("alice","nope",started,respond("alice"))
+      engine.submit("carol","spin",started,respond("carol"))
+      self.assertTrue(engine.wait(5))
+      engine.close()
+
+      self.assertEqual([r for r in results if r[0] == "bob"],
+         [("bob","first",None),("bob",2,None)])
+      self.assertEqual([r for r in results if r[0] == "alice"],
+         [("alice",4,None),("alice",None,"CommandError")])
+      self.assertEqual([r for r in results if r[0] == "carol"],
+         [("carol",None,"CommandTimeout")])
+      self.assertEqual(results[-1][0],"bob")
+
+class TestBotCommands(unittest.TestCase):
+   def setUp(self):
+      self.directory = tempfile.mkdtemp()
+
+   def tearDown(self):
+      shutil.rmtree(self.directory)
+
+   def test_empty_command(self):
+      # every command the bosses send is '@fakebot ctl ', with no words after the keyword
+      clock = FakeClock(time.time())
+      api = fakeapi.FakeApi(rates={'home':0,'mentions':0,'commands':1},commands=[""],seed=1,
+         clock=clock)
+      bot = make_bot(twitterbot.TwitterBot,api,self.directory)
+      bot.start()
+      try:
+         clock.now += 3.0
+         bot.tick()
+         self.assertTrue(bot._command_engine.wait(5))
+      finally:
+         bot.shutdown()
+      commands = api.GetMentions(count=200)
+      self.assertTrue(len(commands) > 0)
+      replies = api.GetReplies(count=200)
+      self.assertTrue(len(replies) > 0)
+      self.assertTrue(all(reply.text.endswith("Error: Empty Command") for reply in replies))
+
+   def test_non_ascii_replies(self):
+      clock = FakeClock(time.time())
+      api = fakeapi.FakeApi(rates={'home':0,'mentions':0,'commands':1},commands=[""],seed=1,
+         clock=clock)
+      bot = make_bot(twitterbot.TwitterBot,api,self.directory)
+      clock.now += 3.0
+      status = api.GetMentions(count=1)[0]
+      bot.respond_to_command(status,u"h\xe9llo",None)
+      bot.respond_to_command(status,None,CommandError(u"Invalid value for a: h\xe9llo"))
+      bot.start()
+      bot.shutdown()
+      self.assertEqual([post.text for post,_ in api.posts],
+         [u"@boss h\xe9llo",u"@boss Error: Invalid value for a: h\xe9llo"])
+
+if __name__ == "__main__":
+   # run unit tests
+   unittest.main()
@@ -4,6 +4,23 @@ A common duration utility class.
 
 import re
 import datetime as dt
+from array import array
+
+import lru
+
+try:
+   import numpy
+except ImportError:
+   # DurationArray falls back to array storage
+   numpy = None
+
+# typecode of a 64-bit integer array, used by DurationArray without numpy: 'q' where available,
+# else 'l' where long is 64 bits (python 2 on 64-bit unix).  If neither is, a list is used.
+try:
+   INT64_TYPECODE = 'q'
+   array(INT64_TYPECODE)
+except ValueError:
+   INT64_TYPECODE = 'l' if array('l').itemsize >= 8 else None
 
 def weeks_to_seconds(weeks):
    return weeks*7*24*60*60
@@ -35,6 +52,30 @@ def seconds_to_microseconds(seconds):
 def seconds_to_nanoseconds(seconds):
    return seconds*1.0e9
 
+# nanoseconds in each duration unit, by unit name and abbreviation
+UNIT_NANOSECONDS={}
+for _names,_nanoseconds in [(('weeks','w'),7*24*60*60*10**9),
+                            (('days','d'),24*60*60*10**9),
+                            (('hours','h'),60*60*10**9),
+                            (('minutes','m'),60*10**9),
+                            (('seconds','s'),10**9),
+                            (('milliseconds','ms'),10**6),
+                            (('microseconds','us'),10**3),
+                            (('nanoseconds','ns'),1)]:
+   for _name in _names:
+      UNIT_NANOSECONDS[_name]=_nanoseconds
+
+# units in the order they are printed
+PRINT_UNITS=['w','d','h','m','s','ms','us','ns']
+
+# tokens of the designated timefield format ('1m24s543ms').  Two-character units come first in the
+# alternation, so something ending in 'ms' isn't interpreted as minutes
+DESIGNATED_TOKEN=re.compile(r"(\d+)(ms|us|ns|w|d|h|m|s)")
+POSITIONAL_TIMEFIELD=re.compile(r"(\d+):(\d+):(\d+)(?:\.(\d+)(?:\.(\d+)(?:\.(\d+))?)?)?")
+
+# nanoseconds of recently parsed duration strings
+_parse_cache=lru.LRUCache(256)
+
 class DurationError(Exception):
   '''Base class for Duration errors'''
 
@@ -63,9 +104,14 @@ class Duration(object):
    microseconds, and a microsecond is 1000 nanoseconds.  Any handling of time zones, daylight
    savings times, and leap seconds would have to happen outside this class.
 
-
+   The duration is stored as an integer number of nanoseconds, so durations built from whole units
+   are exact.  Durations can be compared with each other, hashed, added, subtracted, multiplied or
+   divided by a number, and divided by another duration.
+   Durations are never negative; a subtraction that would give a negative duration is an error.
    '''
 
+   __slots__ = ('_nanoseconds',)
+
    def __init__(self,string="",**kwargs):
       '''
       Duration constructor takes either a string parameter or a keyword argument denoting a 
@@ -114,158 +160,139 @@ class Duration(object):
       else:
          self.construct_from_unit_dict(kwargs)
 
-   def construct_from_string(self,string):
-      # remove spaces
-      string = "".join(string.split())
+   @classmethod
+   def from_nanoseconds(ClassObj,nanoseconds):
+      '''
+      Returns a duration of the given (integer) number of nanoseconds, without any parsing.
+      '''
+      duration = object.__new__(ClassObj)
+      duration._nanoseconds = nanoseconds
+      return duration
 
-      if ":" in string:
-         self.construct_from_positional_timefield(string)
+   def construct_from_string(self,string):
+      nanoseconds = _parse_cache.get(string)
+      if nanoseconds is None:
+         # remove spaces
+         stripped = "".join(string.split())
+
+         if ":" in stripped:
+            self.construct_from_positional_timefield(stripped)
+         else:
+            self.construct_from_designated_timefield(stripped)
+         _parse_cache.put(string,self._nanoseconds)
       else:
-         self.construct_from_designated_timefield(string)
+         self._nanoseconds = nanoseconds
 
    def construct_from_positional_timefield(self,string):
-      unit_dict = {}
-      pattern = re.compile(r"(\d+):(\d+):(\d+)(?:\.(\d+)(?:\.(\d+)(?:\.(\d+))?)?)?")
-      m = pattern.search(string)
+      m = POSITIONAL_TIMEFIELD.search(string)
 
-      if not m or len(m.groups()) != 6:
+      if not m:
          raise DurationError("Duration parse error: HH:MM:SS.MMM.UUU.NNN timefield invalid: "
             "{0}".format(string))
 
-      h,m,s,ms,us,ns = m.groups()
-      if h is None or m is None or s is None:
-         raise DurationError("Duration parse error: HH:MM:SS not complete: {0}".format(string))
-      def set_if_valid(d,key,strval):
-         if strval is not None:
-            d[key] = float(strval)
-      set_if_valid(unit_dict,"h",h)
-      set_if_valid(unit_dict,"m",m)
-      set_if_valid(unit_dict,"s",s)
-      set_if_valid(unit_dict,"ms",ms)
-      set_if_valid(unit_dict,"us",us)
-      set_if_valid(unit_dict,"ns",ns)
-
-      self.construct_from_unit_dict(unit_dict)
-
+      nanoseconds = 0
+      for value,unit in zip(m.groups(),['h','m','s','ms','us','ns']):
+         if value is not None:
+            nanoseconds += int(value)*UNIT_NANOSECONDS[unit]
+      self._nanoseconds = nanoseconds
 
    def construct_from_designated_timefield(self,string):
-      unit_dict = {}
-      # add the two-character duration units first (so something ending in 'ms' isn't interpreted
-      # as minutes)
-      string = self.add_duration_unit_to_args(string,"ms",unit_dict)
-      string = self.add_duration_unit_to_args(string,"ns",unit_dict)
-      string = self.add_duration_unit_to_args(string,"us",unit_dict)
-      string = self.add_duration_unit_to_args(string,"s",unit_dict)
-      string = self.add_duration_unit_to_args(string,"m",unit_dict)
-      string = self.add_duration_unit_to_args(string,"h",unit_dict)
-      string = self.add_duration_unit_to_args(string,"d",unit_dict)
-      string = self.add_duration_unit_to_args(string,"w",unit_dict)
-
-      self.construct_from_unit_dict(unit_dict)
-
-   def add_duration_unit_to_args(self,string,duration_unit,unit_dict):
-      split_timefield = re.split(r"(\d+"+duration_unit+r")",string)
-      if len(split_timefield) > 3:
-         raise DurationError("Duration parse error: Multiple '{0}' units found in string: "
-            "{1}".format(duration_unit,string))
-      if len(split_timefield) == 1:
-         # not found
-         return string
-      prefix, matched_timefield, suffix = split_timefield
-      # remove the matched timefield from the string
-      string = "".join([prefix,suffix])
-      # add the numeric portion of the matched timefield to the duration unit dictionary
-      try:
-         unit_dict[duration_unit] = float(re.sub(duration_unit,'',matched_timefield))
-      except ValueError:
-         raise DurationError("Duration parse error: unable to convert to number: "
-            "{0}".format(matched_timefield))
-      return string
+      nanoseconds = 0
+      units = set()
+      position = 0
+      for token in DESIGNATED_TOKEN.finditer(string):
+         if token.start() != position:
+            break
+         value,unit = token.groups()
+         if unit in units:
+            raise DurationError("Duration parse error: Multiple '{0}' units found in string: "
+               "{1}".format(unit,string))
+         units.add(unit)
+         nanoseconds += int(value)*UNIT_NANOSECONDS[unit]
+         position = token.end()
+      if position != len(string):
+         raise DurationError("Duration parse error: unable to parse: {0}".format(string[position:]))
+      self._nanoseconds = nanoseconds
 
    def construct_from_unit_dict(self,unit_dict):
-      self._seconds = 0.0
+      nanoseconds = 0
       for key in unit_dict:
          val = unit_dict[key]
          if val < 0:
             raise DurationError("Duration parse error: negative value in keyword argument: " 
                "{0}".format(key));
-         if key not in ['weeks','w','days','d','hours','h','minutes','m','seconds','s', \
-               'milliseconds','ms','microseconds','us','nanoseconds','ns']:
+         if key not in UNIT_NANOSECONDS:
             raise DurationError("Duration parse error: unknown duration unit specified: "
                "{0}".format(key))
-
-         if key == 'weeks' or key == 'w':
-            self._seconds += weeks_to_seconds(val)
-         if key == 'days' or key == 'd':
-            self._seconds += days_to_seconds(val)
-         if key == 'hours' or key == 'h':
-            self._seconds += hours_to_seconds(val)
-         if key == 'minutes' or key == 'm':
-            self._seconds += minutes_to_seconds(val)
-         if key == 'seconds' or key == 's':
-            self._seconds += val
-         if key == 'milliseconds' or key == 'ms':
-            self._seconds += milliseconds_to_seconds(val)
-         if key == 'microseconds' or key == 'us':
-            self._seconds += microseconds_to_seconds(val)
-         if key == 'nanoseconds' or key == 'ns':
-            self._seconds += nanoseconds_to_seconds(val)
+         if isinstance(val,(int,long)):
+            nanoseconds += val*UNIT_NANOSECONDS[key]
+         else:
+            nanoseconds += int(round(val*UNIT_NANOSECONDS[key]))
+      self._nanoseconds = nanoseconds
+
+   def _set(self,value,unit):
+      if value < 0:
+         raise DurationError("Duration error: negative value: {0}".format(value))
+      if isinstance(value,(int,long)):
+         self._nanoseconds = value*UNIT_NANOSECONDS[unit]
+      else:
+         self._nanoseconds = int(round(value*UNIT_NANOSECONDS[unit]))
 
    @property
    def nanoseconds(self):
-      return seconds_to_nanoseconds(self._seconds)
+      return self._nanoseconds
    @nanoseconds.setter
    def nanoseconds(self,nanoseconds):
-      self._seconds = nanoseconds_to_seconds(nanoseconds)
+      self._set(nanoseconds,'ns')
    
    @property
    def microseconds(self):
-      return seconds_to_microseconds(self._seconds)
+      return seconds_to_microseconds(self.seconds)
    @microseconds.setter
    def microseconds(self,microseconds):
-      self._seconds = microseconds_to_secondss(microseconds)
+      self._set(microseconds,'us')
    
    @property
    def milliseconds(self):
-      return seconds_to_milliseconds(self._seconds)
+      return seconds_to_milliseconds(self.seconds)
    @milliseconds.setter
    def milliseconds(self,milliseconds):
-      self._seconds = milliseconds_to_seconds(milliseconds)
+      self._set(milliseconds,'ms')
    
    @property
    def seconds(self):
-      return self._seconds
+      return self._nanoseconds/1.0e9
    @seconds.setter
    def seconds(self,seconds):
-      self._seconds = seconds
+      self._set(seconds,'s')
    
    @property
    def minutes(self):
-      return seconds_to_minutes(self._seconds)
+      return seconds_to_minutes(self.seconds)
    @minutes.setter
    def minutes(self,minutes):
-      self._seconds = minutes_to_seconds(minutes)
+      self._set(minutes,'m')
 
    @property
    def hours(self):
-      return seconds_to_hours(self._seconds)
+      return seconds_to_hours(self.seconds)
    @hours.setter
    def hours(self,hours):
-      self._seconds = hours_to_seconds(hours)
+      self._set(hours,'h')
    
    @property
    def days(self):
-      return seconds_to_days(self._seconds)
+      return seconds_to_days(self.seconds)
    @days.setter
    def days(self,days):
-      self._seconds = days_to_seconds(days)
+      self._set(days,'d')
 
    @property
    def weeks(self):
-      return seconds_to_weeks(self._seconds)
+      return seconds_to_weeks(self.seconds)
    @weeks.setter
    def weeks(self,weeks):
-      self._seconds = weeks_to_seconds(weeks)
+      self._set(weeks,'w')
 
    @property
    def timedelta(self):
@@ -274,28 +301,250 @@ class Duration(object):
 
       Drops anything under microsecond granularity.
       '''
-      return dt.timedelta(seconds=self._seconds)
+      return dt.timedelta(microseconds=self._nanoseconds//1000)
 
    def __str__(self):
-      split_by_unit = ['']*8
-      secs = self._seconds
-
-      split_by_unit[0], secs = self.extract_print_string(secs,weeks_to_seconds,"w")
-      split_by_unit[1], secs = self.extract_print_string(secs,days_to_seconds,"d")
-      split_by_unit[2], secs = self.extract_print_string(secs,hours_to_seconds,"h")
-      split_by_unit[3], secs = self.extract_print_string(secs,minutes_to_seconds,"m")
-      split_by_unit[4], secs = self.extract_print_string(secs,lambda x: x,"s")
-      split_by_unit[5], secs = self.extract_print_string(secs,milliseconds_to_seconds,"ms")
-      split_by_unit[6], secs = self.extract_print_string(secs,microseconds_to_seconds,"us")
-      split_by_unit[7], secs = self.extract_print_string(secs,nanoseconds_to_seconds,"ns")
+      split_by_unit = []
+      nanoseconds = self._nanoseconds
+      for unit in PRINT_UNITS:
+         count,nanoseconds = divmod(nanoseconds,UNIT_NANOSECONDS[unit])
+         if count > 0:
+            split_by_unit.append("{0}{1}".format(count,unit))
 
       return "".join(split_by_unit)
 
-   def extract_print_string(self,seconds,conversion_func,designation_str):
-      if seconds >= conversion_func(1):
-         num = int(seconds / conversion_func(1))
-         string_rep = "{0}{1}".format(num,designation_str)
-         return string_rep, (seconds - conversion_func(num))
-      else:
-         return '', seconds      
+   def __repr__(self):
+      return "Duration('{0}')".format(self)
+
+   def __getstate__(self):
+      return (self._nanoseconds,)
+
+   def __setstate__(self,state):
+      self._nanoseconds = state[0]
+
+   def __eq__(self,other):
+      return isinstance(other,Duration) and self._nanoseconds == other._nanoseconds
+
+   def __ne__(self,other):
+      return not self == other
+
+   def _not_comparable(self,other):
+      return TypeError("Cannot compare a Duration with {0}".format(type(other).__name__))
+
+   def __lt__(self,other):
+      if not isinstance(other,Duration):
+         raise self._not_comparable(other)
+      return self._nanoseconds < other._nanoseconds
+   def __le__(self,other):
+      if not isinstance(other,Duration):
+         raise self._not_comparable(other)
+      return self._nanoseconds <= other._nanoseconds
+   def __gt__(self,other):
+      if not isinstance(other,Duration):
+         raise self._not_comparable(other)
+      return self._nanoseconds > other._nanoseconds
+   def __ge__(self,other):
+      if not isinstance(other,Duration):
+         raise self._not_comparable(other)
+      return self._nanoseconds >= other._nanoseconds
+
+   def __hash__(self):
+      return hash(self._nanoseconds)
+
+   def __nonzero__(self):
+      return self._nanoseconds != 0
+
+   def __add__(self,other):
+      if not isinstance(other,Duration):
+         return NotImplemented
+      return Duration.from_nanoseconds(self._nanoseconds+other._nanoseconds)
+
+   def __sub__(self,other):
+      if not isinstance(other,Duration):
+         return NotImplemented
+      if other._nanoseconds > self._nanoseconds:
+         raise DurationError("Duration error: subtraction would give a negative duration: "
+            "{0} - {1}".format(self,other))
+      return Duration.from_nanoseconds(self._nanoseconds-other._nanoseconds)
+
+   def __mul__(self,factor):
+      if not isinstance(factor,(int,long,float)):
+         return NotImplemented
+      if factor < 0:
+         raise DurationError("Duration error: negative factor: {0}".format(factor))
+      if isinstance(factor,float):
+         return Duration.from_nanoseconds(int(round(self._nanoseconds*factor)))
+      return Duration.from_nanoseconds(self._nanoseconds*factor)
+
+   __rmul__ = __mul__
+
+   def __truediv__(self,divisor):
+      '''
+      Dividing by a duration gives their ratio (a float); dividing by a number gives a duration.
+      '''
+      if isinstance(divisor,Duration):
+         return self._nanoseconds/float(divisor._nanoseconds)
+      if not isinstance(divisor,(int,long,float)):
+         return NotImplemented
+      return self*(1.0/divisor)
 
+   __div__ = __truediv__
+
+class DurationArray(object):
+   '''
+   Array of durations, stored as integer nanoseconds in a numpy int64 array (or in a 64-bit integer
+   array if numpy is not installed) instead of one Duration object per value.
+
+   Parse many strings at once with DurationArray(strings) (any format Duration accepts; Duration
+   objects can be mixed in), or build one with from_nanoseconds / from_seconds.  Indexing gives a
+   Duration (or a DurationArray for a slice).  Comparisons with a Duration or another DurationArray
+   of the same length are elementwise and give an array of booleans (a numpy array, or a list
+   without numpy).  sum(), min() and max() give a Duration, and the unit properties (seconds,
+   minutes, etc.) give an array of floats (nanoseconds gives the integer array itself).
+   '''
+
+   __slots__ = ('_nanoseconds',)
+
+   def __init__(self,durations=()):
+      # parse each distinct string once
+      parsed = {}
+      scratch = Duration.from_nanoseconds(0)
+      nanoseconds = []
+      for duration in durations:
+         if isinstance(duration,Duration):
+            nanoseconds.append(duration._nanoseconds)
+            continue
+         if duration not in parsed:
+            # parsed directly, so that a big table does not flush the shared parse cache
+            stripped = "".join(duration.split())
+            if ":" in stripped:
+               scratch.construct_from_positional_timefield(stripped)
+            else:
+               scratch.construct_from_designated_timefield(stripped)
+            parsed[duration] = scratch._nanoseconds
+         nanoseconds.append(parsed[duration])
+      self._nanoseconds = DurationArray._storage(nanoseconds)
+
+   @staticmethod
+   def _storage(nanoseconds):
+      if numpy is not None:
+         return numpy.array(nanoseconds,dtype=numpy.int64)
+      if INT64_TYPECODE is None:
+         return list(nanoseconds)
+      return array(INT64_TYPECODE,nanoseconds)
+
+   @classmethod
+   def from_nanoseconds(ClassObj,nanoseconds):
+      '''
+      Returns an array of the given integer numbers of nanoseconds.
+      '''
+      durations = object.__new__(ClassObj)
+      durations._nanoseconds = DurationArray._storage(nanoseconds)
+      return durations
+
+   @classmethod
+   def from_seconds(ClassObj,seconds):
+      '''
+      Returns an array of durations given in (float) seconds, e.g. the ages from timeutils.ages.
+      '''
+      if numpy is not None:
+         seconds = numpy.asarray(seconds,dtype=numpy.float64)
+         return ClassObj.from_nanoseconds(numpy.rint(seconds*1e9))
+      return ClassObj.from_nanoseconds([int(round(s*1e9)) for s in seconds])
+
+   def __len__(self):
+      return len(self._nanoseconds)
+
+   def __iter__(self):
+      for nanoseconds in self._nanoseconds:
+         yield Duration.from_nanoseconds(int(nanoseconds))
+
+   def __getitem__(self,index):
+      if isinstance(index,slice):
+         return DurationArray.from_nanoseconds(self._nanoseconds[index])
+      return Duration.from_nanoseconds(int(self._nanoseconds[index]))
+
+   def __repr__(self):
+      return "DurationArray([{0}])".format(",".join(repr(str(d)) for d in self))
+
+   def _other_nanoseconds(self,other):
+      if isinstance(other,Duration):
+         return other._nanoseconds
+      if isinstance(other,DurationArray):
+         if len(other) != len(self):
+            raise DurationError("Duration error: cannot compare arrays of lengths {0} and "
+               "{1}".format(len(self),len(other)))
+         return other._nanoseconds
+      raise TypeError("Cannot compare a DurationArray with {0}".format(type(other).__name__))
+
+   def _compare(self,other,compare):
+      other = self._other_nanoseconds(other)
+      if numpy is not None:
+         return compare(self._nanoseconds,other)
+      if not isinstance(other,(int,long)):
+         return [compare(a,b) for a,b in zip(self._nanoseconds,other)]
+      return [compare(a,other) for a in self._nanoseconds]
+
+   def __lt__(self,other):
+      return self._compare(other,lambda a,b: a < b)
+   def __le__(self,other):
+      return self._compare(other,lambda a,b: a <= b)
+   def __gt__(self,other):
+      return self._compare(other,lambda a,b: a > b)
+   def __ge__(self,other):
+      return self._compare(other,lambda a,b: a >= b)
+   def __eq__(self,other):
+      return self._compare(other,lambda a,b: a == b)
+   def __ne__(self,other):
+      return self._compare(other,lambda a,b: a != b)
+
+   # elementwise equality makes arrays unhashable
+   __hash__ = None
+
+   def sum(self):
+      return Duration.from_nanoseconds(int(sum(self._nanoseconds) if numpy is None else
+         self._nanoseconds.sum()))
+
+   def min(self):
+      if len(self) == 0:
+         raise DurationError("Duration error: min() of an empty DurationArray")
+      return Duration.from_nanoseconds(int(min(self._nanoseconds) if numpy is None else
+         self._nanoseconds.min()))
+
+   def max(self):
+      if len(self) == 0:
+         raise DurationError("Duration error: max() of an empty DurationArray")
+      return Duration.from_nanoseconds(int(max(self._nanoseconds) if numpy is None else
+         self._nanoseconds.max()))
+
+   def _in_unit(self,unit):
+      # the durations in a unit, as floats
+      if numpy is not None:
+         return self._nanoseconds/float(UNIT_NANOSECONDS[unit])
+      scale = float(UNIT_NANOSECONDS[unit])
+      return array('d',[nanoseconds/scale for nanoseconds in self._nanoseconds])
+
+   @property
+   def nanoseconds(self):
+      return self._nanoseconds
+   @property
+   def microseconds(self):
+      return self._in_unit('us')
+   @property
+   def milliseconds(self):
+      return self._in_unit('ms')
+   @property
+   def seconds(self):
+      return self._in_unit('s')
+   @property
+   def minutes(self):
+      return self._in_unit('m')
+   @property
+   def hours(self):
+      return self._in_unit('h')
+   @property
+   def days(self):
+      return self._in_unit('d')
+   @property
+   def weeks(self):
+      return self._in_unit('w')
@@ -0,0 +1,68 @@
+'''
+Benchmarks of Duration construction and comparison.
+
+To compare against another implementation of the duration module (e.g. the original one, saved
+with 'git show 43f6771:duration.py > /tmp/legacy_duration.py'), give the path to it:
+
+   python duration_bench.py /tmp/legacy_duration.py
+'''
+
+import imp
+import sys
+
+import benchutils
+import duration
+
+def cases(module):
+   '''
+   Returns a list of (name, function) benchmark cases for a duration module.
+   '''
+   Duration = module.Duration
+   a = Duration(seconds=90)
+   b = Duration(minutes=2)
+   if '__lt__' in vars(Duration):
+      compare = lambda: a < b
+   else:
+      # without comparison support, durations are compared through their timedeltas
+      compare = lambda: a.timedelta < b.timedelta
+   return [
+      ("Duration(seconds=90)",lambda: Duration(seconds=90)),
+      ("Duration('1h30m15s')",lambda: Duration("1h30m15s")),
+      ("Duration('12:34:56.789')",lambda: Duration("12:34:56.789")),
+      ("compare",compare),
+      ("str",lambda: str(a)),
+   ]
+
+def run(legacy_path=None):
+   '''
+   Runs the benchmarks, returning a list of (name, seconds per call, baseline seconds per call or
+   None).  The baseline is the duration module at legacy_path, if given.
+   '''
+   baselines = {}
+   if legacy_path is not None:
+      legacy = imp.load_source('legacy_duration',legacy_path)
+      baselines = dict((name,benchutils.best_time(function)) for name,function in cases(legacy))
+   return [(name,benchutils.best_time(function),baselines.get(name))
+      for name,function in cases(duration)]
+
+def run_bulk(count=10000):
+   '''
+   Benchmarks parsing and comparing count duration strings as Duration objects and as a
+   DurationArray, returning a list of (name, seconds per call, seconds per call with Durations).
+   '''
+   strings = ["{0}m{1}s".format(i%60,i%47) for i in range(count)]
+   limit = duration.Duration("30m")
+   durations = [duration.Duration(s) for s in strings]
+   array = duration.DurationArray(strings)
+   return [
+      ("parse {0} strings".format(count),
+         benchutils.best_time(lambda: duration.DurationArray(strings)),
+         benchutils.best_time(lambda: [duration.Duration(s) for s in strings])),
+      ("compare {0} durations".format(count),
+         benchutils.best_time(lambda: array < limit),
+         benchutils.best_time(lambda: [d < limit for d in durations])),
+   ]
+
+if __name__ == "__main__":
+   benchutils.print_results("duration",run(sys.argv[1] if len(sys.argv) > 1 else None))
+   benchutils.print_results("DurationArray (baseline: Duration objects)",run_bulk())
@@ -1,5 +1,6 @@
 import unittest
-from duration import Duration, DurationError
+import duration
+from duration import Duration, DurationArray, DurationError
 
 class TestDuration(unittest.TestCase):
    def test_designated_timefield(self):
@@ -81,6 +82,80 @@ class TestDuration(unittest.TestCase):
       with self.assertRaises(DurationError):
          Duration(seconds=-1)
 
+   def test_invalid_strings(self):
+      for string in ["5x","1.5h","abc","4m3q"]:
+         with self.assertRaises(DurationError):
+            Duration(string)
+
+      # parsed strings are cached, but each duration is still its own object
+      first = Duration("4m")
+      second = Duration("4m")
+      first.seconds = 1
+      self.assertEqual(second.seconds,240)
+
+   def test_exact_storage(self):
+      self.assertEqual(Duration("1s100ms").nanoseconds,1100000000)
+      self.assertEqual(Duration(milliseconds=100)*3,Duration(milliseconds=300))
+      self.assertEqual(str(Duration(seconds=1.5)),"1s500ms")
+      self.assertEqual(Duration("2w12d10h43m1s42ms44us458ns").nanoseconds,
+         458+44*10**3+42*10**6+(1+60*(43+60*(10+24*(12+7*2))))*10**9)
+
+   def test_comparison(self):
+      self.assertEqual(Duration("1m30s"),Duration(seconds=90))
+      self.assertEqual(hash(Duration("1m30s")),hash(Duration(seconds=90)))
+      self.assertNotEqual(Duration("1m"),Duration("1m1ns"))
+      self.assertTrue(Duration("59s") < Duration("1m") <= Duration("60s") < Duration("1m1ns"))
+      self.assertTrue(Duration("1h") > Duration("59m") >= Duration("59m"))
+      self.assertEqual(max(Duration("1s"),Duration("1ms")),Duration("1s"))
+      self.assertFalse(Duration())
+      with self.assertRaises(TypeError):
+         Duration("1s") < 2
+
+   def test_arithmetic(self):
+      self.assertEqual(Duration("1m")+Duration("30s"),Duration("1m30s"))
+      self.assertEqual(Duration("1m")-Duration("30s"),Duration("30s"))
+      self.assertEqual(Duration("1m")*2,Duration("2m"))
+      self.assertEqual(2*Duration("1m"),Duration("2m"))
+      self.assertEqual(Duration("1m")*1.5,Duration("1m30s"))
+      self.assertEqual(Duration("1m")/4,Duration("15s"))
+      self.assertEqual(Duration("1m")/Duration("15s"),4.0)
+      with self.assertRaises(DurationError):
+         Duration("1s")-Duration("2s")
+
+class TestDurationArray(unittest.TestCase):
+   def check_array(self):
+      durations = DurationArray(["1m","30s",Duration(hours=2),"1:00:00","1m"])
+      self.assertEqual(len(durations),5)
+      self.assertEqual(durations[0],Duration("1m"))
+      self.assertEqual(list(durations[1:3]),[Duration("30s"),Duration("2h")])
+      self.assertEqual(list(durations.seconds),[60.0,30.0,7200.0,3600.0,60.0])
+      self.assertEqual(list(durations.minutes),[1.0,0.5,120.0,60.0,1.0])
+      self.assertEqual(list(durations.nanoseconds),[60*10**9,30*10**9,7200*10**9,3600*10**9,
+         60*10**9])
+      self.assertEqual(list(durations < Duration("1h")),[True,True,False,False,True])
+      self.assertEqual(list(durations >= DurationArray(["1m"]*5)),[True,False,True,True,True])
+      self.assertEqual(durations.sum(),Duration("3h2m30s"))
+      self.assertEqual(durations.min(),Duration("30s"))
+      self.assertEqual(durations.max(),Duration("2h"))
+      self.assertEqual(list(DurationArray.from_seconds([1.5,0.25])),
+         [Duration("1s500ms"),Duration("250ms")])
+
+      with self.assertRaises(DurationError):
+         DurationArray(["1m","1x"])
+      with self.assertRaises(DurationError):
+         DurationArray([]).min()
+
+   def test_array(self):
+      self.check_array()
+
+   def test_array_without_numpy(self):
+      numpy = duration.numpy
+      duration.numpy = None
+      try:
+         self.check_array()
+      finally:
+         duration.numpy = numpy
+
 if __name__ == "__main__":
    # run unit tests
    unittest.main()
@@ -0,0 +1,303 @@
+'''
+In-process fake of the twitter API, for running and load testing bots offline.
+'''
+
+import collections
+import itertools
+import os.path
+import random
+import threading
+import time
+
+import twitter
+from twitter.ratelimit import EndpointRateLimit
+
+import backend
+import ratelimit
+
+# error codes the fake raises
+ERROR_RATE_LIMIT_EXCEEDED=88
+ERROR_OVER_CAPACITY=130
+ERROR_INTERNAL=131
+ERROR_STATUS_TOO_LONG=186
+ERROR_DUPLICATE_STATUS=187
+ERROR_INVALID_MEDIA=324
+# errors injected at random, with their messages
+INJECTED_ERRORS=[(ERROR_OVER_CAPACITY,"Over capacity"),(ERROR_INTERNAL,"Internal error")]
+# longest status accepted
+MAX_STATUS_LENGTH=280
+# number of statuses kept in each timeline
+TIMELINE_CAPACITY=800
+# default number of statuses returned by a timeline call, and the most that can be asked for
+DEFAULT_COUNT=20
+MAX_COUNT=200
+# synthetic traffic generated by default: statuses per second for each kind of traffic
+DEFAULT_RATES={'home':0.05,'mentions':0.01,'dms':0.0,'commands':0.0}
+WORDS=("the quick brown fox jumps over a lazy dog while bots tweet pictures of cats and "
+   "generated art every hour").split()
+
+def twitter_error(code,message):
+   return twitter.TwitterError([{'code':code,'message':message}])
+
+def format_timestamp(epoch_seconds):
+   return time.strftime('%a %b %d %H:%M:%S +0000 %Y',time.gmtime(epoch_seconds))
+
+class FakeRateLimit(object):
+   '''
+   Rate limit state of the fake API, reported the way python-twitter's RateLimit does.
+   '''
+
+   def __init__(self):
+      self._limits={}
+
+   def get_limit(self,url):
+      return self._limits.get(url,EndpointRateLimit(limit=15,remaining=15,reset=0))
+
+   def set_limit(self,url,limit,remaining,reset):
+      self._limits[url]=EndpointRateLimit(limit=limit,remaining=remaining,reset=reset)
+
+class FakeApi(backend.Backend):
+   '''
+   Stand-in for twitter.Api that keeps the timelines of a fake twitter in memory.
+
+   Synthetic traffic arrives at random (as a Poisson process) at the given rates, in statuses per
+   second: 'home' for statuses of followed users, 'mentions' for statuses mentioning the bot,
+   'dms' for direct messages and 'commands' for mentions from one of the bosses giving one of the
+   commands (e.g. 'status' for '@bot ctl status').  All rates are multiplied by scale, so that a bot
+   can be run at several times its normal volume.  Traffic is generated when a timeline is read,
+   for the time since the last read, so a fake that is not read costs nothing.
+
+   Each call takes latency (plus a random amount up to latency_jitter), and fails with a random
+   over capacity or internal error with probability error_rate.  Rate limits are enforced per
+   resource, with the limits of ratelimit.DEFAULT_LIMITS (overridden by rate_limits), and reported
+   in the rate_limit attribute as twitter.Api does.
+
+   Posts are kept in the bot's own timeline, and in the posts list for inspection; calls counts the
+   calls made to each method.
+   '''
+
+   base_url='https://api.twitter.invalid/1.1'
+   capabilities=frozenset([backend.UPLOAD_MEDIA,backend.POST_MEDIA])
+
+   def __init__(self,screen_name="fakebot",rates=None,scale=1.0,users=None,bosses=("boss",),
+         commands=(),latency=None,latency_jitter=None,error_rate=0.0,rate_limits=None,
+         enforce_rate_limits=True,seed=None,clock=time.time,sleep=time.sleep):
+      self._clock=clock
+      self._sleep=sleep
+      self._random=random.Random(seed)
+      self._lock=threading.Lock()
+      self._ids=itertools.count(1000)
+      self._me=self._new_user(screen_name)
+      self._users=[self._new_user(name) for name in
+         (users if users is not None else ["user{0}".format(i) for i in range(50)])]
+      self._bosses=[self._new_user(name) for name in bosses]
+      self._commands=list(commands)
+      self.rates=dict(DEFAULT_RATES)
+      self.rates.update(rates or {})
+      self.scale=scale
+      self.latency=latency
+      self.latency_jitter=latency_jitter
+      self.error_rate=error_rate
+      self._limits=dict(ratelimit.DEFAULT_LIMITS)
+      self._limits.update(rate_limits or {})
+      self.enforce_rate_limits=enforce_rate_limits
+      self.rate_limit=FakeRateLimit()
+      # resource -> [calls left, time (epoch seconds) the window resets]
+      self._windows={}
+
+      # timelines, newest last: 'home', 'mentions', 'dms' and 'own' (the bot's posts)
+      self._timelines=collections.defaultdict(
+         lambda: collections.deque(maxlen=TIMELINE_CAPACITY))
+      # time traffic was last generated up to, and the next arrival time of each kind of traffic
+      self._generated_until=self._clock()
+      self._next_arrivals={}
+      # media ID -> size in bytes of each uploaded image
+      self._media={}
+
+      self.calls=collections.Counter()
+      self.rate_limited=collections.Counter()
+      self.injected_errors=0
+      self.posts=[]
+
+   def _new_user(self,screen_name):
+      return twitter.User(id=next(self._ids),screen_name=screen_name,name=screen_name)
+
+   def _call(self,method):
+      # latency, then rate limits, then injected errors, as the real API would fail
+      delay=0.0
+      if self.latency is not None:
+         delay+=self.latency.seconds
+      if self.latency_jitter is not None:
+         with self._lock:
+            delay+=self._random.uniform(0,self.latency_jitter.seconds)
+      if delay > 0:
+         self._sleep(delay)
+
+      with self._lock:
+         self.calls[method]+=1
+         resource=ratelimit.API_RESOURCES.get(method)
+         if resource in self._limits:
+            limit,window=self._limits[resource]
+            now=self._clock()
+            state=self._windows.get(resource)
+            if state is None or now >= state[1]:
+               state=self._windows[resource]=[limit,now+window]
+            if state[0] <= 0 and self.enforce_rate_limits:
+               self.rate_limited[method]+=1
+               raise twitter_error(ERROR_RATE_LIMIT_EXCEEDED,"Rate limit exceeded")
+            state[0]=max(state[0]-1,0)
+            self.rate_limit.set_limit("{0}{1}.json".format(self.base_url,resource),limit,state[0],
+               int(state[1]))
+         if self.error_rate > 0 and self._random.random() < self.error_rate:
+            self.injected_errors+=1
+            raise twitter_error(*self._random.choice(INJECTED_ERRORS))
+
+   def _generate(self):
+      '''
+      Generates the traffic that arrived since the last call.  Called with the lock held.
+      '''
+      now=self._clock()
+      while True:
+         for kind,rate in self.rates.items():
+            if kind not in self._next_arrivals and rate*self.scale > 0:
+               self._next_arrivals[kind]=self._generated_until+ \
+                  self._random.expovariate(rate*self.scale)
+         due=[(arrival,kind) for kind,arrival in self._next_arrivals.items() if arrival <= now]
+         if not due:
+            break
+         arrival,kind=min(due)
+         del self._next_arrivals[kind]
+         self._generated_until=arrival
+         self._arrive(kind,arrival)
+      self._generated_until=now
+
+   def _arrive(self,kind,created_at):
+      text=" ".join(self._random.sample(WORDS,self._random.randint(3,8)))
+      if kind == 'home':
+         self._timelines['home'].append(self._status(self._random.choice(self._users),text,
+            created_at))
+      elif kind == 'mentions' or (kind == 'commands' and self._commands and self._bosses):
+         if kind == 'commands':
+            user=self._random.choice(self._bosses)
+            text="ctl {0}".format(self._random.choice(self._commands))
+         else:
+            user=self._random.choice(self._users)
+         # replies in threads carry the handles of everyone in the thread
+         others=self._random.sample(self._users,min(len(self._users),self._random.randint(0,3)))
+         mentioned=[self._me]+[other for other in others if other is not user]
+         text=" ".join(["@"+m.screen_name for m in mentioned]+[text])
+         self._timelines['mentions'].append(self._status(user,text,created_at,mentioned))
+      elif kind == 'dms':
+         user=self._random.choice(self._users)
+         self._timelines['dms'].append(twitter.DirectMessage.NewFromJsonDict({
+            'id':next(self._ids),'text':text,'created_at':format_timestamp(created_at),
+            'sender_id':user.id,'sender_screen_name':user.screen_name,
+            'sender':user.AsDict(),'recipient_id':self._me.id,
+            'recipient_screen_name':self._me.screen_name}))
+
+   def _status(self,user,text,created_at,mentioned=(),in_reply_to_status_id=None):
+      mentions=[]
+      position=0
+      for mentioned_user in mentioned:
+         position=text.find("@"+mentioned_user.screen_name,position)
+         end=position+len(mentioned_user.screen_name)+1
+         mentions.append({'id':mentioned_user.id,'screen_name':mentioned_user.screen_name,
+            'name':mentioned_user.name,'indices':[position,end]})
+         position=end
+      return twitter.Status.NewFromJsonDict({'id':next(self._ids),'text':text,
+         'created_at':format_timestamp(created_at),'user':user.AsDict(),
+         'in_reply_to_status_id':in_reply_to_status_id,'entities':{'user_mentions':mentions}})
+
+   def _read(self,timeline,since_id=None,max_id=None,count=None,matches=None):
+      '''
+      Returns the statuses of a timeline, newest first, like the API's timeline calls.
+      '''
+      count=min(count or DEFAULT_COUNT,MAX_COUNT)
+      with self._lock:
+         self._generate()
+         statuses=[]
+         for status in reversed(self._timelines[timeline]):
+            if since_id is not None and status.id <= since_id:
+               break
+            if (max_id is None or status.id <= max_id) and (matches is None or matches(status)):
+               statuses.append(status)
+               if len(statuses) == count:
+                  break
+         return statuses
+
+   def VerifyCredentials(self,**kwargs):
+      self._call('VerifyCredentials')
+      return self._me
+
+   def GetHomeTimeline(self,count=None,since_id=None,max_id=None,**kwargs):
+      self._call('GetHomeTimeline')
+      return self._read('home',since_id,max_id,count)
+
+   def GetReplies(self,since_id=None,count=None,max_id=None,**kwargs):
+      self._call('GetReplies')
+      return self._read('own',since_id,max_id,count,
+         lambda status: status.in_reply_to_status_id is not None)
+
+   def GetMentions(self,count=None,since_id=None,max_id=None,**kwargs):
+      self._call('GetMentions')
+      return self._read('mentions',since_id,max_id,count)
+
+   def GetDirectMessages(self,since_id=None,max_id=None,count=None,**kwargs):
+      self._call('GetDirectMessages')
+      return self._read('dms',since_id,max_id,count)
+
+   def GetUserTimeline(self,user_id=None,screen_name=None,since_id=None,max_id=None,count=None,
+         **kwargs):
+      self._call('GetUserTimeline')
+      if screen_name == self._me.screen_name or user_id == self._me.id:
+         return self._read('own',since_id,max_id,count)
+      return self._read('home',since_id,max_id,count,lambda status:
+         status.user.screen_name == screen_name or status.user.id == user_id)
+
+   def UploadMediaSimple(self,media,**kwargs):
+      self._call('UploadMediaSimple')
+      return self._upload(media)
+
+   def UploadMediaChunked(self,media,**kwargs):
+      self._call('UploadMediaChunked')
+      return self._upload(media)
+
+   def _upload(self,media):
+      if isinstance(media,basestring):
+         size=os.path.getsize(media)
+      else:
+         size=len(media.read())
+      with self._lock:
+         media_id=next(self._ids)
+         self._media[media_id]=size
+      return media_id
+
+   def PostUpdate(self,status,media=None,in_reply_to_status_id=None,**kwargs):
+      self._call('PostUpdate')
+      if media is not None:
+         with self._lock:
+            unknown=[media_id for media_id in (media if isinstance(media,list) else [media])
+               if media_id not in self._media]
+         if unknown:
+            raise twitter_error(ERROR_INVALID_MEDIA,"The validation of media ids failed.")
+      return self._post(status,in_reply_to_status_id,media)
+
+   def PostMedia(self,status,media,in_reply_to_status_id=None,**kwargs):
+      self._call('PostMedia')
+      return self._post(status,in_reply_to_status_id,[self._upload(media)])
+
+   def PostMultipleMedia(self,status,media,in_reply_to_status_id=None,**kwargs):
+      self._call('PostMultipleMedia')
+      return self._post(status,in_reply_to_status_id,[self._upload(m) for m in media])
+
+   def _post(self,text,in_reply_to_status_id,media):
+      if len(text) > MAX_STATUS_LENGTH:
+         raise twitter_error(ERROR_STATUS_TOO_LONG,"Status is over 280 characters.")
+      with self._lock:
+         if any(status.text == text for status in list(self._timelines['own'])[-20:]):
+            raise twitter_error(ERROR_DUPLICATE_STATUS,"Status is a duplicate.")
+         status=self._status(self._me,text,self._clock(),
+            in_reply_to_status_id=in_reply_to_status_id)
+         self._timelines['own'].append(status)
+         self.posts.append((status,media))
+      return status
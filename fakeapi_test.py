@@ -0,0 +1,162 @@
+import io
+import itertools
+import shutil
+import tempfile
+import time
+import unittest
+import twitter
+import backend
+import command
+import fakeapi
+from duration import Duration
+from testutils import FakeClock, make_bot
+from twitterbot import TwitterBot, twitter_error_code
+
+pings = itertools.count(1)
+
+@command.register("fakeping")
+def fakeping(bot):
+   return "pong {0}".format(next(pings))
+
+class TestFakeApi(unittest.TestCase):
+   def setUp(self):
+      self.clock = FakeClock()
+
+   def fake(self,**kwargs):
+      return fakeapi.FakeApi(seed=1,clock=self.clock,sleep=self.clock.sleep,**kwargs)
+
+   def test_backend(self):
+      fake = self.fake()
+      self.assertIs(backend.create(api_backend=fake),fake)
+      self.assertEqual(backend.missing_methods(fake),[])
+      self.assertTrue(backend.uploads_media(fake))
+      self.assertEqual(backend.capabilities(fake),
+         frozenset([backend.UPLOAD_MEDIA,backend.POST_MEDIA]))
+      api = twitter.Api()
+      self.assertTrue(isinstance(api,backend.Backend))
+      self.assertEqual(backend.missing_methods(api),[])
+      self.assertEqual(backend.capabilities(api),backend.TWITTER_API_CAPABILITIES)
+      self.assertTrue(backend.TWITTER_API_CAPABILITIES)
+      with self.assertRaises(backend.BackendError):
+         backend.create(api_backend=object())
+
+   def test_backend_capabilities(self):
+      class PostingBackend(fakeapi.FakeApi):
+         capabilities = frozenset([backend.POST_MEDIA])
+      posting = PostingBackend(seed=1)
+      self.assertIs(backend.create(api_backend=posting),posting)
+      self.assertFalse(backend.uploads_media(posting))
+
+      # a backend has to declare a way of posting media, and have the methods it declares
+      class NoMedia(fakeapi.FakeApi):
+         capabilities = frozenset()
+      class Unknown(fakeapi.FakeApi):
+         capabilities = frozenset([backend.UPLOAD_MEDIA,'teleport'])
+      class Missing(fakeapi.FakeApi):
+         capabilities = frozenset([backend.UPLOAD_MEDIA])
+         UploadMediaChunked = None
+      for backend_class in (NoMedia,Unknown,Missing):
+         with self.assertRaises(backend.BackendError):
+            backend.create(api_backend=backend_class(seed=1))
+      self.assertEqual(backend.missing_methods(Missing(seed=1)),['UploadMediaChunked'])
+
+      # the required methods are abstract
+      class Incomplete(backend.Backend):
+         def VerifyCredentials(self):
+            return None
+      with self.assertRaises(TypeError):
+         Incomplete()
+
+   def test_traffic(self):
+      api = self.fake(rates={'home':1.0,'mentions':0.5,'dms':0.1},scale=2.0)
+      self.assertEqual(api.GetHomeTimeline(),[])
+      self.clock.now += 100
+      home = api.GetHomeTimeline(count=200)
+      mentions = api.GetMentions(count=200)
+      # about rate * scale * 100 statuses of each kind
+      self.assertTrue(150 < len(home) < 250,len(home))
+      self.assertTrue(70 < len(mentions) < 130,len(mentions))
+      self.assertTrue(0 < len(api.GetDirectMessages(count=200)) < 40)
+      ids = [status.id for status in home]
+      self.assertEqual(ids,sorted(ids,reverse=True))
+      self.assertEqual(len(api.GetHomeTimeline()),fakeapi.DEFAULT_COUNT)
+      self.assertEqual(api.GetMentions(since_id=mentions[3].id),mentions[:3])
+      me = api.VerifyCredentials()
+      self.assertTrue(all(status.text.startswith("@"+me.screen_name) for status in mentions))
+      self.assertTrue(all(me.id in [user.id for user in status.user_mentions]
+         for status in mentions))
+      user = home[0].user.screen_name
+      self.assertTrue(all(status.user.screen_name == user for status in
+         api.GetUserTimeline(screen_name=user)))
+
+   def test_rate_limits(self):
+      api = self.fake(rate_limits={'/statuses/mentions_timeline':(3,60)})
+      for _ in range(3):
+         api.GetMentions()
+      with self.assertRaises(twitter.TwitterError) as raised:
+         api.GetMentions()
+      self.assertEqual(twitter_error_code(raised.exception),fakeapi.ERROR_RATE_LIMIT_EXCEEDED)
+      self.assertEqual(api.rate_limited['GetMentions'],1)
+      limit = api.rate_limit.get_limit(api.base_url+'/statuses/mentions_timeline.json')
+      self.assertEqual((limit.limit,limit.remaining),(3,0))
+      self.clock.now += 60
+      api.GetMentions()
+
+   def test_latency_and_errors(self):
+      api = self.fake(latency=Duration(milliseconds=100),error_rate=0.5,enforce_rate_limits=False)
+      errors = 0
+      for _ in range(100):
+         try:
+            api.GetHomeTimeline()
+         except twitter.TwitterError,te:
+            self.assertIn(twitter_error_code(te),(fakeapi.ERROR_OVER_CAPACITY,
+               fakeapi.ERROR_INTERNAL))
+            errors += 1
+      self.assertEqual(errors,api.injected_errors)
+      self.assertTrue(30 < errors < 70)
+      self.assertAlmostEqual(self.clock.now,1500000010.0,places=3)
+
+   def test_posts(self):
+      api = self.fake()
+      status = api.PostUpdate("hello",in_reply_to_status_id=5)
+      self.assertEqual(api.GetReplies(),[status])
+      for text,code in (("hello",fakeapi.ERROR_DUPLICATE_STATUS),
+                        ("x"*281,fakeapi.ERROR_STATUS_TOO_LONG)):
+         with self.assertRaises(twitter.TwitterError) as raised:
+            api.PostUpdate(text)
+         self.assertEqual(twitter_error_code(raised.exception),code)
+      with self.assertRaises(twitter.TwitterError):
+         api.PostUpdate("bad media",media=[1])
+      media_id = api.UploadMediaSimple(io.BytesIO(b"image"))
+      api.PostUpdate("image",media=[media_id])
+      self.assertEqual(api.GetUserTimeline(screen_name="fakebot")[0].text,"image")
+      self.assertEqual(len(api.posts),2)
+
+class TestBotOnFakeApi(unittest.TestCase):
+   def setUp(self):
+      self.directory = tempfile.mkdtemp()
+
+   def tearDown(self):
+      shutil.rmtree(self.directory)
+
+   def test_commands(self):
+      clock = FakeClock(time.time())
+      api = fakeapi.FakeApi(rates={'home':0,'mentions':0,'commands':10},commands=["fakeping"],
+         seed=1,clock=clock)
+      bot = make_bot(TwitterBot,api,self.directory,check_period=Duration(milliseconds=10))
+      bot.start()
+      try:
+         clock.now += 1.0
+         bot.tick()
+      finally:
+         bot.shutdown()
+      commands = api.GetMentions(count=200)
+      self.assertTrue(len(commands) > 0)
+      # one reply for each command, answered in order
+      self.assertEqual([status.in_reply_to_status_id for status,_ in api.posts],
+         [status.id for status in reversed(commands)])
+      self.assertTrue(all(status.text.startswith("@boss pong") for status,_ in api.posts))
+
+if __name__ == "__main__":
+   # run unit tests
+   unittest.main()
@@ -5,7 +5,37 @@ Simple imagebot example
 from twitterbot import TwitterBot
 import timeutils
 import duration
+import mediabuffer
+import collections
+import math
+import multiprocessing
+import os
 import os.path
+import shutil
+import tempfile
+
+def generate_in_directory(generator,directory,encoding):
+   '''
+   Runs a generator in the given working directory, so that generators which always save to the
+   same filename can run side by side.  Returns (media, message), where media is the absolute image
+   filename or a MediaBuffer (images in memory are encoded here, with the given encoding settings).
+   Runs in a prefetch worker process.
+   '''
+   cwd=os.getcwd()
+   os.chdir(directory)
+   try:
+      image,message=generator()
+      media=mediabuffer.to_media(image,**encoding)
+   finally:
+      os.chdir(cwd)
+   if isinstance(media,basestring):
+      media=os.path.join(directory,media)
+   return (media,message)
+
+def is_image_tweet(post):
+   # posts queued by tweet_image() and tweet_multiple_images(), as opposed to replies with images
+   return post['kind'] in ('media','multiple_media') and \
+      post.get('in_reply_to_status_id') is None
 
 class ImageBot(TwitterBot):
 
@@ -13,15 +43,68 @@ class ImageBot(TwitterBot):
       self._period_between_tweets = duration.Duration(hours=1)
       if 'period_between_tweets' in kwargs:
          self._period_between_tweets = kwargs['period_between_tweets']
+      # encoder settings for images generated in memory: format (e.g. 'PNG' or 'JPEG'), quality
+      # (for lossy formats) and whether to optimize the encoding.  Trades encoding CPU against
+      # upload size
+      self._image_encoding = {'format':kwargs.get('image_format','PNG'),
+                              'quality':kwargs.get('image_quality'),
+                              'optimize':kwargs.get('image_optimize',False)}
+      # number of processes generating images ahead of time (only used if generator() is
+      # implemented)
+      self._prefetch_workers = kwargs.get('prefetch_workers',1)
+      # number of generated images to keep ready.  By default, enough to cover the tweets that fall
+      # due within one check period, plus one being generated
+      self._prefetch_depth = kwargs.get('prefetch_depth')
+      if self._prefetch_depth is None:
+         self._prefetch_depth = min(4,1+int(math.ceil(
+            float(self._check_period.seconds)/self._period_between_tweets.seconds)))
+      # directory under which each prefetched image gets its own working directory (None for the
+      # system temporary directory)
+      self._prefetch_directory = kwargs.get('prefetch_directory')
+      # process pool generating images, and the pending results (with their working directories) in
+      # the order they were started
+      self._prefetch_pool = None
+      self._prefetched = collections.deque()
+      # working directories of prefetched images that were tweeted, with the post handles, so they
+      # can be removed once posted
+      self._posted_directories = []
+      # handle of the last image post, so another image is not tweeted while it waits in the post
+      # queue (the bot's own timeline only shows an image once it is posted)
+      self._image_post = None
       self.add_self_to_watched_timelines()
 
+   def start(self,fetch_pool=None):
+      # the pool is forked before the bot starts its own threads (fetch pool, post queue, stream).
+      # Threads already running in the process, such as the log writer or a BotHost's pools, are
+      # not copied into the workers, and neither are any locks they hold; the workers only run the
+      # generator and encode its image, which take none of those locks
+      if self._prefetch_pool is None and self.generator() is not None:
+         self._prefetch_pool = multiprocessing.Pool(self._prefetch_workers)
+         self.fill_prefetch_buffer()
+      super(ImageBot,self).start(fetch_pool)
+
+   def shutdown(self):
+      if self._prefetch_pool is not None:
+         self._prefetch_pool.terminate()
+         self._prefetch_pool.join()
+         self._prefetch_pool = None
+         while self._prefetched:
+            shutil.rmtree(self._prefetched.popleft()[1],ignore_errors=True)
+      super(ImageBot,self).shutdown()
+      self.remove_posted_directories()
+
    def on_watched_timelines(self,statuses):
       if self._me.screen_name not in statuses:
          return
+      if self.image_post_pending():
+         self._log.debug('image_post_pending',
+            "the last image has not been posted yet; not tweeting another")
+         return
       my_timeline = statuses[self._me.screen_name]
       if len(my_timeline)==0:
          # no tweets yet, let's get started!
-         print "WARNING: No tweets found for this bot. Proceeding with initial tweet!"
+         self._log.warning('no_tweets',
+            "no tweets found for this bot; proceeding with initial tweet")
          self.generate_and_tweet()
       else:
          most_recent_tweet=my_timeline[0]
@@ -30,14 +113,87 @@ class ImageBot(TwitterBot):
             self.generate_and_tweet()
 
    def generate_and_tweet(self):
-      image_filename,message = self.generate()
-      if image_filename and os.path.isfile(image_filename):
-         self.tweet_image(image_filename,message)
+      directory = None
+      if self._prefetch_pool is not None:
+         self.remove_posted_directories()
+         if not self._prefetched or not self._prefetched[0][0].ready():
+            self._log.warning('prefetch_not_ready',
+               "no prefetched image is ready yet; tweeting on a later update")
+            return
+         result,directory = self._prefetched.popleft()
+         self.fill_prefetch_buffer()
+         try:
+            media,message = result.get()
+         except Exception:
+            self._log.exception('image_generation_failed',"image generation failed")
+            shutil.rmtree(directory,ignore_errors=True)
+            return
+      else:
+         image,message = self.generate()
+         media = mediabuffer.to_media(image,**self._image_encoding)
+
+      if media is not None:
+         handle = self.tweet_image(media,message)
+         self._image_post = handle
+         if directory is not None and isinstance(media,basestring):
+            self._posted_directories.append((handle,directory))
+            directory = None
+      if directory is not None:
+         shutil.rmtree(directory,ignore_errors=True)
+
+   def image_post_pending(self):
+      '''
+      Returns whether an image tweeted earlier is still waiting in the post queue (for rate limit
+      budget or a retry), including one left in the post queue file by an earlier run.
+      '''
+      if self._image_post is None or self._image_post.done():
+         handles = self._post_queue.pending(is_image_tweet)
+         self._image_post = handles[-1] if handles else None
+      return self._image_post is not None and not self._image_post.done()
+
+   def fill_prefetch_buffer(self):
+      '''
+      Starts generating images in the prefetch pool until prefetch_depth images are ready or on
+      their way.
+      '''
+      generator = self.generator()
+      while len(self._prefetched) < self._prefetch_depth:
+         directory = tempfile.mkdtemp(prefix="imagebot-",dir=self._prefetch_directory)
+         self._prefetched.append((self._prefetch_pool.apply_async(generate_in_directory,
+            (generator,directory,self._image_encoding)),directory))
+
+   def remove_posted_directories(self):
+      '''
+      Removes the working directories of prefetched images whose posts were sent (or failed for
+      good).  Images still waiting in the post queue are kept.
+      '''
+      pending = []
+      for handle,directory in self._posted_directories:
+         if handle.done():
+            shutil.rmtree(directory,ignore_errors=True)
+         else:
+            pending.append((handle,directory))
+      self._posted_directories = pending
 
    def generate(self):
       '''
-      Generates an image, saves it to a file, and returns the name of the file.
+      Generates an image and returns (image, message).  The image can be the name of a file it was
+      saved to, a PIL image (encoded with the bot's image_format, image_quality and image_optimize
+      settings), or encoded image data (bytes, bytearray, memoryview or mediabuffer.MediaBuffer);
+      images in memory are uploaded without going through a file.
 
       Implemented in subclass.
       '''
       return (None,None)
+
+   def generator(self):
+      '''
+      Returns a picklable callable (e.g. a module level function) that generates an image like
+      generate() does.  If one is returned, images are generated ahead of time in a pool of
+      prefetch_workers processes, keeping up to prefetch_depth of them ready, and the generator is
+      used instead of generate().  The generator runs in its own working directory, so it may save
+      to a fixed filename.
+
+      Optionally implemented in subclass.
+      '''
+      return None
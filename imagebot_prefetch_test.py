@@ -0,0 +1,170 @@
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+import unittest
+from StringIO import StringIO
+import botlog
+import fakeapi
+from duration import Duration
+from imagebot import ImageBot
+from testutils import make_bot
+
+def named_image():
+   # generators run in their own working directories, so they can all save to the same filename;
+   # the directory also identifies the image
+   time.sleep(random.uniform(0.0,0.05))
+   with open("image.png","wb") as image_file:
+      image_file.write(b"\x89PNG\r\n\x1a\n image data")
+   return ("image.png",os.path.basename(os.getcwd()))
+
+def broken_image():
+   raise ValueError("no image today")
+
+class PrefetchBot(ImageBot):
+   def on_subclass_init(self,**kwargs):
+      self.image_generator = kwargs.pop('image_generator')
+      super(PrefetchBot,self).on_subclass_init(**kwargs)
+
+   def generator(self):
+      return self.image_generator
+
+class MemoryImageBot(ImageBot):
+   def on_subclass_init(self,**kwargs):
+      super(MemoryImageBot,self).on_subclass_init(**kwargs)
+      self.generated = 0
+
+   def generate(self):
+      self.generated += 1
+      return (b"\x89PNG\r\n\x1a\n image data","image {0}".format(self.generated))
+
+class TestImagePostPending(unittest.TestCase):
+   def setUp(self):
+      self.directory = tempfile.mkdtemp()
+      self.api = fakeapi.FakeApi(rates={'home':0,'mentions':0},seed=1)
+
+   def tearDown(self):
+      shutil.rmtree(self.directory)
+
+   def bot(self):
+      # no media uploads are allowed, so image posts stay in the queue
+      return make_bot(MemoryImageBot,self.api,self.directory,
+         rate_limits={'/media/upload':(0,900)},post_drain_timeout=Duration(),
+         period_between_tweets=Duration(seconds=1),log=botlog.open_log(StringIO()))
+
+   def test_blocked_posting(self):
+      bot = self.bot()
+      bot.start()
+      try:
+         for index in range(4):
+            bot.tick()
+         # the bot's timeline stays empty, but only the first image is queued
+         self.assertEqual(bot.generated,1)
+         self.assertEqual(len(bot._post_queue),1)
+      finally:
+         bot.shutdown()
+      self.assertEqual(self.api.posts,[])
+
+   def test_persisted_post(self):
+      bot = self.bot()
+      bot.start()
+      bot.tick()
+      bot.shutdown()
+      # the image post left in the post queue file by the first run counts as pending
+      bot = self.bot()
+      bot.start()
+      try:
+         bot.tick()
+         self.assertEqual(bot.generated,0)
+         self.assertEqual(len(bot._post_queue),1)
+      finally:
+         bot.shutdown()
+
+class TestPrefetch(unittest.TestCase):
+   def setUp(self):
+      self.directory = tempfile.mkdtemp()
+      self.prefetch_directory = os.path.join(self.directory,"prefetch")
+      os.mkdir(self.prefetch_directory)
+      self.api = fakeapi.FakeApi(rates={'home':0,'mentions':0},seed=1)
+      self.output = StringIO()
+
+   def tearDown(self):
+      shutil.rmtree(self.directory)
+
+   def bot(self,generator):
+      return make_bot(PrefetchBot,self.api,self.directory,image_generator=generator,
+         prefetch_workers=2,prefetch_depth=3,prefetch_directory=self.prefetch_directory,
+         log=botlog.open_log(self.output))
+
+   def tweet_when_ready(self,bot):
+      result = bot._prefetched[0][0]
+      result.wait(10)
+      self.assertTrue(result.ready())
+      bot.generate_and_tweet()
+
+   def events(self,bot):
+      bot._log.pipeline.close()
+      return [json.loads(line)['event'] for line in self.output.getvalue().splitlines()]
+
+   def test_order(self):
+      bot = self.bot(named_image)
+      bot.start()
+      try:
+         started = []
+         for index in range(6):
+            started.append(os.path.basename(bot._prefetched[0][1]))
+            self.tweet_when_ready(bot)
+            # the buffer is topped up as images are taken
+            self.assertEqual(len(bot._prefetched),3)
+      finally:
+         bot.shutdown()
+      # images are tweeted in the order they were started, however long each one took
+      tweets = self.api.GetUserTimeline(screen_name="fakebot",count=200)
+      self.assertEqual([tweet.text for tweet in reversed(tweets)],started)
+
+   def test_generation_failure(self):
+      bot = self.bot(broken_image)
+      bot.start()
+      try:
+         failed = bot._prefetched[0][1]
+         self.tweet_when_ready(bot)
+         # nothing is tweeted, the failed image's directory is removed and another is started
+         self.assertFalse(os.path.exists(failed))
+         self.assertEqual(len(bot._prefetched),3)
+      finally:
+         bot.shutdown()
+      self.assertEqual(self.api.GetUserTimeline(screen_name="fakebot"),[])
+      self.assertEqual(self.events(bot).count('image_generation_failed'),1)
+
+   def test_not_ready(self):
+      bot = self.bot(named_image)
+      bot.start()
+      try:
+         # nothing is generated in the foreground while the prefetched images are on their way
+         while bot._prefetched[0][0].ready():
+            self.tweet_when_ready(bot)
+         bot.generate_and_tweet()
+      finally:
+         bot.shutdown()
+      self.assertIn('prefetch_not_ready',self.events(bot))
+
+   def test_shutdown(self):
+      bot = self.bot(named_image)
+      bot.start()
+      workers = list(bot._prefetch_pool._pool)
+      self.assertEqual(len(workers),2)
+      self.tweet_when_ready(bot)
+      bot.shutdown()
+      # the workers are stopped and every working directory is removed, including those of
+      # images that were never tweeted
+      self.assertIsNone(bot._prefetch_pool)
+      self.assertFalse(any(worker.is_alive() for worker in workers))
+      self.assertEqual(len(bot._prefetched),0)
+      self.assertEqual(os.listdir(self.prefetch_directory),[])
+      self.assertEqual(len(self.api.GetUserTimeline(screen_name="fakebot")),1)
+
+if __name__ == "__main__":
+   # run unit tests
+   unittest.main()
@@ -16,11 +16,10 @@ class ImageBotTest(ImageBot):
       pixels = array.array('B',[r,g,b]*256**2)
       img = Image.frombytes('RGB',(256,256),pixels)
 
-      image_filename="unittest.png"
-      img.save(image_filename)
+      # the image is encoded and uploaded from memory
       message = "UnitTest: ImageBotTest {0},{1},{2} ({3})".format(r,g,b,str(dt.datetime.utcnow()))
-      print "Generated image {0}, tweeting with message: {1}".format(image_filename,message)
-      return (image_filename,message)
+      print "Generated image, tweeting with message: {0}".format(message)
+      return (img,message)
 
    def on_update_end(self):
       # only run once
@@ -0,0 +1,105 @@
+'''
+Runs a bot against the fake API (fakeapi.FakeApi) at a multiple of normal traffic, and reports how
+it keeps up.
+
+   python loadtest.py [scale] [seconds]
+
+Rate limits are lifted, so that what is measured is the bot's own throughput; pass
+production_limits=True to run() to see how the bot defers calls under the real limits instead.
+'''
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import command
+import duration
+import fakeapi
+import ratelimit
+import storage
+from twitterbot import TwitterBot
+
+# normal traffic, in statuses per second, that scale multiplies
+BASE_RATES={'home':0.5,'mentions':0.2,'dms':0.05,'commands':0.05}
+
+@command.register("loadtest")
+def loadtest(bot):
+   return "ok {0:.6f}".format(time.time())
+
+class LoadTestBot(TwitterBot):
+   def on_subclass_init(self,**kwargs):
+      self._do_process_home_timeline = True
+      self._do_process_direct_messages = True
+      self._run_until = None
+      # number of statuses handed to each hook, and the time spent in each update
+      self.handled = dict((feed,0) for feed in ('home','mentions','dms'))
+      self.update_times = []
+
+   def on_update_start(self):
+      self._update_started = time.time()
+
+   def on_update_end(self):
+      self.update_times.append(time.time()-self._update_started)
+      if time.time() >= self._run_until:
+         self._running = False
+
+   def on_home_timeline(self,statuses):
+      self.handled['home'] += len(statuses)
+
+   def on_mentions(self,statuses):
+      self.handled['mentions'] += len(statuses)
+
+   def on_dms(self,statuses):
+      self.handled['dms'] += len(statuses)
+
+   def run_for(self,seconds):
+      self._run_until = time.time()+seconds
+      self.run()
+
+def run(scale=10.0,seconds=30.0,check_period=duration.Duration(seconds=1),
+      latency=duration.Duration(milliseconds=50),error_rate=0.01,production_limits=False):
+   '''
+   Runs the load test and returns a dictionary of results.
+   '''
+   limits = None
+   if not production_limits:
+      limits = dict((resource,(10**9,window)) for resource,(_,window) in
+         ratelimit.DEFAULT_LIMITS.items())
+   api = fakeapi.FakeApi(rates=BASE_RATES,scale=scale,commands=["loadtest"],latency=latency,
+      error_rate=error_rate,rate_limits=limits,seed=1)
+
+   directory = tempfile.mkdtemp(prefix="loadtest-")
+   cwd = os.getcwd()
+   os.chdir(directory)
+   try:
+      storage.save_list(["boss"],"allowed_bosses.dat")
+      bot = LoadTestBot(api_backend=api,check_period=check_period,rate_limits=limits,
+         post_interval=duration.Duration())
+      bot.run_for(seconds)
+   finally:
+      os.chdir(cwd)
+      shutil.rmtree(directory,ignore_errors=True)
+
+   usage = bot._budgeter.usage()
+   return {'scale':scale,
+           'seconds':seconds,
+           'updates':len(bot.update_times),
+           'overruns':bot._scheduler.overruns,
+           'mean update seconds':sum(bot.update_times)/max(len(bot.update_times),1),
+           'slowest update seconds':max(bot.update_times or [0]),
+           'statuses handled':bot.handled,
+           'api calls':dict(api.calls),
+           'calls deferred':sum(budget['deferred'] for budget in usage.values()),
+           'rate limited':sum(api.rate_limited.values()),
+           'injected errors':api.injected_errors,
+           'posts sent':len(api.posts)}
+
+if __name__ == "__main__":
+   scale = float(sys.argv[1]) if len(sys.argv) > 1 else 10.0
+   seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 30.0
+   results = run(scale,seconds)
+   print "="*20,"load test","="*20
+   for name in sorted(results):
+      print "{0:<30} {1}".format(name,results[name])
@@ -0,0 +1,103 @@
+'''
+Small thread-safe least-recently-used cache.
+'''
+
+import threading
+
+# fields of the links in the recently used list
+PREV,NEXT,KEY,VALUE=0,1,2,3
+
+class LRUCache(object):
+   '''
+   Mapping of at most capacity entries; when full, adding an entry evicts the one used least
+   recently.  Lookups and insertions are O(1).
+
+   Entries are kept in a dictionary of key -> link in a circular, doubly linked list ordered from
+   least to most recently used (collections.OrderedDict does the same, but is much slower under
+   python 2).
+   '''
+
+   def __init__(self,capacity=128):
+      self._capacity=capacity
+      self._links={}
+      # sentinel of the recently used list: root[NEXT] is the least recently used link
+      self._root=[]
+      self._root[:]=[self._root,self._root,None,None]
+      self._lock=threading.Lock()
+      # lookups that found / did not find their key
+      self.hits=0
+      self.misses=0
+
+   @property
+   def capacity(self):
+      return self._capacity
+
+   def __len__(self):
+      return len(self._links)
+
+   def __contains__(self,key):
+      return key in self._links
+
+   def get(self,key,default=None):
+      '''
+      Returns the value cached for a key (marking it as the most recently used), or default.
+      '''
+      with self._lock:
+         link=self._links.get(key)
+         if link is None:
+            self.misses+=1
+            return default
+         # move the link to the most recently used end
+         link_prev,link_next,_,value=link
+         link_prev[NEXT]=link_next
+         link_next[PREV]=link_prev
+         root=self._root
+         last=root[PREV]
+         last[NEXT]=root[PREV]=link
+         link[PREV]=last
+         link[NEXT]=root
+         self.hits+=1
+         return value
+
+   def put(self,key,value):
+      with self._lock:
+         root=self._root
+         link=self._links.pop(key,None)
+         if link is not None:
+            link[PREV][NEXT]=link[NEXT]
+            link[NEXT][PREV]=link[PREV]
+         last=root[PREV]
+         link=[last,root,key,value]
+         last[NEXT]=root[PREV]=self._links[key]=link
+         if len(self._links) > self._capacity:
+            oldest=root[NEXT]
+            root[NEXT]=oldest[NEXT]
+            oldest[NEXT][PREV]=root
+            del self._links[oldest[KEY]]
+
+   def clear(self):
+      with self._lock:
+         self._links.clear()
+         self._root[:]=[self._root,self._root,None,None]
+         self.hits=0
+         self.misses=0
+
+def lru_cached(capacity=128):
+   '''
+   Decorator that caches the results of a function of one hashable argument in an LRUCache, which is
+   available as the cache attribute of the decorated function.
+   '''
+   def decorate(function):
+      cache=LRUCache(capacity)
+      missing=object()
+      def cached(argument):
+         value=cache.get(argument,missing)
+         if value is missing:
+            value=function(argument)
+            cache.put(argument,value)
+         return value
+      cached.__name__=function.__name__
+      cached.__doc__=function.__doc__
+      cached.cache=cache
+      return cached
+   return decorate
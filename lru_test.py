@@ -0,0 +1,29 @@
+import unittest
+from lru import LRUCache, lru_cached
+
+class TestLRUCache(unittest.TestCase):
+   def test_eviction(self):
+      cache = LRUCache(2)
+      cache.put('a',1)
+      cache.put('b',2)
+      self.assertEqual(cache.get('a'),1)
+      cache.put('c',3)
+      self.assertFalse('b' in cache)
+      self.assertEqual((cache.get('a'),cache.get('c'),len(cache)),(1,3,2))
+      cache.put('a',4)
+      cache.put('d',5)
+      self.assertEqual((cache.get('a'),cache.get('c'),cache.get('d')),(4,None,5))
+
+   def test_decorator(self):
+      calls = []
+      @lru_cached(2)
+      def square(x):
+         calls.append(x)
+         return x*x
+      self.assertEqual([square(2),square(2),square(3),square(2)],[4,4,9,4])
+      self.assertEqual(calls,[2,3])
+      self.assertEqual((square.cache.hits,square.cache.misses),(2,2))
+
+if __name__ == "__main__":
+   # run unit tests
+   unittest.main()
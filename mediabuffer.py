@@ -0,0 +1,148 @@
+'''
+Encoded images held in memory, usable wherever the bot would otherwise upload an image file.
+'''
+
+import hashlib
+import io
+import os.path
+
+# leading bytes of each encoded image format that can be posted, and its file extension
+IMAGE_SIGNATURES=[
+   (b'\x89PNG\r\n\x1a\n','.png'),
+   (b'\xff\xd8\xff','.jpg'),
+   (b'GIF87a','.gif'),
+   (b'GIF89a','.gif'),
+   (b'BM','.bmp'),
+]
+
+# file extension of each PIL image format
+FORMAT_EXTENSIONS={
+   'PNG':'.png',
+   'JPEG':'.jpg',
+   'GIF':'.gif',
+   'WEBP':'.webp',
+   'BMP':'.bmp',
+}
+
+def image_extension(data):
+   '''
+   Returns the file extension of the encoded image in data (a string of bytes), or None if data
+   does not start like a known image format.
+   '''
+   head=data[:12]
+   head=head.tobytes() if isinstance(head,memoryview) else bytes(head)
+   if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+      return '.webp'
+   for signature,extension in IMAGE_SIGNATURES:
+      if head.startswith(signature):
+         return extension
+   return None
+
+class MediaBuffer(object):
+   '''
+   Read-only, file-like view of an encoded image in memory (a string of bytes, bytearray,
+   memoryview or anything else supporting the buffer protocol).  The data is not copied; reads
+   return slices of it, and reading the whole of a byte string returns the string itself.
+
+   The name (by default 'image' plus the extension of the detected format) tells the API the media
+   type, as the name of an image file would.
+   '''
+
+   # the twitter API checks that media files are opened for binary reading
+   mode='rb'
+
+   def __init__(self,data,name=None):
+      if isinstance(data,bytes):
+         self._data=data
+      else:
+         self._data=memoryview(data)
+      if name is None:
+         name="image{0}".format(image_extension(self._data) or '')
+      self.name=name
+      self._position=0
+      self._digest=None
+
+   def __len__(self):
+      return len(self._data)
+
+   @property
+   def extension(self):
+      return os.path.splitext(self.name)[1]
+
+   @property
+   def digest(self):
+      '''
+      SHA-1 hex digest of the data, computed once.
+      '''
+      if self._digest is None:
+         self._digest=hashlib.sha1(self._data).hexdigest()
+      return self._digest
+
+   def read(self,size=-1):
+      start=self._position
+      end=len(self._data) if size is None or size < 0 else min(start+size,len(self._data))
+      self._position=max(end,start)
+      if start == 0 and end == len(self._data) and isinstance(self._data,bytes):
+         return self._data
+      chunk=self._data[start:end]
+      return chunk if isinstance(chunk,bytes) else chunk.tobytes()
+
+   def seek(self,offset,whence=io.SEEK_SET):
+      if whence == io.SEEK_CUR:
+         offset+=self._position
+      elif whence == io.SEEK_END:
+         offset+=len(self._data)
+      self._position=max(offset,0)
+      return self._position
+
+   def tell(self):
+      return self._position
+
+   def tobytes(self):
+      return self._data if isinstance(self._data,bytes) else self._data.tobytes()
+
+   def __reduce__(self):
+      # memoryviews cannot be pickled, so the data is pickled as bytes
+      return (MediaBuffer,(self.tobytes(),self.name))
+
+   def close(self):
+      # the API closes uploaded files; the data stays readable
+      self._position=0
+
+def encode_image(image,format='PNG',quality=None,optimize=False):
+   '''
+   Encodes a PIL image in the given format and returns it as a MediaBuffer.  quality applies to
+   lossy formats (e.g. JPEG, 1-95); optimize spends more CPU for a smaller encoding.
+   '''
+   options={}
+   if quality is not None:
+      options['quality']=quality
+   if optimize:
+      options['optimize']=True
+   if format.upper() == 'JPEG' and image.mode not in ('RGB','L','CMYK'):
+      image=image.convert('RGB')
+   encoded=io.BytesIO()
+   image.save(encoded,format=format,**options)
+   return MediaBuffer(encoded.getvalue(),
+      "image{0}".format(FORMAT_EXTENSIONS.get(format.upper(),'.'+format.lower())))
+
+def is_pil_image(image):
+   return hasattr(image,'save') and hasattr(image,'mode') and hasattr(image,'size')
+
+def to_media(image,format='PNG',quality=None,optimize=False):
+   '''
+   Returns what the bot should upload for an image given as a filename, a PIL image (which is
+   encoded with the given settings), encoded image data or a MediaBuffer: either the filename or a
+   MediaBuffer.  Returns None if there is no image (None, or a filename that does not exist).
+
+   A byte string is taken to be encoded image data if it starts like a known image format, and a
+   filename otherwise.
+   '''
+   if image is None or isinstance(image,MediaBuffer):
+      return image
+   if is_pil_image(image):
+      return encode_image(image,format,quality,optimize)
+   if isinstance(image,basestring) and (not isinstance(image,bytes) or
+         image_extension(image) is None):
+      return image if os.path.isfile(image) else None
+   return MediaBuffer(image)
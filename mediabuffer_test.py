@@ -0,0 +1,55 @@
+import array
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+from PIL import Image
+from mediabuffer import MediaBuffer, encode_image, to_media
+
+class TestMediaBuffer(unittest.TestCase):
+   def setUp(self):
+      self.image = Image.frombytes('RGB',(16,16),array.array('B',[10,20,30]*16**2).tostring())
+
+   def test_file_like(self):
+      encoded = encode_image(self.image)
+      data = encoded.tobytes()
+      self.assertEqual(encoded.name,"image.png")
+      self.assertEqual(encoded.mode,"rb")
+
+      # the whole of a byte string is returned without a copy
+      self.assertTrue(encoded.read() is data)
+      encoded.seek(0,os.SEEK_END)
+      self.assertEqual(encoded.tell(),len(data))
+      encoded.seek(0)
+      self.assertEqual(encoded.read(8)+encoded.read(),data)
+
+      view = MediaBuffer(memoryview(bytearray(data)))
+      self.assertEqual(view.name,"image.png")
+      self.assertEqual(view.read(),data)
+      self.assertEqual(view.digest,encoded.digest)
+      self.assertEqual(pickle.loads(pickle.dumps(view)).tobytes(),data)
+
+   def test_encoder_settings(self):
+      jpeg = encode_image(self.image.convert('RGBA'),'JPEG',quality=50,optimize=True)
+      self.assertEqual(jpeg.name,"image.jpg")
+      self.assertEqual(Image.open(jpeg).size,(16,16))
+
+   def test_to_media(self):
+      self.assertEqual(to_media(None),None)
+      self.assertEqual(to_media("missing.png"),None)
+      png = to_media(self.image)
+      self.assertEqual(to_media(png.tobytes()).digest,png.digest)
+      self.assertEqual(to_media(bytearray(png.tobytes())).name,"image.png")
+
+      directory = tempfile.mkdtemp()
+      try:
+         filename = os.path.join(directory,"image.png")
+         self.image.save(filename)
+         self.assertEqual(to_media(filename),filename)
+      finally:
+         shutil.rmtree(directory)
+
+if __name__ == "__main__":
+   # run unit tests
+   unittest.main()
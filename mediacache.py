@@ -0,0 +1,173 @@
+'''
+Content-addressed cache of uploaded media IDs.
+'''
+
+import hashlib
+import os
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+import botlog
+import duration
+import storage
+
+def file_digest(filename,chunk_size=1<<16):
+   '''
+   Returns the SHA-1 hex digest of the contents of a file.
+   '''
+   digest=hashlib.sha1()
+   with open(filename,'rb') as f:
+      for chunk in iter(lambda: f.read(chunk_size),b''):
+         digest.update(chunk)
+   return digest.hexdigest()
+
+class MediaCache(object):
+   '''
+   Uploads media and remembers the media ID returned for its contents, so that posting the same
+   bytes again (even from a different file) reuses the media ID instead of uploading again.  Media
+   is given as filenames or mediabuffer.MediaBuffers.
+
+   The upload function takes a filename or MediaBuffer and returns the media ID, or None if the
+   upload should be tried again later (e.g. no rate limit budget left).  Twitter drops uploaded
+   media that is not used within a day, so media IDs are only reused for lifetime after the upload.
+   If a persist_file (a filename or storage location) is given, the cache is saved to it and
+   survives a restart.
+   '''
+
+   def __init__(self,upload,workers=4,lifetime=duration.Duration(hours=23),persist_file=None,
+         clock=time.time,log=None):
+      self._upload=upload
+      # botlog.Logger for errors
+      self._log=log or botlog.default_logger()
+      self._workers=workers
+      self._lifetime=lifetime
+      self._persist_file=persist_file
+      # media IDs are kept across restarts, so this is a wall clock
+      self._clock=clock
+
+      self._lock=threading.Lock()
+      # content digest -> (media ID, time it expires)
+      self._entries={}
+      # content digest -> AsyncResult of an upload in progress, shared by every post that needs it
+      self._uploading={}
+      # filename -> (modification time, size, digest), so unchanged files are not hashed again
+      self._digests={}
+      # pool running the uploads (created when first needed)
+      self._pool=None
+
+      if self._persist_file is not None:
+         now=self._clock()
+         for digest,(media_id,expires) in storage.load_dict(self._persist_file).items():
+            if expires > now:
+               self._entries[str(digest)]=(media_id,expires)
+
+   @property
+   def persist_file(self):
+      return self._persist_file
+
+   def __len__(self):
+      with self._lock:
+         return len(self._entries)
+
+   def digest(self,filename):
+      '''
+      Returns the content digest of a file (or MediaBuffer), hashing a file only if it changed since
+      it was last hashed.
+      '''
+      if not isinstance(filename,basestring):
+         return filename.digest
+      stat=os.stat(filename)
+      with self._lock:
+         cached=self._digests.get(filename)
+      if cached is not None and cached[:2] == (stat.st_mtime,stat.st_size):
+         return cached[2]
+      digest=file_digest(filename)
+      with self._lock:
+         self._digests[filename]=(stat.st_mtime,stat.st_size,digest)
+      return digest
+
+   def media_ids(self,filenames):
+      '''
+      Returns the media IDs of the given files (or MediaBuffers), in order, uploading (in parallel)
+      the ones whose contents have no unexpired media ID yet.  Returns None if any upload was
+      deferred; raises the error of a failed upload.
+      '''
+      digests=[self.digest(filename) for filename in filenames]
+      now=self._clock()
+      pending={}
+      with self._lock:
+         for digest,filename in zip(digests,filenames):
+            if digest in pending:
+               continue
+            entry=self._entries.get(digest)
+            if entry is not None and entry[1] > now:
+               continue
+            if digest not in self._uploading:
+               if self._pool is None:
+                  self._pool=ThreadPool(self._workers)
+               self._uploading[digest]=self._pool.apply_async(self._upload_file,(digest,filename))
+            pending[digest]=self._uploading[digest]
+
+      uploaded={}
+      for digest,result in pending.items():
+         uploaded[digest]=result.get()
+      if pending:
+         self._save()
+      if None in uploaded.values():
+         return None
+
+      with self._lock:
+         return [uploaded[digest] if digest in uploaded else self._entries[digest][0]
+            for digest in digests]
+
+   def _upload_file(self,digest,filename):
+      try:
+         media_id=self._upload(filename)
+         if media_id is not None:
+            with self._lock:
+               self._entries[digest]=(media_id,self._clock()+self._lifetime.seconds)
+         return media_id
+      finally:
+         with self._lock:
+            del self._uploading[digest]
+
+   def forget(self,filenames):
+      '''
+      Drops the cached media IDs of the given files (or MediaBuffers), e.g. after the API rejected
+      them.
+      '''
+      with self._lock:
+         for filename in filenames:
+            if not isinstance(filename,basestring):
+               self._entries.pop(filename.digest,None)
+               continue
+            cached=self._digests.pop(filename,None)
+            if cached is not None:
+               self._entries.pop(cached[2],None)
+      self._save()
+
+   def _save(self):
+      if self._persist_file is None:
+         return
+      now=self._clock()
+      with self._lock:
+         for digest in [d for d,(_,expires) in self._entries.items() if expires <= now]:
+            del self._entries[digest]
+         data=dict((digest,[media_id,expires]) for digest,(media_id,expires) in
+            self._entries.items())
+      try:
+         storage.save_dict(data,self._persist_file)
+      except Exception:
+         self._log.exception('media_cache_save_failed',"unable to save the media cache")
+
+   def close(self):
+      '''
+      Stops the upload threads.  The cache can still be used afterwards; new threads are started
+      when needed.
+      '''
+      with self._lock:
+         pool,self._pool=self._pool,None
+      if pool is not None:
+         pool.close()
+         pool.join()
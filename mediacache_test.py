@@ -0,0 +1,81 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from duration import Duration
+from mediacache import MediaCache
+
+class TestMediaCache(unittest.TestCase):
+   def setUp(self):
+      self.directory = tempfile.mkdtemp()
+      self.cache_file = os.path.join(self.directory,"media_cache.dat")
+      self.uploads = []
+      self.lock = threading.Lock()
+      self.now = 1000.0
+
+   def tearDown(self):
+      shutil.rmtree(self.directory)
+
+   def write(self,name,contents):
+      filename = os.path.join(self.directory,name)
+      with open(filename,'wb') as f:
+         f.write(contents)
+      return filename
+
+   def upload(self,filename):
+      with self.lock:
+         self.uploads.append(os.path.basename(filename))
+         return 100+len(self.uploads)
+
+   def make_cache(self):
+      return MediaCache(self.upload,lifetime=Duration(hours=1),persist_file=self.cache_file,
+         clock=lambda: self.now)
+
+   def test_identical_contents_upload_once(self):
+      logo = self.write("logo.png","logo")
+      copy = self.write("copy.png","logo")
+      frame = self.write("frame.png","frame")
+      cache = self.make_cache()
+
+      ids = cache.media_ids([logo,frame,copy])
+      self.assertEqual(len(self.uploads),2)
+      self.assertEqual(ids[0],ids[2])
+      self.assertNotEqual(ids[0],ids[1])
+
+      self.assertEqual(cache.media_ids([copy]),[ids[0]])
+      self.assertEqual(len(self.uploads),2)
+      cache.close()
+
+   def test_expiry_and_persistence(self):
+      logo = self.write("logo.png","logo")
+      cache = self.make_cache()
+      first = cache.media_ids([logo])
+      cache.close()
+
+      # a new cache (e.g. after a restart) reuses the saved media ID until it expires
+      cache = self.make_cache()
+      self.assertEqual(cache.media_ids([logo]),first)
+      self.now += Duration(hours=2).seconds
+      self.assertNotEqual(cache.media_ids([logo]),first)
+      self.assertEqual(len(self.uploads),2)
+
+      # changed contents are uploaded again, and forgotten media is uploaded again
+      self.write("logo.png","new logo")
+      os.utime(logo,(self.now,self.now))
+      cache.media_ids([logo])
+      cache.forget([logo])
+      cache.media_ids([logo])
+      self.assertEqual(len(self.uploads),4)
+      cache.close()
+
+   def test_deferred_upload(self):
+      logo = self.write("logo.png","logo")
+      cache = MediaCache(lambda filename: None)
+      self.assertEqual(cache.media_ids([logo]),None)
+      self.assertEqual(len(cache),0)
+      cache.close()
+
+if __name__ == "__main__":
+   # run unit tests
+   unittest.main()
@@ -0,0 +1,259 @@
+'''
+In-process metrics: timers and counters kept in a registry, which can be read directly or served
+over HTTP in the Prometheus text format.
+'''
+
+import BaseHTTPServer
+import SocketServer
+import threading
+
+import timeutils
+
+# content type of the Prometheus text exposition format
+PROMETHEUS_CONTENT_TYPE='text/plain; version=0.0.4; charset=utf-8'
+
+class TimerStats(object):
+   '''
+   Number of timings recorded by a timer, their total and the longest one, in seconds.
+   '''
+   __slots__=('count','total','max')
+
+   def __init__(self):
+      self.count=0
+      self.total=0.0
+      self.max=0.0
+
+   def add(self,seconds):
+      self.count+=1
+      self.total+=seconds
+      if seconds > self.max:
+         self.max=seconds
+
+   @property
+   def mean(self):
+      return self.total/self.count if self.count else 0.0
+
+   def __repr__(self):
+      return "TimerStats(count={0}, total={1:.6f}, max={2:.6f})".format(self.count,self.total,
+         self.max)
+
+class Timer(object):
+   '''
+   Context manager timing the block it runs, into a timer of a registry.  The time is recorded
+   even if the block raises.
+   '''
+   __slots__=('_registry','_key','_started')
+
+   def __init__(self,registry,key):
+      self._registry=registry
+      self._key=key
+      self._started=None
+
+   def __enter__(self):
+      self._started=self._registry.clock()
+      return self
+
+   def __exit__(self,exc_type,exc_value,tb):
+      self._registry._observe(self._key,self._registry.clock()-self._started)
+      return False
+
+class Registry(object):
+   '''
+   Thread-safe registry of timers and counters.
+
+   Each metric is identified by a name and a set of labels, e.g. timer('api_seconds',
+   method='GetMentions').  Timers keep the number, total and maximum of the durations recorded;
+   counters only go up.  Metrics are created the first time they are used.
+   '''
+   # whether the registry records anything (see NullRegistry)
+   enabled=True
+
+   def __init__(self,clock=timeutils.monotonic):
+      # clock the timers read, in seconds
+      self.clock=clock
+      self._lock=threading.Lock()
+      # TimerStats of each timer and value of each counter, keyed by (name, sorted label items)
+      self._timers={}
+      self._counters={}
+
+   def timer(self,name,**labels):
+      '''
+      Returns a context manager that times its block into the named timer.
+      '''
+      return Timer(self,(name,tuple(sorted(labels.items()))))
+
+   def observe(self,name,seconds,**labels):
+      '''
+      Records a duration (in seconds) measured elsewhere into the named timer.
+      '''
+      self._observe((name,tuple(sorted(labels.items()))),seconds)
+
+   def _observe(self,key,seconds):
+      with self._lock:
+         stats=self._timers.get(key)
+         if stats is None:
+            stats=self._timers[key]=TimerStats()
+         stats.add(seconds)
+
+   def count(self,name,amount=1,**labels):
+      '''
+      Adds amount to the named counter.
+      '''
+      key=(name,tuple(sorted(labels.items())))
+      with self._lock:
+         self._counters[key]=self._counters.get(key,0)+amount
+
+   def counter(self,name,**labels):
+      '''
+      Returns the value of a counter (0 if it was never counted).
+      '''
+      with self._lock:
+         return self._counters.get((name,tuple(sorted(labels.items()))),0)
+
+   def timing(self,name,**labels):
+      '''
+      Returns a copy of the TimerStats of a timer (with a count of 0 if it never recorded
+      anything).
+      '''
+      stats=TimerStats()
+      with self._lock:
+         recorded=self._timers.get((name,tuple(sorted(labels.items()))))
+         if recorded is not None:
+            stats.count,stats.total,stats.max=recorded.count,recorded.total,recorded.max
+      return stats
+
+   def snapshot(self):
+      '''
+      Returns a copy of all metrics, as a dictionary with 'timers' (name -> {labels: TimerStats})
+      and 'counters' (name -> {labels: value}), where labels are tuples of sorted (label, value)
+      pairs.
+      '''
+      timers={}
+      counters={}
+      with self._lock:
+         for (name,labels),recorded in self._timers.items():
+            stats=timers.setdefault(name,{})[labels]=TimerStats()
+            stats.count,stats.total,stats.max=recorded.count,recorded.total,recorded.max
+         for (name,labels),value in self._counters.items():
+            counters.setdefault(name,{})[labels]=value
+      return {'timers':timers,'counters':counters}
+
+   def reset(self):
+      '''
+      Forgets all metrics recorded so far.
+      '''
+      with self._lock:
+         self._timers={}
+         self._counters={}
+
+   def prometheus_text(self):
+      '''
+      Returns all metrics in the Prometheus text exposition format.  Each timer is a summary (its
+      _count and _sum) plus a gauge of its maximum (_max).
+      '''
+      snapshot=self.snapshot()
+      lines=[]
+      for name in sorted(snapshot['timers']):
+         timers=sorted(snapshot['timers'][name].items())
+         lines.append("# TYPE {0} summary".format(name))
+         for labels,stats in timers:
+            lines.append("{0}_count{1} {2}".format(name,format_labels(labels),stats.count))
+            lines.append("{0}_sum{1} {2!r}".format(name,format_labels(labels),stats.total))
+         lines.append("# TYPE {0}_max gauge".format(name))
+         for labels,stats in timers:
+            lines.append("{0}_max{1} {2!r}".format(name,format_labels(labels),stats.max))
+      for name in sorted(snapshot['counters']):
+         lines.append("# TYPE {0} counter".format(name))
+         for labels,value in sorted(snapshot['counters'][name].items()):
+            lines.append("{0}{1} {2}".format(name,format_labels(labels),value))
+      return "".join(line+"\n" for line in lines)
+
+class NullTimer(object):
+   '''
+   Timer that records nothing.
+   '''
+   __slots__=()
+
+   def __enter__(self):
+      return self
+
+   def __exit__(self,exc_type,exc_value,tb):
+      return False
+
+NULL_TIMER=NullTimer()
+
+class NullRegistry(Registry):
+   '''
+   Registry that records nothing, used when metrics are disabled.  Its methods return right away,
+   so instrumented code costs little more than the method calls.
+   '''
+   enabled=False
+
+   def timer(self,name,**labels):
+      return NULL_TIMER
+
+   def observe(self,name,seconds,**labels):
+      pass
+
+   def count(self,name,amount=1,**labels):
+      pass
+
+# registry shared by everything that has metrics disabled
+NULL_REGISTRY=NullRegistry()
+
+def format_labels(labels):
+   '''
+   Formats (label, value) pairs as a Prometheus label set, e.g. {method="GetMentions"}.
+   '''
+   if not labels:
+      return ""
+   return "{"+",".join('{0}="{1}"'.format(label,escape_label_value(value))
+      for label,value in labels)+"}"
+
+def escape_label_value(value):
+   if isinstance(value,unicode):
+      value=value.encode('utf-8')
+   return str(value).replace("\\","\\\\").replace('"','\\"').replace("\n","\\n")
+
+class MetricsServer(object):
+   '''
+   HTTP server on a local port that serves the metrics of a registry in the Prometheus text format
+   (at any path, e.g. /metrics), from a background thread.
+   '''
+
+   def __init__(self,registry,port=0,host='127.0.0.1'):
+      self.registry=registry
+
+      server=self
+      class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+         def do_GET(self):
+            body=server.registry.prometheus_text()
+            self.send_response(200)
+            self.send_header('Content-Type',PROMETHEUS_CONTENT_TYPE)
+            self.send_header('Content-Length',str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+         def log_message(self,format,*args):
+            pass
+
+      self._httpd=ThreadingHTTPServer((host,port),Handler)
+      self._thread=threading.Thread(target=self._httpd.serve_forever,name="metrics server")
+      self._thread.daemon=True
+      self._thread.start()
+
+   @property
+   def port(self):
+      return self._httpd.server_address[1]
+
+   @property
+   def url(self):
+      return "http://{0}:{1}/metrics".format(*self._httpd.server_address[:2])
+
+   def close(self):
+      self._httpd.shutdown()
+      self._httpd.server_close()
+      self._thread.join()
+
+class ThreadingHTTPServer(SocketServer.ThreadingMixIn,BaseHTTPServer.HTTPServer):
+   daemon_threads=True
@@ -0,0 +1,167 @@
+import itertools
+import shutil
+import tempfile
+import time
+import unittest
+import urllib2
+import metrics
+import command
+import fakeapi
+import twitterbot
+from testutils import FakeClock, make_bot
+from twitterbot import TwitterBot
+
+pings = itertools.count(1)
+
+@command.register("metricsping")
+def metricsping(bot):
+   return "pong {0}".format(next(pings))
+
+class TestRegistry(unittest.TestCase):
+   def setUp(self):
+      self.clock = FakeClock(0.0)
+      self.registry = metrics.Registry(clock=self.clock)
+
+   def test_timers(self):
+      for seconds in (0.5,2.0):
+         with self.registry.timer('api_seconds',method='GetMentions'):
+            self.clock.now += seconds
+      with self.assertRaises(ValueError):
+         with self.registry.timer('api_seconds',method='GetMentions'):
+            self.clock.now += 1.0
+            raise ValueError()
+      self.registry.observe('api_seconds',0.25,method='GetHomeTimeline')
+      stats = self.registry.timing('api_seconds',method='GetMentions')
+      self.assertEqual((stats.count,stats.total,stats.max),(3,3.5,2.0))
+      self.assertAlmostEqual(stats.mean,3.5/3)
+      self.assertEqual(self.registry.timing('api_seconds',method='GetHomeTimeline').count,1)
+      self.assertEqual(self.registry.timing('api_seconds',method='GetReplies').count,0)
+
+   def test_counters(self):
+      self.registry.count('posts_total',kind='update')
+      self.registry.count('posts_total',3,kind='update')
+      self.registry.count('posts_total',kind='media')
+      self.assertEqual(self.registry.counter('posts_total',kind='update'),4)
+      self.assertEqual(self.registry.counter('posts_total',kind='media'),1)
+      self.assertEqual(self.registry.counter('posts_total'),0)
+      snapshot = self.registry.snapshot()
+      self.assertEqual(snapshot['counters'],
+         {'posts_total':{(('kind','media'),):1,(('kind','update'),):4}})
+      self.registry.reset()
+      self.assertEqual(self.registry.snapshot(),{'timers':{},'counters':{}})
+
+   def test_prometheus_text(self):
+      self.registry.observe('api_seconds',0.5,method='GetMentions')
+      self.registry.observe('api_seconds',1.5,method='GetMentions')
+      self.registry.count('errors_total',code=None,method='Get"Mentions"')
+      self.registry.count('updates_total')
+      self.assertEqual(self.registry.prometheus_text(),
+         '# TYPE api_seconds summary\n'
+         'api_seconds_count{method="GetMentions"} 2\n'
+         'api_seconds_sum{method="GetMentions"} 2.0\n'
+         '# TYPE api_seconds_max gauge\n'
+         'api_seconds_max{method="GetMentions"} 1.5\n'
+         '# TYPE errors_total counter\n'
+         'errors_total{code="None",method="Get\\"Mentions\\""} 1\n'
+         '# TYPE updates_total counter\n'
+         'updates_total 1\n')
+
+   def test_null_registry(self):
+      registry = metrics.NULL_REGISTRY
+      self.assertFalse(registry.enabled)
+      with registry.timer('api_seconds',method='GetMentions'):
+         pass
+      registry.observe('api_seconds',1.0)
+      registry.count('posts_total')
+      self.assertEqual(registry.timing('api_seconds',method='GetMentions').count,0)
+      self.assertEqual(registry.counter('posts_total'),0)
+      self.assertEqual(registry.prometheus_text(),"")
+
+   def test_server(self):
+      self.registry.count('updates_total')
+      server = metrics.MetricsServer(self.registry)
+      try:
+         response = urllib2.urlopen(server.url,timeout=5)
+         self.assertEqual(response.info()['Content-Type'],metrics.PROMETHEUS_CONTENT_TYPE)
+         self.assertEqual(response.read(),self.registry.prometheus_text())
+      finally:
+         server.close()
+
+class TestBotMetrics(unittest.TestCase):
+   def setUp(self):
+      self.directory = tempfile.mkdtemp()
+
+   def tearDown(self):
+      shutil.rmtree(self.directory)
+
+   def bot(self,api,**kwargs):
+      return make_bot(TwitterBot,api,self.directory,**kwargs)
+
+   def test_update(self):
+      clock = FakeClock(time.time())
+      api = fakeapi.FakeApi(rates={'home':0,'mentions':5,'commands':5},commands=["metricsping"],
+         seed=1,clock=clock)
+      registry = metrics.Registry()
+      bot = self.bot(api,metrics_registry=registry)
+      bot.start()
+      try:
+         clock.now += 1.0
+         bot.tick()
+         bot._command_engine.wait(5)
+      finally:
+         bot.shutdown()
+
+      mentions = api.GetMentions(count=200)
+      commands = [status for status in mentions if "metricsping" in status.text]
+      self.assertTrue(len(commands) > 0)
+      self.assertEqual(registry.timing(twitterbot.UPDATE_SECONDS).count,1)
+      for stage in ('fetch_feeds','handle_watched_timelines','handle_mentions','process_commands',
+                    'save_last_ids'):
+         self.assertEqual(registry.timing(twitterbot.STAGE_SECONDS,stage=stage).count,1,stage)
+      self.assertEqual(registry.timing(twitterbot.API_SECONDS,method='GetMentions').count,1)
+      self.assertEqual(registry.timing(twitterbot.HOOK_SECONDS,hook='on_mentions').count,1)
+      self.assertEqual(registry.counter(twitterbot.STATUSES_SEEN,feed='mentions'),len(mentions))
+      self.assertEqual(registry.counter(twitterbot.STATUSES_NEW,feed='mentions'),len(mentions))
+      self.assertEqual(registry.counter(twitterbot.COMMANDS,command='metricsping',outcome='ok'),
+         len(commands))
+      self.assertEqual(registry.timing(twitterbot.COMMAND_SECONDS,command='metricsping').count,
+         len(commands))
+      self.assertEqual(registry.counter(twitterbot.POSTS,kind='update'),len(commands))
+      self.assertEqual(registry.timing(twitterbot.API_SECONDS,method='PostUpdate').count,
+         len(commands))
+
+   def test_api_errors(self):
+      api = fakeapi.FakeApi(rate_limits={'/statuses/mentions_timeline':(0,900)},seed=1)
+      registry = metrics.Registry()
+      bot = self.bot(api,metrics_registry=registry)
+      bot.start()
+      try:
+         bot.tick()
+      finally:
+         bot.shutdown()
+      self.assertEqual(registry.counter(twitterbot.API_ERRORS,method='GetMentions',
+         code=fakeapi.ERROR_RATE_LIMIT_EXCEEDED),1)
+
+   def test_disabled(self):
+      bot = self.bot(fakeapi.FakeApi(seed=1))
+      self.assertIs(bot._metrics,metrics.NULL_REGISTRY)
+      bot.start()
+      try:
+         bot.tick()
+      finally:
+         bot.shutdown()
+
+   def test_endpoint(self):
+      bot = self.bot(fakeapi.FakeApi(seed=1),metrics_port=0)
+      bot.start()
+      try:
+         bot.tick()
+         text = urllib2.urlopen(bot._metrics_server.url,timeout=5).read()
+      finally:
+         bot.shutdown()
+      self.assertIn('twitterbot_api_seconds_count{method="GetMentions"} 1\n',text)
+      self.assertIsNone(bot._metrics_server)
+
+if __name__ == "__main__":
+   # run unit tests
+   unittest.main()
@@ -0,0 +1,249 @@
+'''
+Persistent outbound queue for posts (tweets, replies, media), sent by background workers.
+'''
+
+import heapq
+import itertools
+import threading
+import time
+
+import botlog
+import duration
+import storage
+
+# seconds that close() gives the workers to exit after the timeout, for those that only have to
+# wake up and return
+JOIN_GRACE_SECONDS=1.0
+
+class PostHandle(object):
+   '''
+   Handle for a queued post.  wait() blocks until the post has been sent (or has failed for good)
+   and returns the posted status (None if the post failed).
+   '''
+
+   def __init__(self):
+      self._event=threading.Event()
+      # posted status, once sent
+      self.status=None
+      # the last error, if the post failed for good
+      self.error=None
+
+   def done(self):
+      return self._event.is_set()
+
+   def wait(self,timeout=None):
+      self._event.wait(timeout)
+      return self.status
+
+   @property
+   def status_id(self):
+      if self.status is None:
+         return None
+      return self.status.id
+
+   def resolve(self,status=None,error=None):
+      self.status=status
+      self.error=error
+      self._event.set()
+
+class PostQueue(object):
+   '''
+   Queue of posts waiting to be sent.
+
+   A post is a dictionary of simple data (so that it can be saved), which is given to the send
+   function by a worker thread.  The send function returns the posted status, returns None if the
+   post should be tried again later without counting as a failed attempt (e.g. no rate limit budget
+   left), or raises an error.  Failed posts are retried with exponential backoff, up to max_attempts
+   in total, unless is_retryable(error) says the error is permanent.
+
+   Sends are paced so that they start at least min_interval apart.  If a persist_file (a filename or
+   storage location) is given, the posts that have not been sent are saved to it whenever the queue
+   changes, and are queued again when the queue starts.
+
+   Posts marked 'in_memory' hold data that cannot be saved as is (e.g. images in memory).  They are
+   left out of the persist file while they are on their way out, and only saved once they have to
+   wait: after a failed attempt, or when the queue is closed before they are sent.  Saving them
+   first replaces the post with the result of spool(post), which should write the data to files.
+   '''
+
+   def __init__(self,send,workers=1,min_interval=duration.Duration(seconds=1),max_attempts=5,
+         initial_backoff=duration.Duration(seconds=30),max_backoff=duration.Duration(minutes=30),
+         persist_file=None,is_retryable=None,spool=None,clock=time.time,log=None):
+      self._send=send
+      self._workers=workers
+      self._min_interval=min_interval
+      self._max_attempts=max_attempts
+      self._initial_backoff=initial_backoff
+      self._max_backoff=max_backoff
+      self._persist_file=persist_file
+      self._is_retryable=is_retryable
+      self._spool=spool
+      self._clock=clock
+      # botlog.Logger for retries and failures
+      self._log=log or botlog.default_logger()
+
+      self._condition=threading.Condition()
+      # heap of (time the post may be sent, sequence number, entry)
+      self._queue=[]
+      self._sequence=itertools.count()
+      # entries currently being sent, by sequence number
+      self._in_flight={}
+      # earliest time the next send may start
+      self._next_send=0.0
+      self._threads=[]
+      self._running=False
+
+      if self._persist_file is not None:
+         for post in storage.load_list(self._persist_file):
+            self._push({'post':post,'attempts':post.pop('_attempts',0),'handle':PostHandle()},
+               self._clock())
+
+   @property
+   def persist_file(self):
+      return self._persist_file
+
+   def _push(self,entry,ready_time):
+      entry['sequence']=next(self._sequence)
+      heapq.heappush(self._queue,(ready_time,entry['sequence'],entry))
+
+   def _persist(self,final=False):
+      # called with the condition held
+      if self._persist_file is None:
+         return
+      posts=[]
+      for entry in [e for _,_,e in self._queue] + self._in_flight.values():
+         if entry['post'].get('in_memory'):
+            if self._spool is None or (entry['attempts'] == 0 and not final):
+               continue
+            try:
+               entry['post']=self._spool(entry['post'])
+            except Exception:
+               self._log.exception('post_spool_failed',"unable to spool a post")
+               continue
+         post=dict(entry['post'])
+         post['_attempts']=entry['attempts']
+         posts.append(post)
+      try:
+         storage.save_list(posts,self._persist_file)
+      except Exception:
+         self._log.exception('post_queue_save_failed',"unable to save the post queue")
+
+   def __len__(self):
+      with self._condition:
+         return len(self._queue)+len(self._in_flight)
+
+   def pending(self,match=None):
+      '''
+      Returns the PostHandles of the posts not sent yet (queued, waiting to be retried or being
+      sent), including those reloaded from the persist file.  If match is given, only posts for
+      which match(post) is true are included.
+      '''
+      with self._condition:
+         entries=[e for _,_,e in self._queue] + self._in_flight.values()
+      return [entry['handle'] for entry in entries if match is None or match(entry['post'])]
+
+   def start(self):
+      '''
+      Starts the worker threads.  Posts can be queued before the queue is started.
+      '''
+      with self._condition:
+         if self._running:
+            return
+         self._running=True
+      for i in range(self._workers):
+         thread=threading.Thread(target=self._work,name="post-queue-{0}".format(i))
+         thread.daemon=True
+         thread.start()
+         self._threads.append(thread)
+
+   def put(self,post):
+      '''
+      Queues a post and returns its PostHandle.
+      '''
+      handle=PostHandle()
+      with self._condition:
+         self._push({'post':post,'attempts':0,'handle':handle},self._clock())
+         self._persist()
+         self._condition.notify()
+      return handle
+
+   def close(self,timeout=None):
+      '''
+      Waits up to timeout seconds (forever if None) for the queue to empty, then stops the workers.
+      Posts that were not sent stay saved in the persist file.  A worker still stuck in a send
+      after the timeout is abandoned (it is a daemon thread), and its post is saved as unsent.
+      '''
+      deadline=None if timeout is None else self._clock()+timeout
+      with self._condition:
+         while self._threads and (self._queue or self._in_flight):
+            remaining=None if deadline is None else deadline-self._clock()
+            if remaining is not None and remaining <= 0:
+               break
+            self._condition.wait(0.5 if remaining is None else min(remaining,0.5))
+         self._running=False
+         self._condition.notify_all()
+      for thread in self._threads:
+         if deadline is None:
+            thread.join()
+         else:
+            thread.join(max(deadline-self._clock(),0.0)+JOIN_GRACE_SECONDS)
+         if thread.is_alive():
+            self._log.warning('post_worker_abandoned',"post queue worker did not stop in time; "
+               "abandoning it",thread=thread.name,timeout=timeout)
+      self._threads=[]
+      with self._condition:
+         if self._queue or self._in_flight:
+            self._persist(final=True)
+
+   def _work(self):
+      while True:
+         with self._condition:
+            entry=None
+            while self._running:
+               now=self._clock()
+               if self._queue:
+                  ready_time=max(self._queue[0][0],self._next_send)
+                  if ready_time <= now:
+                     entry=heapq.heappop(self._queue)[2]
+                     self._in_flight[entry['sequence']]=entry
+                     self._next_send=now+self._min_interval.seconds
+                     break
+                  self._condition.wait(min(ready_time-now,1.0))
+               else:
+                  self._condition.wait(1.0)
+            if entry is None:
+               return
+
+         self._send_entry(entry)
+
+   def _send_entry(self,entry):
+      status=None
+      error=None
+      deferred=False
+      try:
+         status=self._send(entry['post'])
+         deferred=status is None
+      except Exception,e:
+         error=e
+
+      with self._condition:
+         del self._in_flight[entry['sequence']]
+         if error is None and not deferred:
+            entry['handle'].resolve(status)
+         else:
+            if not deferred:
+               entry['attempts']+=1
+            retryable=self._is_retryable is None or error is None or self._is_retryable(error)
+            if retryable and entry['attempts'] < self._max_attempts:
+               backoff=min(self._initial_backoff.seconds*2**max(entry['attempts']-1,0),
+                  self._max_backoff.seconds)
+               if error is not None:
+                  self._log.warning('post_retry',"post failed; retrying",error=error,
+                     attempts=entry['attempts'],retry_seconds=backoff)
+               self._push(entry,self._clock()+backoff)
+            else:
+               self._log.error('post_failed',"post failed for good",error=error,
+                  attempts=entry['attempts'])
+               entry['handle'].resolve(None,error)
+         self._persist()
+         self._condition.notify_all()
@@ -0,0 +1,111 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from StringIO import StringIO
+import botlog
+import storage
+from duration import Duration
+from postqueue import PostQueue
+from testutils import Status
+
+class PermanentError(Exception):
+   pass
+
+class TestPostQueue(unittest.TestCase):
+   def setUp(self):
+      self.directory = tempfile.mkdtemp()
+      self.filename = os.path.join(self.directory,"post_queue.dat")
+      self.sent = []
+      self.failures = {}
+
+   def tearDown(self):
+      shutil.rmtree(self.directory)
+
+   def send(self,post):
+      message = post['message']
+      if self.failures.get(message,0) > 0:
+         self.failures[message] -= 1
+         raise IOError("connection reset")
+      if message == 'bad':
+         raise PermanentError("duplicate status")
+      self.sent.append(message)
+      return Status(len(self.sent))
+
+   def make_queue(self,**kwargs):
+      return PostQueue(self.send,min_interval=Duration(),initial_backoff=Duration(milliseconds=10),
+         persist_file=self.filename,is_retryable=lambda e: not isinstance(e,PermanentError),
+         **kwargs)
+
+   def test_send_and_wait(self):
+      queue = self.make_queue(workers=2)
+      queue.start()
+      handles = [queue.put({'kind':'update','message':str(i)}) for i in range(5)]
+      self.assertEqual(sorted(handle.wait(5).id for handle in handles),[1,2,3,4,5])
+      queue.close(5)
+      self.assertEqual(len(queue),0)
+      self.assertEqual(sorted(self.sent),['0','1','2','3','4'])
+
+   def test_retry(self):
+      self.failures['flaky'] = 2
+      queue = self.make_queue()
+      queue.start()
+      self.assertEqual(queue.put({'kind':'update','message':'flaky'}).wait(5).id,1)
+
+      # permanent errors are not retried
+      handle = queue.put({'kind':'update','message':'bad'})
+      self.assertEqual(handle.wait(5),None)
+      self.assertTrue(isinstance(handle.error,PermanentError))
+
+      # give up after max_attempts
+      self.failures['down'] = 10
+      handle = queue.put({'kind':'update','message':'down'})
+      self.assertEqual(handle.wait(5),None)
+      self.assertEqual(self.failures['down'],5)
+      queue.close(5)
+
+   def test_persistence(self):
+      # posts queued while not running are saved, and sent after a restart
+      queue = self.make_queue()
+      queue.put({'kind':'update','message':'hello','in_reply_to_status_id':12})
+      queue.close()
+      self.assertEqual(self.sent,[])
+
+      queue = self.make_queue()
+      self.assertEqual(len(queue),1)
+      queue.start()
+      queue.close(5)
+      self.assertEqual(self.sent,['hello'])
+
+      queue = self.make_queue()
+      self.assertEqual(len(queue),0)
+
+   def test_close_abandons_stuck_worker(self):
+      output = StringIO()
+      log = botlog.open_log(output)
+      release = threading.Event()
+      def stuck(post):
+         release.wait(30)
+         return Status(1)
+      queue = PostQueue(stuck,persist_file=self.filename,log=log)
+      queue.start()
+      queue.put({'kind':'update','message':'stuck'})
+      started = time.time()
+      queue.close(0.1)
+      self.assertTrue(time.time()-started < 5)
+      # the post that was being sent is kept, to be sent after a restart
+      self.assertEqual(storage.load_list(self.filename),
+         [{'kind':'update','message':'stuck','_attempts':0}])
+      release.set()
+
+      log.pipeline.close()
+      events = [json.loads(line) for line in output.getvalue().splitlines()]
+      self.assertEqual([(e['event'],e['thread']) for e in events],
+         [('post_worker_abandoned','post-queue-0')])
+
+if __name__ == "__main__":
+   # run unit tests
+   unittest.main()
@@ -0,0 +1,193 @@
+'''
+Client-side budgeting of Twitter API calls against the per-endpoint rate limit windows.
+'''
+
+import threading
+import time
+
+# call priorities: posts bypass the pacing applied to polling calls
+PRIORITY_POST=0
+PRIORITY_POLL=1
+# seconds after the first polling call of a burst (e.g. the concurrent fetches of one update)
+# during which further polling calls on the same resource join the burst rather than being paced
+BURST_SECONDS=5.0
+
+# the Twitter resource each API call counts against.  Calls that share a resource share a budget.
+API_RESOURCES={
+   'GetHomeTimeline':'/statuses/home_timeline',
+   'GetReplies':'/statuses/user_timeline',
+   'GetUserTimeline':'/statuses/user_timeline',
+   'GetMentions':'/statuses/mentions_timeline',
+   'GetDirectMessages':'/direct_messages',
+   'VerifyCredentials':'/account/verify_credentials',
+   'PostUpdate':'/statuses/update',
+   'PostMedia':'/statuses/update',
+   'PostMultipleMedia':'/statuses/update',
+   'UploadMediaSimple':'/media/upload',
+   'UploadMediaChunked':'/media/upload',
+}
+
+# default limits for each resource: (calls per window, window length in seconds).  These are used
+# until (and unless) the API reports the actual limits.
+DEFAULT_LIMITS={
+   '/statuses/home_timeline':(15,15*60),
+   '/statuses/user_timeline':(900,15*60),
+   '/statuses/mentions_timeline':(75,15*60),
+   '/direct_messages':(15,15*60),
+   '/account/verify_credentials':(75,15*60),
+   '/statuses/update':(300,3*60*60),
+}
+
+class EndpointBudget(object):
+   '''
+   Remaining budget of a single resource within its current rate limit window.
+   '''
+   def __init__(self,limit,window):
+      # calls allowed per window, and window length in seconds
+      self.limit=limit
+      self.window=window
+      # calls left in the current window, and the time (epoch seconds) the window resets
+      self.remaining=limit
+      self.reset=None
+      # start of the current burst of polling calls, number of calls in it, and the share of the
+      # window each call of the burst uses up (the window left over the calls left at its start)
+      self.burst_start=None
+      self.burst_calls=0
+      self.burst_spacing=0.0
+      # calls let through / deferred since the budgeter was created
+      self.calls=0
+      self.deferred=0
+
+   def roll(self,now):
+      '''
+      Starts a new window if the current one is over.
+      '''
+      if self.reset is None or now >= self.reset:
+         self.remaining=self.limit
+         self.reset=now+self.window
+
+class RequestBudgeter(object):
+   '''
+   Tracks the remaining calls and reset time of each API resource, and decides whether a call may
+   be made now.
+
+   Limits come from DEFAULT_LIMITS (overridden by the limits argument) and are corrected from the
+   rate limit information reported by the API whenever it is available.  Polling calls are spread
+   evenly over what is left of the window, in bursts: the calls made within burst_seconds of each
+   other (such as the concurrent fetches of one update, which may all count against one resource)
+   go through together, up to the remaining budget, and the next burst waits until the calls of
+   the last one are paid for at the even rate.  Posting calls are only held back once the budget
+   is used up.  A call that is refused should be deferred to a later update rather than made
+   anyway.
+   '''
+
+   def __init__(self,limits=None,clock=time.time,burst_seconds=BURST_SECONDS):
+      self._limits=dict(DEFAULT_LIMITS)
+      if limits is not None:
+         self._limits.update(limits)
+      # rate limit reset times are reported as epoch seconds, so this is a wall clock
+      self._clock=clock
+      self._burst_seconds=burst_seconds
+      self._budgets={}
+      self._lock=threading.Lock()
+
+   def _budget(self,method):
+      resource=API_RESOURCES.get(method,method)
+      if resource not in self._budgets:
+         if resource not in self._limits:
+            return None
+         limit,window=self._limits[resource]
+         self._budgets[resource]=EndpointBudget(limit,window)
+      return self._budgets[resource]
+
+   def acquire(self,method,priority=PRIORITY_POLL,now=None):
+      '''
+      Returns True (and uses up one call) if the given API call may be made now, or False if it
+      should be deferred.  Calls without a known limit are always allowed.
+      '''
+      if now is None:
+         now=self._clock()
+      with self._lock:
+         budget=self._budget(method)
+         if budget is None:
+            return True
+         budget.roll(now)
+
+         if budget.remaining <= 0:
+            budget.deferred+=1
+            return False
+
+         if priority != PRIORITY_POST:
+            since_burst=None if budget.burst_start is None else now-budget.burst_start
+            if since_burst is not None and since_burst < self._burst_seconds:
+               budget.burst_calls+=1
+            elif since_burst is not None and \
+                  since_burst < budget.burst_spacing*budget.burst_calls:
+               budget.deferred+=1
+               return False
+            else:
+               # spread the remaining calls evenly over the rest of the window
+               budget.burst_start=now
+               budget.burst_calls=1
+               budget.burst_spacing=(budget.reset-now)/float(budget.remaining)
+
+         budget.remaining-=1
+         budget.calls+=1
+         return True
+
+   def update(self,method,limit,remaining,reset):
+      '''
+      Sets the limit, remaining calls and reset time (epoch seconds) reported for an API call.
+      '''
+      with self._lock:
+         budget=self._budget(method)
+         if budget is None:
+            resource=API_RESOURCES.get(method,method)
+            budget=self._budgets[resource]=EndpointBudget(limit,max(reset-self._clock(),0))
+         budget.limit=limit
+         budget.remaining=remaining
+         budget.reset=reset
+
+   def update_from_headers(self,method,headers):
+      '''
+      Updates the budget of an API call from the x-rate-limit-* headers of its response.
+      '''
+      if 'x-rate-limit-remaining' not in headers:
+         return
+      self.update(method,int(headers['x-rate-limit-limit']),
+         int(headers['x-rate-limit-remaining']),int(headers['x-rate-limit-reset']))
+
+   def update_from_api(self,method,api):
+      '''
+      Updates the budget of an API call from the rate limit state kept by a python-twitter Api
+      object (python-twitter 3.0+), if it has one.
+      '''
+      rate_limit=getattr(api,'rate_limit',None)
+      resource=API_RESOURCES.get(method)
+      if resource is None or not hasattr(rate_limit,'get_limit'):
+         return
+      endpoint_limit=rate_limit.get_limit("{0}{1}.json".format(api.base_url,resource))
+      # a reset time of 0 means python-twitter has no information about this resource
+      if endpoint_limit.reset:
+         self.update(method,int(endpoint_limit.limit),int(endpoint_limit.remaining),
+            int(endpoint_limit.reset))
+
+   def exhausted(self,method):
+      '''
+      Marks the budget of an API call as used up, e.g. after the API reported a rate limit error.
+      '''
+      with self._lock:
+         budget=self._budget(method)
+         if budget is not None:
+            budget.roll(self._clock())
+            budget.remaining=0
+
+   def usage(self):
+      '''
+      Returns a dictionary of resource -> dictionary of 'limit', 'remaining', 'reset' (epoch
+      seconds), 'calls' and 'deferred' for each resource used so far.
+      '''
+      with self._lock:
+         return dict((resource,{'limit':budget.limit,'remaining':budget.remaining,
+            'reset':budget.reset,'calls':budget.calls,'deferred':budget.deferred})
+            for resource,budget in self._budgets.items())
@@ -0,0 +1,97 @@
+import shutil
+import tempfile
+import unittest
+import fakeapi
+from ratelimit import RequestBudgeter, PRIORITY_POST, PRIORITY_POLL
+from testutils import make_bot
+from twitterbot import TwitterBot
+
+class TestRequestBudgeter(unittest.TestCase):
+   def test_polls_are_spread_over_window(self):
+      budgeter = RequestBudgeter(limits={'/statuses/home_timeline':(15,900)})
+
+      # 15 calls in 900 seconds: polls are spaced 60 seconds apart
+      self.assertTrue(budgeter.acquire('GetHomeTimeline',now=0.0))
+      self.assertFalse(budgeter.acquire('GetHomeTimeline',now=30.0))
+      self.assertTrue(budgeter.acquire('GetHomeTimeline',now=60.0))
+
+      usage = budgeter.usage()['/statuses/home_timeline']
+      self.assertEqual(usage['calls'],2)
+      self.assertEqual(usage['deferred'],1)
+      self.assertEqual(usage['remaining'],13)
+
+   def test_bursts(self):
+      budgeter = RequestBudgeter(limits={'/statuses/user_timeline':(90,900)})
+
+      # the calls of one update go through together, up to the remaining budget...
+      for now in (0.0,0.1,0.2,4.0):
+         self.assertTrue(budgeter.acquire('GetUserTimeline',now=now))
+      self.assertTrue(budgeter.acquire('GetReplies',now=0.3))
+
+      # ...and the next burst waits until they are paid for: 5 calls spaced 10 seconds apart
+      self.assertFalse(budgeter.acquire('GetUserTimeline',now=30.0))
+      self.assertTrue(budgeter.acquire('GetUserTimeline',now=50.0))
+
+      budgeter = RequestBudgeter(limits={'/statuses/user_timeline':(3,900)})
+      for now in (0.0,0.1,0.2):
+         self.assertTrue(budgeter.acquire('GetUserTimeline',now=now))
+      self.assertFalse(budgeter.acquire('GetUserTimeline',now=0.3))
+      self.assertEqual(budgeter.usage()['/statuses/user_timeline']['deferred'],1)
+
+   def test_posts_skip_pacing(self):
+      budgeter = RequestBudgeter(limits={'/statuses/update':(3,900)})
+      self.assertTrue(budgeter.acquire('PostUpdate',PRIORITY_POST,now=0.0))
+      self.assertTrue(budgeter.acquire('PostMedia',PRIORITY_POST,now=1.0))
+      self.assertTrue(budgeter.acquire('PostUpdate',PRIORITY_POST,now=2.0))
+
+      # posting calls share one budget, which is now used up until the window resets
+      self.assertFalse(budgeter.acquire('PostMultipleMedia',PRIORITY_POST,now=3.0))
+      self.assertTrue(budgeter.acquire('PostUpdate',PRIORITY_POST,now=900.0))
+
+   def test_reported_limits(self):
+      budgeter = RequestBudgeter(clock=lambda: 100.0)
+      budgeter.update_from_headers('GetMentions',{'x-rate-limit-limit':'75',
+         'x-rate-limit-remaining':'0','x-rate-limit-reset':'500'})
+      self.assertFalse(budgeter.acquire('GetMentions',PRIORITY_POLL))
+      self.assertTrue(budgeter.acquire('GetMentions',PRIORITY_POLL,now=500.0))
+
+   def test_exhausted_and_unknown(self):
+      budgeter = RequestBudgeter(clock=lambda: 0.0)
+      budgeter.exhausted('GetDirectMessages')
+      self.assertFalse(budgeter.acquire('GetDirectMessages'))
+
+      # calls without a known limit are never held back
+      for i in range(100):
+         self.assertTrue(budgeter.acquire('GetFavorites'))
+
+class WatchingBot(TwitterBot):
+   def on_subclass_init(self,**kwargs):
+      self._watched_timelines = [("user{0}".format(i),5) for i in range(6)]
+      self._do_process_replies = True
+      self.watched = []
+
+   def on_watched_timelines(self,statuses):
+      self.watched.append(sorted(statuses))
+
+class TestBotBudget(unittest.TestCase):
+   def setUp(self):
+      self.directory = tempfile.mkdtemp()
+
+   def tearDown(self):
+      shutil.rmtree(self.directory)
+
+   def test_watched_timelines_in_one_update(self):
+      bot = make_bot(WatchingBot,fakeapi.FakeApi(seed=1),self.directory)
+      bot.start()
+      try:
+         bot.tick()
+      finally:
+         bot.shutdown()
+      # every watched timeline and the replies share one budget, and are all fetched at once
+      self.assertEqual(bot.watched,[["user{0}".format(i) for i in range(6)]])
+      usage = bot._budgeter.usage()['/statuses/user_timeline']
+      self.assertEqual((usage['calls'],usage['deferred']),(7,0))
+
+if __name__ == "__main__":
+   # run unit tests
+   unittest.main()
@@ -0,0 +1,148 @@
+'''
+Deadline-based scheduling of periodic bot updates.
+'''
+
+import random
+import time
+
+import duration
+import timeutils
+
+class TickScheduler(object):
+   '''
+   Schedules periodic ticks on a fixed grid of deadlines (start, start + period, start + 2*period,
+   ...) measured on a monotonic clock, so the time a tick takes does not push back the ones after
+   it.
+
+   A tick that finishes after the next deadline is an overrun.  Deadlines that have already passed
+   are never run one after another to catch up: if coalesce is True, all missed deadlines are
+   merged into a single tick that runs right away; otherwise they are skipped and the next tick
+   waits for the next deadline on the grid.
+
+   An optional jitter adds a random delay of up to that duration to each deadline.  The jitter does
+   not move the grid itself.
+
+   If the clock goes backwards (e.g. a wall clock set back), the grid restarts from the current
+   time, and no wait is ever longer than one period plus the jitter.
+
+   Public counters:
+
+      next_deadline  -- clock time of the next tick
+      overruns       -- number of ticks that finished after the following deadline
+      skipped_ticks  -- number of deadlines that were coalesced or skipped
+      last_overrun   -- how far (in seconds) the most recent overrun went past its deadline
+   '''
+
+   def __init__(self,period,jitter=None,coalesce=True,clock=timeutils.monotonic):
+      # duration between ticks
+      self.period=period
+      # maximum random delay added to each deadline
+      self.jitter=jitter if jitter is not None else duration.Duration()
+      # whether missed deadlines are merged into one immediate tick (True) or skipped (False)
+      self.coalesce=coalesce
+      self._clock=clock
+      # grid time of the current tick (without jitter)
+      self._nominal=None
+
+      self.next_deadline=None
+      self.overruns=0
+      self.skipped_ticks=0
+      self.last_overrun=0.0
+
+   def reset(self,now=None):
+      '''
+      Starts a new grid with the first tick due right away.
+      '''
+      if now is None:
+         now=self._clock()
+      self._nominal=now
+      self.next_deadline=now
+
+   def advance(self,now=None):
+      '''
+      Called when a tick has finished.  Schedules the next tick and returns its deadline.
+      '''
+      if now is None:
+         now=self._clock()
+      if self._nominal is None or now < self._nominal:
+         # first tick, or the clock went back past the current tick
+         self.reset(now)
+
+      period=self.period.seconds
+      nominal=self._nominal+period
+
+      if now > nominal:
+         self.overruns+=1
+         self.last_overrun=now-nominal
+         # move to the last deadline that has already passed
+         missed=int((now-nominal)//period)
+         nominal+=missed*period
+         if self.coalesce:
+            # the missed deadlines become one tick that runs now
+            self.skipped_ticks+=missed
+            self._nominal=nominal
+            self.next_deadline=now
+            return self.next_deadline
+         # skip everything that was missed and wait for the next deadline
+         self.skipped_ticks+=missed+1
+         nominal+=period
+
+      self._nominal=nominal
+      self.next_deadline=nominal+random.uniform(0.0,self.jitter.seconds)
+      return self.next_deadline
+
+   def time_until_next(self,now=None):
+      '''
+      Returns the number of seconds until the next tick is due (0 if it is already due).
+      '''
+      if self.next_deadline is None:
+         return 0.0
+      if now is None:
+         now=self._clock()
+      # a deadline further away than that is left over from before the clock went back
+      return min(max(self.next_deadline-now,0.0),self.period.seconds+self.jitter.seconds)
+
+   def wait(self):
+      '''
+      Sleeps until the next tick is due.
+      '''
+      remaining=self.time_until_next()
+      if remaining > 0:
+         time.sleep(remaining)
+
+class AdaptiveInterval(object):
+   '''
+   Polling interval for a single feed that follows how active the feed is.
+
+   The interval starts at the minimum.  Each poll that returns nothing new multiplies it by the
+   backoff factor, up to the maximum; a poll that returns something new drops it straight back to
+   the minimum, so a busy feed is polled as often as allowed and a quiet one less and less often.
+   '''
+
+   def __init__(self,minimum,maximum,backoff=2.0):
+      # shortest and longest allowed intervals (durations)
+      self.minimum=minimum
+      self.maximum=maximum
+      # factor applied to the interval after each quiet poll
+      self.backoff=backoff
+      # current interval, in seconds
+      self.interval=minimum.seconds
+      # clock time the feed is next due to be polled (None means due right away)
+      self.next_due=None
+
+   def due(self,now,slack=0.0):
+      '''
+      Returns whether the feed should be polled at the given clock time.  The slack allows a poll
+      that is only slightly early (e.g. because ticks do not start exactly on their deadline).
+      '''
+      return self.next_due is None or now >= self.next_due-slack
+
+   def record(self,active,now):
+      '''
+      Records the outcome of a poll made at the given clock time, and schedules the next one.
+      '''
+      if active:
+         self.interval=self.minimum.seconds
+      else:
+         self.interval=min(self.interval*self.backoff,self.maximum.seconds)
+      self.next_due=now+self.interval
@@ -0,0 +1,153 @@
+import shutil
+import tempfile
+import time
+import unittest
+import fakeapi
+from duration import Duration
+from scheduler import TickScheduler, AdaptiveInterval
+from testutils import FakeClock, make_bot
+from twitterbot import TwitterBot
+
+class TestTickScheduler(unittest.TestCase):
+   def test_fixed_deadlines(self):
+      sched = TickScheduler(Duration(seconds=10))
+      sched.reset(100.0)
+      self.assertEqual(sched.next_deadline,100.0)
+
+      # the time taken by the tick does not push back the next deadline
+      self.assertEqual(sched.advance(103.0),110.0)
+      self.assertEqual(sched.time_until_next(104.0),6.0)
+      self.assertEqual(sched.advance(119.5),120.0)
+      self.assertEqual(sched.overruns,0)
+
+   def test_coalesce_missed_ticks(self):
+      sched = TickScheduler(Duration(seconds=10),coalesce=True)
+      sched.reset(100.0)
+
+      # tick ran until 135: deadlines at 110, 120 and 130 were missed
+      self.assertEqual(sched.advance(135.0),135.0)
+      self.assertEqual(sched.overruns,1)
+      self.assertEqual(sched.skipped_ticks,2)
+      self.assertEqual(sched.last_overrun,25.0)
+      self.assertEqual(sched.time_until_next(135.0),0.0)
+
+      # back on the original grid afterwards
+      self.assertEqual(sched.advance(136.0),140.0)
+
+   def test_skip_missed_ticks(self):
+      sched = TickScheduler(Duration(seconds=10),coalesce=False)
+      sched.reset(100.0)
+
+      self.assertEqual(sched.advance(135.0),140.0)
+      self.assertEqual(sched.overruns,1)
+      self.assertEqual(sched.skipped_ticks,3)
+
+   def test_jitter(self):
+      sched = TickScheduler(Duration(seconds=10),jitter=Duration(seconds=2))
+      sched.reset(100.0)
+      for i in range(1,20):
+         deadline = sched.advance(100.0+10*(i-1)+1)
+         self.assertTrue(100.0+10*i <= deadline <= 100.0+10*i+2)
+
+   def test_clock_going_backwards(self):
+      clock = FakeClock(1000.0)
+      sched = TickScheduler(Duration(seconds=10),clock=clock)
+      sched.reset()
+      clock.now = 1003.0
+      self.assertEqual(sched.advance(),1010.0)
+
+      # the clock is set back an hour while waiting: the wait is still at most one period
+      clock.now = -2597.0
+      self.assertEqual(sched.time_until_next(),10.0)
+      clock.sleep(10.0)
+      # the tick that follows starts a new grid rather than waiting for the old one to come around
+      clock.now += 2.0
+      self.assertEqual(sched.advance(),-2575.0)
+      self.assertEqual(sched.time_until_next(),10.0)
+      self.assertEqual(sched.overruns,0)
+
+      # and a step back in the middle of a tick
+      clock.now = -2590.0
+      self.assertEqual(sched.advance(),-2580.0)
+      self.assertEqual(sched.time_until_next(),10.0)
+
+class TestAdaptiveInterval(unittest.TestCase):
+   def test_backoff_and_reset(self):
+      interval = AdaptiveInterval(Duration(seconds=10),Duration(seconds=60))
+      self.assertTrue(interval.due(0.0))
+
+      # quiet polls back off exponentially up to the maximum
+      interval.record(False,0.0)
+      self.assertEqual(interval.interval,20)
+      self.assertFalse(interval.due(19.0))
+      self.assertTrue(interval.due(20.0))
+      interval.record(False,20.0)
+      interval.record(False,60.0)
+      self.assertEqual(interval.interval,60)
+
+      # new activity goes straight back to the minimum
+      interval.record(True,120.0)
+      self.assertEqual(interval.interval,10)
+      self.assertEqual(interval.next_due,130.0)
+
+   def test_slack(self):
+      interval = AdaptiveInterval(Duration(seconds=10),Duration(seconds=60))
+      interval.record(True,0.0)
+      self.assertFalse(interval.due(9.0))
+      self.assertTrue(interval.due(9.0,slack=5.0))
+
+class PollingBot(TwitterBot):
+   def on_subclass_init(self,**kwargs):
+      self._do_process_home_timeline = True
+
+class TestAdaptivePolling(unittest.TestCase):
+   def setUp(self):
+      self.directory = tempfile.mkdtemp()
+      self.clock = FakeClock(time.time())
+
+   def tearDown(self):
+      shutil.rmtree(self.directory)
+
+   def run_bot(self,api,updates=3,**kwargs):
+      # each bot gets its own state, so that it does not start from another bot's last IDs
+      bot = make_bot(PollingBot,api,tempfile.mkdtemp(dir=self.directory),
+         check_period=Duration(seconds=10),max_poll_interval=Duration(minutes=10),**kwargs)
+      bot.start()
+      try:
+         for update in range(updates):
+            self.clock.now += 10.0
+            bot.tick()
+            # make every feed due on the next update, as if its interval had passed
+            for interval in bot._poll_intervals.values():
+               interval.next_due = None
+      finally:
+         bot.shutdown()
+      return bot
+
+   def test_quiet_and_busy_feeds(self):
+      api = fakeapi.FakeApi(rates={'home':0,'mentions':2},seed=1,clock=self.clock)
+      bot = self.run_bot(api)
+      self.assertEqual(api.calls['GetHomeTimeline'],3)
+      # the quiet home timeline backs off after each poll; the busy mentions stay at the minimum
+      self.assertEqual(bot._poll_intervals['home'].interval,80)
+      self.assertEqual(bot._poll_intervals['mentions'].interval,10)
+
+   def test_failed_polls_are_not_quiet(self):
+      # the home timeline fetch fails with a rate limit error from the API, after which the bot's
+      # budget holds the fetches back
+      api = fakeapi.FakeApi(rates={'home':0,'mentions':2},seed=1,clock=self.clock,
+         rate_limits={'/statuses/home_timeline':(0,900)})
+      bot = self.run_bot(api)
+      self.assertEqual(api.rate_limited['GetHomeTimeline'],1)
+      self.assertNotIn('home',bot._poll_intervals)
+
+      # neither are fetches the bot's own budget defers
+      api = fakeapi.FakeApi(rates={'home':0,'mentions':2},seed=1,clock=self.clock)
+      bot = self.run_bot(api,rate_limits={'/statuses/home_timeline':(0,900)})
+      self.assertEqual(api.calls['GetHomeTimeline'],0)
+      self.assertNotIn('home',bot._poll_intervals)
+      self.assertEqual(bot._poll_intervals['mentions'].interval,10)
+
+if __name__ == "__main__":
+   # run unit tests
+   unittest.main()
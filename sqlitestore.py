@@ -0,0 +1,164 @@
+'''
+SQLite-backed store for bot state.
+
+A single database file (in WAL mode) can hold the state of any number of bots: their last IDs,
+allowed bosses lists, timestamps and processed status indexes, each keyed by bot.  Anything in this
+package that loads or saves a file (storage.load_data / save_data, StorageMixin.load / save,
+timeutils.time_since_file / save_now_to_file) can be given a location in the store instead of a
+filename:
+
+   store = SqliteStore("bots.db")
+   last_ids = LastIds.load(store.location("mybot","last_ids"))
+
+Writes made inside a batch() are kept in memory (per thread) and committed in a single transaction
+when the outermost batch ends.
+'''
+
+import contextlib
+import sqlite3
+import threading
+
+import storage
+
+class SqliteStore(object):
+   '''
+   Bot state stored in a SQLite database.  Values are simple data (as handled by the storage
+   module), stored as JSON.
+   '''
+
+   def __init__(self,filename,timeout=30.0):
+      self._filename=filename
+      self._serializer=storage.SERIALIZERS['json']
+      # one connection shared by all threads; access is serialized by the lock
+      self._lock=threading.RLock()
+      self._connection=sqlite3.connect(filename,timeout=timeout,check_same_thread=False,
+         isolation_level=None)
+      self._connection.execute("PRAGMA journal_mode=WAL")
+      self._connection.execute("PRAGMA synchronous=NORMAL")
+      self._connection.execute("CREATE TABLE IF NOT EXISTS state ("
+         "bot TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, PRIMARY KEY (bot,key))")
+      # writes waiting for the end of the current batch, per thread
+      self._local=threading.local()
+
+   @property
+   def filename(self):
+      return self._filename
+
+   def location(self,bot,key):
+      '''
+      Returns a storage location for the given bot and key, usable in place of a filename.
+      '''
+      return StoreLocation(self,bot,key)
+
+   def _pending(self):
+      if not hasattr(self._local,'depth'):
+         self._local.depth=0
+         self._local.state={}
+      return self._local
+
+   @contextlib.contextmanager
+   def batch(self):
+      '''
+      Context manager that groups all writes made by this thread into one transaction, committed
+      when the outermost batch ends.  If the batch ends with an exception, its writes are dropped.
+      '''
+      pending=self._pending()
+      pending.depth+=1
+      try:
+         yield self
+      except:
+         pending.depth-=1
+         if pending.depth == 0:
+            pending.state={}
+         raise
+      pending.depth-=1
+      if pending.depth == 0:
+         self._commit(pending)
+
+   def flush(self):
+      '''
+      Commits the writes this thread made in the current batch right away, without waiting for the
+      batch to end.
+      '''
+      self._commit(self._pending())
+
+   def _commit(self,pending):
+      state=pending.state
+      pending.state={}
+      if not state:
+         return
+      with self._lock:
+         self._connection.execute("BEGIN")
+         try:
+            self._connection.executemany("INSERT OR REPLACE INTO state (bot,key,value) "
+               "VALUES (?,?,?)",[(bot,key,value) for (bot,key),value in state.items()])
+            self._connection.execute("COMMIT")
+         except:
+            self._connection.execute("ROLLBACK")
+            raise
+
+   def get(self,bot,key):
+      '''
+      Returns the value stored for a bot and key, or None if there is none.
+      '''
+      pending=self._pending()
+      if (bot,key) in pending.state:
+         return self._serializer.loads(pending.state[(bot,key)])
+      with self._lock:
+         row=self._connection.execute("SELECT value FROM state WHERE bot=? AND key=?",
+            (bot,key)).fetchone()
+      if row is None:
+         return None
+      return self._serializer.loads(row[0])
+
+   def put(self,bot,key,value):
+      '''
+      Stores a value for a bot and key.
+      '''
+      with self.batch() as store:
+         store._pending().state[(bot,key)]=self._serializer.dumps(value)
+
+   def contains(self,bot,key):
+      return self.get(bot,key) is not None
+
+   def close(self):
+      with self._lock:
+         self._connection.close()
+
+class StoreLocation(object):
+   '''
+   A (bot, key) location in a SqliteStore, usable wherever the storage functions take a filename.
+   '''
+
+   def __init__(self,store,bot,key):
+      self.store=store
+      self.bot=bot
+      self.key=key
+
+   def exists(self):
+      return self.store.contains(self.bot,self.key)
+
+   def load_data(self):
+      return self.store.get(self.bot,self.key)
+
+   def save_data(self,data):
+      self.store.put(self.bot,self.key,data)
+
+   def batch(self):
+      return self.store.batch()
+
+   def flush(self):
+      self.store.flush()
+
+   def __eq__(self,other):
+      return isinstance(other,StoreLocation) and (self.store,self.bot,self.key) == \
+         (other.store,other.bot,other.key)
+
+   def __ne__(self,other):
+      return not self == other
+
+   def __hash__(self):
+      return hash((id(self.store),self.bot,self.key))
+
+   def __str__(self):
+      return "{0}:{1}/{2}".format(self.store.filename,self.bot,self.key)
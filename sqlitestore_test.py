@@ -0,0 +1,77 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+import storage
+import timeutils
+from sqlitestore import SqliteStore
+
+class Counters(storage.StorageMixin):
+   def __init__(self):
+      self.first = None
+      self.second = None
+
+class TestSqliteStore(unittest.TestCase):
+   def setUp(self):
+      self.directory = tempfile.mkdtemp()
+      self.filename = os.path.join(self.directory,"bots.db")
+      self.store = SqliteStore(self.filename)
+
+   def tearDown(self):
+      self.store.close()
+      shutil.rmtree(self.directory)
+
+   def stored_keys(self):
+      # read through a separate connection, to see only what has been committed
+      connection = sqlite3.connect(self.filename)
+      try:
+         return sorted(connection.execute("SELECT bot,key FROM state").fetchall())
+      finally:
+         connection.close()
+
+   def test_bots_are_isolated(self):
+      self.store.put("bot1","allowed_bosses.dat",["alice"])
+      self.store.put("bot2","allowed_bosses.dat",["bob"])
+      self.assertEqual(storage.load_list(self.store.location("bot1","allowed_bosses.dat")),
+         ["alice"])
+      self.assertEqual(storage.load_list(self.store.location("bot2","allowed_bosses.dat")),
+         ["bob"])
+      self.assertEqual(storage.load_list(self.store.location("bot3","allowed_bosses.dat")),[])
+
+   def test_storage_mixin(self):
+      location = self.store.location("bot1","last_ids.dat")
+      self.assertEqual(Counters.load(location).first,None)
+
+      counters = Counters()
+      counters.first = 633389383438393344
+      counters.save(location)
+      self.assertEqual(Counters.load(location).first,633389383438393344)
+
+   def test_batch(self):
+      with storage.batch(self.store.location("bot1","last_ids.dat")):
+         self.store.put("bot1","a",1)
+         self.store.put("bot1","b",2)
+
+         # pending writes are visible to this thread, but not yet committed
+         self.assertEqual(self.store.get("bot1","a"),1)
+         self.assertEqual(self.stored_keys(),[])
+
+      self.assertEqual(self.stored_keys(),[("bot1","a"),("bot1","b")])
+
+   def test_failed_batch(self):
+      with self.assertRaises(ValueError):
+         with self.store.batch():
+            self.store.put("bot1","a",1)
+            raise ValueError("update failed")
+      self.assertEqual(self.store.get("bot1","a"),None)
+
+   def test_timestamps(self):
+      location = self.store.location("bot1","last_tweet.dat")
+      self.assertEqual(timeutils.time_since_file(location),timeutils.dt.timedelta.max)
+      timeutils.save_now_to_file(location)
+      self.assertTrue(timeutils.time_since_file(location) < timeutils.dt.timedelta.max)
+
+if __name__ == "__main__":
+   # run unit tests
+   unittest.main()
@@ -0,0 +1,120 @@
+'''
+Bounded, persistent index of the statuses a bot has already handled.
+'''
+
+import collections
+
+import botlog
+import storage
+
+class FeedIndex(object):
+   '''
+   Ordered set of the most recently handled status IDs of one feed, holding at most capacity IDs.
+
+   When the set is full, the oldest ID is evicted and the watermark is raised to it.  Status IDs
+   increase over time, so any ID at or below the watermark is older than everything in the set and
+   is treated as handled.  Lookups and insertions are O(1).
+   '''
+
+   def __init__(self,capacity):
+      self._capacity=capacity
+      self._ids=set()
+      self._order=collections.deque()
+      # highest ID evicted so far (None if nothing has been evicted)
+      self.watermark=None
+
+   def __contains__(self,status_id):
+      return status_id in self._ids or (self.watermark is not None and status_id <= self.watermark)
+
+   def __len__(self):
+      return len(self._ids)
+
+   def add(self,status_id):
+      '''
+      Adds an ID to the set.  Returns False if it was already handled.
+      '''
+      if status_id in self:
+         return False
+      self._ids.add(status_id)
+      self._order.append(status_id)
+      while len(self._order) > self._capacity:
+         evicted=self._order.popleft()
+         self._ids.discard(evicted)
+         if self.watermark is None or evicted > self.watermark:
+            self.watermark=evicted
+      return True
+
+   def to_data(self):
+      return {'ids':list(self._order),'watermark':self.watermark}
+
+   @classmethod
+   def from_data(ClassObj,data,capacity):
+      index=ClassObj(capacity)
+      for status_id in data.get('ids',[]):
+         index.add(status_id)
+      if data.get('watermark') is not None:
+         index.watermark=max(data['watermark'],index.watermark)
+      return index
+
+class ProcessedIndex(object):
+   '''
+   Index of handled status (or direct message) IDs for each of a bot's feeds, kept in a FeedIndex
+   per feed so that a status seen on one feed (e.g. 'home') is still handled on another (e.g.
+   'mentions').  Memory use is bounded by the per-feed capacity no matter how long the bot runs.
+   '''
+
+   def __init__(self,capacity=5000):
+      self._capacity=capacity
+      self._feeds={}
+      self._changed=False
+
+   def feed(self,name):
+      if name not in self._feeds:
+         self._feeds[name]=FeedIndex(self._capacity)
+      return self._feeds[name]
+
+   def seen(self,feed,status_id):
+      return status_id in self.feed(feed)
+
+   def claim(self,feed,statuses):
+      '''
+      Returns the statuses that have not been handled yet on the given feed, in their original
+      order, and marks them as handled.
+      '''
+      index=self.feed(feed)
+      # add oldest first, so that the newest IDs are the last to be evicted
+      new_ids=set(s.id for s in reversed(statuses) if index.add(s.id))
+      if len(new_ids) > 0:
+         self._changed=True
+      return [s for s in statuses if s.id in new_ids]
+
+   def changed(self):
+      return self._changed
+
+   @classmethod
+   def load(ClassObj,filename,capacity=5000):
+      '''
+      Loads an index from a storage target (a filename or storage location).  A missing or corrupt
+      file gives an empty index.
+      '''
+      instance=ClassObj(capacity)
+      try:
+         data=storage.load_data(filename)
+      except storage.StorageFormatError:
+         botlog.default_logger().warning('state_corrupt',
+            "processed status index is corrupt; starting empty",filename=filename)
+         data=None
+      for name,feed_data in (data or {}).items():
+         instance._feeds[str(name)]=FeedIndex.from_data(feed_data,capacity)
+      return instance
+
+   def save(self,filename,fsync=False):
+      storage.save_data(dict((name,index.to_data()) for name,index in self._feeds.items()),
+         filename,fsync)
+      self._changed=False
+
+   def save_if_changed(self,filename,fsync=False):
+      if not self._changed:
+         return False
+      self.save(filename,fsync)
+      return True
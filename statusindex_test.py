@@ -0,0 +1,103 @@
+import itertools
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import command
+import fakeapi
+from statusindex import FeedIndex, ProcessedIndex
+from testutils import FakeClock, Status, make_bot
+from twitterbot import TwitterBot
+
+runs = itertools.count(1)
+
+@command.register("indexping")
+def indexping(bot):
+   return "pong {0}".format(next(runs))
+
+class TestFeedIndex(unittest.TestCase):
+   def test_bounded(self):
+      index = FeedIndex(3)
+      for status_id in [10,11,12,13,14]:
+         self.assertTrue(index.add(status_id))
+      self.assertEqual(len(index),3)
+      self.assertFalse(index.add(14))
+
+      # evicted IDs are still treated as handled through the watermark
+      self.assertEqual(index.watermark,11)
+      self.assertTrue(10 in index)
+      self.assertTrue(11 in index)
+      self.assertFalse(15 in index)
+
+class TestProcessedIndex(unittest.TestCase):
+   def setUp(self):
+      self.directory = tempfile.mkdtemp()
+      self.filename = os.path.join(self.directory,"processed_ids.dat")
+
+   def tearDown(self):
+      shutil.rmtree(self.directory)
+
+   def test_claim(self):
+      index = ProcessedIndex()
+      batch = [Status(3),Status(2),Status(1)]
+      self.assertEqual([s.id for s in index.claim('mentions',batch)],[3,2,1])
+      self.assertTrue(index.changed())
+
+      # statuses are only claimed once per feed
+      batch = [Status(4),Status(3),Status(2)]
+      self.assertEqual([s.id for s in index.claim('mentions',batch)],[4])
+      self.assertEqual([s.id for s in index.claim('home',batch)],[4,3,2])
+
+   def test_persistence(self):
+      index = ProcessedIndex(capacity=2)
+      index.claim('mentions',[Status(3),Status(2),Status(1)])
+      index.claim('dms',[Status(7)])
+      self.assertTrue(index.save_if_changed(self.filename))
+      self.assertFalse(index.save_if_changed(self.filename))
+
+      loaded = ProcessedIndex.load(self.filename,capacity=2)
+      self.assertTrue(loaded.seen('mentions',1))
+      self.assertTrue(loaded.seen('mentions',3))
+      self.assertTrue(loaded.seen('dms',7))
+      self.assertFalse(loaded.seen('dms',8))
+      self.assertEqual(loaded.claim('mentions',[Status(4),Status(3)])[0].id,4)
+
+      self.assertFalse(ProcessedIndex.load(os.path.join(self.directory,"none.dat")).seen('dms',7))
+
+class TestBotRestart(unittest.TestCase):
+   def setUp(self):
+      self.directory = tempfile.mkdtemp()
+
+   def tearDown(self):
+      shutil.rmtree(self.directory)
+
+   def run_bot(self,api):
+      bot = make_bot(TwitterBot,api,self.directory)
+      bot.start()
+      try:
+         bot.tick()
+         self.assertTrue(bot._command_engine.wait(5))
+      finally:
+         bot.shutdown()
+
+   def test_lost_last_ids(self):
+      clock = FakeClock(time.time())
+      api = fakeapi.FakeApi(rates={'home':0,'mentions':0,'commands':2},commands=["indexping"],
+         seed=1,clock=clock)
+      clock.now += 5.0
+      self.run_bot(api)
+      commands = api.GetMentions(count=200)
+      self.assertTrue(len(commands) > 0)
+      self.assertEqual(len(api.posts),len(commands))
+      ran = next(runs)
+
+      # the bot restarts without its last IDs, so it fetches the same mentions again
+      os.remove(os.path.join(self.directory,"last_ids.dat"))
+      self.run_bot(api)
+      self.assertEqual(next(runs),ran+1)
+      self.assertEqual(len(api.posts),len(commands))
+
+if __name__ == "__main__":
+   # run unit tests
+   unittest.main()
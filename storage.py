@@ -1,14 +1,34 @@
 '''
-Utility functions for saving simple objects (consisting of simple data types) to plaintext files,
-and reading them back.
+Utility functions for saving simple objects (consisting of simple data types) to files, and reading
+them back.
 
-Note that the storage methods in this file are horribly insecure and should not be used for any
-program running in a priveleged context.
+Data is stored through a pluggable serializer: JSON (the default, human readable) or a compact
+binary format.  Both only handle simple data types (None, booleans, numbers, strings, lists and
+dictionaries), and neither runs any code when loading.  Files in the old format (a Python literal,
+as written by earlier versions of this module) are still read; StorageMixin state files are migrated
+to the default format the first time they are loaded.
+
+The contents of loaded and saved files are cached, keyed on the file's modification time and size,
+so loading a file that has not changed does not read it or detect its format again.  Each load
+parses the cached contents, so that every caller gets its own copy of the data.
+
+Wherever a filename is expected, a storage location (an object with exists, load_data, save_data and
+batch methods, such as a sqlitestore.StoreLocation) can be used instead.
 
 This typically should be used only for simple configuration files and the like.  For anything more
 complicated, just use pickle or some other serialization method.
 '''
+import ast
+import contextlib
+import copy
+import json
+import os
 import os.path
+import struct
+import tempfile
+import threading
+
+import botlog
 
 class StorageError(Exception):
   '''Base class for storage errors'''
@@ -18,23 +38,260 @@ class StorageError(Exception):
     '''Returns the first argument used to construct this error.'''
     return self.args[0]
 
-def load_data(filename):
+class StorageFormatError(StorageError):
+  '''Raised when the contents of a storage file cannot be parsed'''
+  pass
+
+class JsonSerializer(object):
+   '''
+   Stores data as JSON text.
+   '''
+   def dumps(self,data):
+      return json.dumps(data,separators=(',',':'))
+
+   def loads(self,source):
+      return json.loads(source)
+
+class BinarySerializer(object):
+   '''
+   Stores data in a compact tagged binary format.  Each value is a one-byte type tag followed by
+   its little-endian payload; strings, lists and dictionaries are prefixed by their length.
+   '''
+   MAGIC = b'TBS\x01'
+
+   def dumps(self,data):
+      parts = [self.MAGIC]
+      self._encode(data,parts)
+      return b''.join(parts)
+
+   def _encode(self,value,parts):
+      if value is None:
+         parts.append(b'N')
+      elif value is True:
+         parts.append(b'T')
+      elif value is False:
+         parts.append(b'F')
+      elif isinstance(value,(int,long)):
+         if -2**31 <= value < 2**31:
+            parts.append(b'i' + struct.pack('<i',value))
+         elif -2**63 <= value < 2**63:
+            parts.append(b'q' + struct.pack('<q',value))
+         else:
+            digits = str(value).encode('ascii')
+            parts.append(b'I' + struct.pack('<I',len(digits)) + digits)
+      elif isinstance(value,float):
+         parts.append(b'd' + struct.pack('<d',value))
+      elif isinstance(value,unicode):
+         encoded = value.encode('utf-8')
+         parts.append(b'u' + struct.pack('<I',len(encoded)) + encoded)
+      elif isinstance(value,bytes):
+         parts.append(b's' + struct.pack('<I',len(value)) + value)
+      elif isinstance(value,(list,tuple)):
+         parts.append(b'l' + struct.pack('<I',len(value)))
+         for item in value:
+            self._encode(item,parts)
+      elif isinstance(value,dict):
+         parts.append(b'm' + struct.pack('<I',len(value)))
+         for k,v in value.items():
+            self._encode(k,parts)
+            self._encode(v,parts)
+      else:
+         raise StorageError("Unable to store value of type {0}".format(type(value).__name__))
+
+   def loads(self,source):
+      if not source.startswith(self.MAGIC):
+         raise StorageFormatError("Not a binary storage file")
+      try:
+         value, offset = self._decode(source,len(self.MAGIC))
+      except (struct.error,IndexError,ValueError):
+         raise StorageFormatError("Truncated or corrupt binary storage file")
+      if offset != len(source):
+         raise StorageFormatError("Trailing data in binary storage file")
+      return value
+
+   def _decode(self,source,offset):
+      tag = source[offset:offset+1]
+      offset += 1
+      if tag == b'N':
+         return None, offset
+      if tag == b'T':
+         return True, offset
+      if tag == b'F':
+         return False, offset
+      if tag == b'i':
+         return struct.unpack_from('<i',source,offset)[0], offset+4
+      if tag == b'q':
+         return struct.unpack_from('<q',source,offset)[0], offset+8
+      if tag == b'd':
+         return struct.unpack_from('<d',source,offset)[0], offset+8
+      if tag in (b'I',b's',b'u'):
+         length = struct.unpack_from('<I',source,offset)[0]
+         offset += 4
+         payload = source[offset:offset+length]
+         if len(payload) != length:
+            raise ValueError("truncated string")
+         offset += length
+         if tag == b'I':
+            return int(payload), offset
+         if tag == b'u':
+            return payload.decode('utf-8'), offset
+         return payload, offset
+      if tag == b'l':
+         count = struct.unpack_from('<I',source,offset)[0]
+         offset += 4
+         items = []
+         for i in xrange(count):
+            item, offset = self._decode(source,offset)
+            items.append(item)
+         return items, offset
+      if tag == b'm':
+         count = struct.unpack_from('<I',source,offset)[0]
+         offset += 4
+         d = {}
+         for i in xrange(count):
+            k, offset = self._decode(source,offset)
+            d[k], offset = self._decode(source,offset)
+         return d, offset
+      raise ValueError("unknown tag")
+
+# available serializers, by format name
+SERIALIZERS = {
+   'json': JsonSerializer(),
+   'binary': BinarySerializer(),
+}
+
+# format used when saving (and when migrating files in the old format)
+_default_format = 'json'
+
+# cache of file contents: absolute filename -> (modification time, size, contents, format)
+_cache = {}
+_cache_lock = threading.Lock()
+
+def set_default_format(format):
+   '''
+   Sets the format ('json' or 'binary') used when saving files.
+   '''
+   global _default_format
+   if format not in SERIALIZERS:
+      raise StorageError("Unknown storage format: {0}".format(format))
+   _default_format = format
+
+def is_location(target):
+   '''
+   Returns whether a storage target is a storage location (rather than a filename).
+   '''
+   return not isinstance(target,basestring)
+
+def exists(target):
+   '''
+   Returns whether there is stored data at a storage target (a filename or storage location).
+   '''
+   if is_location(target):
+      return target.exists()
+   return os.path.isfile(target)
+
+def target_id(target):
+   '''
+   Returns a value identifying a storage target, such that two targets referring to the same stored
+   data have equal IDs.
+   '''
+   if is_location(target):
+      return target
+   return os.path.abspath(target)
+
+@contextlib.contextmanager
+def _no_batch():
+   yield
+
+def batch(target):
+   '''
+   Returns a context manager that groups the writes to a storage target's backend into a single
+   transaction.  Files are written immediately, so for a filename this does nothing.
    '''
-   Loads a file into a dictionary.  The file must be of a format similar to initializing an object
-   such as a dictionary or list in Python code:
+   if is_location(target):
+      return target.batch()
+   return _no_batch()
+
+def flush(target):
+   '''
+   Commits any writes to a storage target's backend that are waiting for the end of a batch.  Files
+   are written immediately, so for a filename this does nothing.
+   '''
+   if is_location(target):
+      target.flush()
+
+def parse_data(source):
+   '''
+   Parses the contents of a storage file, detecting its format.  Returns a tuple of (data, format),
+   where format is None for files in the old Python literal format.
+   '''
+   if source.startswith(BinarySerializer.MAGIC):
+      return SERIALIZERS['binary'].loads(source), 'binary'
+   try:
+      return SERIALIZERS['json'].loads(source), 'json'
+   except ValueError:
+      pass
+   # the old format: a Python literal, which is parsed without evaluating any code
+   try:
+      return ast.literal_eval(source.strip()), None
+   except (SyntaxError,ValueError,TypeError):
+      raise StorageFormatError("Unable to parse storage data")
+
+def load_data(filename,migrate=False):
+   '''
+   Loads a file into a dictionary or list (or whatever simple data it contains).  Returns None if
+   the file does not exist, and raises StorageFormatError if it cannot be parsed.
+
+   Files in the old format, similar to initializing an object such as a dictionary or list in
+   Python code, are also accepted:
 
    {'key1':'value1','key2':'value2'}
    ['value1','value2']
 
-   Newlines are stripped out (and thus the data file should avoid using the '\' character to denote
-   line continuation).
+   If migrate is True, such files are rewritten in the default format, unless that would change
+   their data (JSON has no tuples, and only string keys).  A file that cannot be rewritten (e.g.
+   because it is read-only) is left as it is.  Only pass migrate for files this package owns, not
+   for configuration that people edit by hand.
    '''
+   if is_location(filename):
+      return filename.load_data()
    if not os.path.isfile(filename):
       return None
-   source = ""
-   with open(filename,'r') as source_file:
-      source = "".join(source_file.readlines())
-   return eval(source)
+   path = os.path.abspath(filename)
+   stat = os.stat(path)
+   with _cache_lock:
+      cached = _cache.get(path)
+   if cached is not None and cached[0] == stat.st_mtime and cached[1] == stat.st_size:
+      return SERIALIZERS[cached[3]].loads(cached[2])
+
+   with open(path,'rb') as source_file:
+      source = source_file.read()
+   try:
+      data, format = parse_data(source)
+   except StorageFormatError:
+      raise StorageFormatError("Unable to parse storage file: {0}".format(filename))
+
+   if format is None:
+      if migrate:
+         migrate_data(data,filename)
+   else:
+      with _cache_lock:
+         _cache[path] = (stat.st_mtime,stat.st_size,source,format)
+   return data
+
+def migrate_data(data,filename):
+   '''
+   Rewrites data loaded from a file in the old format in the default format, if that keeps the data
+   as it is.  Failures are logged rather than raised, since the file can still be read as it is.
+   '''
+   try:
+      serializer = SERIALIZERS[_default_format]
+      if serializer.loads(serializer.dumps(data)) != data:
+         return
+      save_data(data,filename)
+   except (EnvironmentError,StorageError),e:
+      botlog.default_logger().warning('migration_failed',
+         "unable to rewrite storage file in the new format",filename=filename,error=e)
 
 def load_list(filename):
    data = load_data(filename)
@@ -47,61 +304,128 @@ def load_dict(filename):
       return {}
    return data
 
-def save_dict(d,filename):
+def atomic_write(filename,data,fsync=False):
+   '''
+   Writes data to a file such that readers see either the old contents or the new contents, never a
+   partially written file: the data is written to a temporary file in the same directory, which then
+   replaces the original.  If fsync is True, the data is flushed to disk before the replacement.
+   '''
+   directory = os.path.dirname(os.path.abspath(filename))
+   fd, temp_filename = tempfile.mkstemp(dir=directory,prefix=".tmp-")
+   try:
+      with os.fdopen(fd,'wb') as temp_file:
+         temp_file.write(data)
+         if fsync:
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+      try:
+         os.rename(temp_filename,filename)
+      except OSError:
+         # rename does not replace an existing file on Windows
+         os.remove(filename)
+         os.rename(temp_filename,filename)
+   except:
+      if os.path.exists(temp_filename):
+         os.remove(temp_filename)
+      raise
+
+def save_data(data,filename,fsync=False,format=None):
    '''
-   Saves a dictionary into a file.  The resulting file with contain (in plaintext), the Python
-   dictionary in text form. E.g.,
+   Saves simple data (e.g. a dictionary or list) into a file, using the given format or, if none is
+   given, the default format.
+   '''
+   if is_location(filename):
+      filename.save_data(data)
+      return
 
-   {'key1':'value1','key2':'value2'}
+   format = format or _default_format
+   source = SERIALIZERS[format].dumps(data)
+   atomic_write(filename,source,fsync)
+
+   path = os.path.abspath(filename)
+   stat = os.stat(path)
+   with _cache_lock:
+      _cache[path] = (stat.st_mtime,stat.st_size,source,format)
+
+def save_dict(d,filename,fsync=False,format=None):
    '''
-   with open(filename,'w') as dest_file:
-      dest_file.write('{')
-      for k in d.keys():
-         if type(d[k]) is str:
-            dest_file.write("'{0}':'{1}',".format(k,d[k]))
-         else:
-            dest_file.write("'{0}':{1},".format(k,d[k]))
-      dest_file.write('}')
+   Saves a dictionary into a file. E.g., in the JSON format:
 
-def save_list(l,filename):
+   {"key1":"value1","key2":"value2"}
    '''
-   Saves a list into a file.  The resulting file with contain (in plaintext), the Python
-   list in text form. E.g.,
+   save_data(d,filename,fsync,format)
 
-   ['value1','value2']
+def save_list(l,filename,fsync=False,format=None):
    '''
-   with open(filename,'w') as dest_file:
-      dest_file.write('[')
-      for value in l:
-         if type(value) is str:
-            dest_file.write("'{1}',".format(k,value))
-         else:
-            dest_file.write("{1},".format(k,value))
-      dest_file.write(']')
+   Saves a list into a file. E.g., in the JSON format:
+
+   ["value1","value2"]
+   '''
+   save_data(l,filename,fsync,format)
 
 class StorageMixin(object):
    '''
    A mixin which adds a 'load' and 'save' method to an object, which will write the object's member
    variables into a file.
 
-   This mixin only works with data types with members where the return value of __str__ can be used
-   to construct a new identical object.  This works for primitive data types (e.g. the result of
-   printing out an integer can be used to construct/assign a new integer).
+   This mixin only works with member variables of simple data types (None, booleans, numbers,
+   strings, and lists and dictionaries of those).
+
+   Member variables starting with an underscore are not stored.  The mixin remembers what was last
+   loaded or saved, so that save_if_changed only writes to the file when a stored value changed.
+   Files in the old format are migrated to the default format when loaded (see load_data).
    '''
 
    @classmethod
    def load(ClassObj,filename):
       instance = ClassObj()
-      if not os.path.isfile(filename):
+      if not exists(filename):
          # return empty
          return instance
-      instance_dict = load_data(filename)
+      try:
+         instance_dict = load_data(filename,migrate=True)
+      except StorageFormatError:
+         if is_location(filename):
+            raise
+         # a corrupt or partially written file: move it out of the way and start over
+         corrupt_filename = filename + ".corrupt"
+         botlog.default_logger().warning('state_corrupt',
+            "storage file is corrupt; moved aside and starting empty",filename=filename,
+            moved_to=corrupt_filename)
+         if os.path.exists(corrupt_filename):
+            os.remove(corrupt_filename)
+         os.rename(filename,corrupt_filename)
+         return instance
       for k in instance_dict:
          if k not in instance.__dict__.keys():
             raise StorageError("Error processing storage file ({0}): member variable name '{1}' "
                "not recognized.".format(filename,k))
-         instance.__dict__[k] = instance_dict[k]
+         instance.__dict__[str(k)] = instance_dict[k]
+      instance._saved_state = copy.deepcopy(instance.storage_dict())
       return instance
 
-   def save(self,filename):
-      save_dict(self.__dict__,filename)
+   def storage_dict(self):
+      '''
+      Returns a dictionary of the member variables that are stored.
+      '''
+      return dict((k,v) for k,v in self.__dict__.items() if not k.startswith('_'))
+
+   def changed(self):
+      '''
+      Returns whether any stored member variable changed since the object was last loaded or saved.
+      '''
+      return self.storage_dict() != getattr(self,'_saved_state',None)
+
+   def save(self,filename,fsync=False):
+      state = self.storage_dict()
+      save_dict(state,filename,fsync)
+      self._saved_state = copy.deepcopy(state)
+
+   def save_if_changed(self,filename,fsync=False):
+      '''
+      Saves the object only if a stored member variable changed.  Returns whether it was saved.
+      '''
+      if not self.changed():
+         return False
+      self.save(filename,fsync)
+      return True
@@ -0,0 +1,156 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import storage
+
+class Counters(storage.StorageMixin):
+   def __init__(self):
+      self.first = None
+      self.second = None
+      self._not_stored = 0
+
+class TestSerialization(unittest.TestCase):
+   def setUp(self):
+      self.directory = tempfile.mkdtemp()
+      self.filename = os.path.join(self.directory,"data.dat")
+
+   def tearDown(self):
+      shutil.rmtree(self.directory)
+
+   def test_round_trip(self):
+      data = {'none':None,'flag':True,'id':633389383438393344,'big':2**70,'ratio':0.25,
+         'name':'bot','text':u'caf\xe9','list':[1,'two',[3.0,None]],'nested':{'a':{'b':False}}}
+      for format in ['json','binary']:
+         storage.save_dict(data,self.filename,format=format)
+         self.assertEqual(storage.load_dict(self.filename),data)
+
+      # binary data is smaller than the equivalent JSON
+      ids = range(633389383438393344,633389383438393344+1000)
+      storage.save_list(ids,self.filename,format='json')
+      json_size = os.path.getsize(self.filename)
+      storage.save_list(ids,self.filename,format='binary')
+      self.assertTrue(os.path.getsize(self.filename) < json_size)
+      self.assertEqual(storage.load_list(self.filename),ids)
+
+   def test_legacy_migration(self):
+      legacy = "{'home':None,'mentions':633389383438393344,\n'name':'bot',}"
+      with open(self.filename,'w') as legacy_file:
+         legacy_file.write(legacy)
+
+      # files are only rewritten when asked to
+      data = storage.load_dict(self.filename)
+      self.assertEqual(data,{'home':None,'mentions':633389383438393344,'name':'bot'})
+      with open(self.filename,'r') as legacy_file:
+         self.assertEqual(legacy_file.read(),legacy)
+
+      # the file has been rewritten in the default format
+      self.assertEqual(storage.load_data(self.filename,migrate=True),data)
+      with open(self.filename,'r') as migrated_file:
+         self.assertEqual(json.loads(migrated_file.read()),data)
+
+   def test_migration_keeps_data(self):
+      # JSON would turn the tuple into a list and the key into a string
+      legacy = "{'secret':('a','b'),1:'one'}"
+      with open(self.filename,'w') as legacy_file:
+         legacy_file.write(legacy)
+      self.assertEqual(storage.load_data(self.filename,migrate=True),
+         {'secret':('a','b'),1:'one'})
+      with open(self.filename,'r') as legacy_file:
+         self.assertEqual(legacy_file.read(),legacy)
+
+      # a file that cannot be rewritten is still loaded
+      with open(self.filename,'w') as legacy_file:
+         legacy_file.write("['a','b']")
+      def fail(*args,**kwargs):
+         raise IOError(13,"Permission denied")
+      atomic_write = storage.atomic_write
+      storage.atomic_write = fail
+      try:
+         self.assertEqual(storage.load_data(self.filename,migrate=True),['a','b'])
+      finally:
+         storage.atomic_write = atomic_write
+      with open(self.filename,'r') as legacy_file:
+         self.assertEqual(legacy_file.read(),"['a','b']")
+
+   def test_no_code_execution(self):
+      with open(self.filename,'w') as evil_file:
+         evil_file.write("__import__('os').getcwd()")
+      with self.assertRaises(storage.StorageFormatError):
+         storage.load_data(self.filename)
+
+   def test_cache(self):
+      storage.save_list(['a','b'],self.filename)
+      loaded = storage.load_list(self.filename)
+      # callers get their own copy of cached data
+      loaded.append('c')
+      self.assertEqual(storage.load_list(self.filename),['a','b'])
+
+      # changes made to the file are picked up
+      with open(self.filename,'w') as data_file:
+         data_file.write('["a","b","c","d"]')
+      self.assertEqual(storage.load_list(self.filename),['a','b','c','d'])
+
+      self.assertEqual(storage.load_list(os.path.join(self.directory,"missing.dat")),[])
+
+      # cached binary files load as binary
+      storage.save_list([1,2],self.filename,format='binary')
+      self.assertEqual(storage.load_list(self.filename),[1,2])
+      self.assertEqual(storage.load_list(self.filename),[1,2])
+
+class TestStorageMixin(unittest.TestCase):
+   def setUp(self):
+      self.directory = tempfile.mkdtemp()
+      self.filename = os.path.join(self.directory,"counters.dat")
+
+   def tearDown(self):
+      shutil.rmtree(self.directory)
+
+   def test_save_and_load(self):
+      counters = Counters()
+      counters.first = 12345678901234
+      counters.second = "abc"
+      counters.save(self.filename)
+
+      loaded = Counters.load(self.filename)
+      self.assertEqual(loaded.first,12345678901234)
+      self.assertEqual(loaded.second,"abc")
+      self.assertEqual(loaded._not_stored,0)
+      # no temporary files left behind
+      self.assertEqual(os.listdir(self.directory),["counters.dat"])
+
+   def test_save_if_changed(self):
+      counters = Counters()
+      self.assertTrue(counters.save_if_changed(self.filename,fsync=True))
+      self.assertFalse(counters.save_if_changed(self.filename))
+
+      # private members do not count as changes
+      counters._not_stored = 1
+      self.assertFalse(counters.save_if_changed(self.filename))
+
+      counters.first = 1
+      self.assertTrue(counters.save_if_changed(self.filename))
+
+      loaded = Counters.load(self.filename)
+      self.assertFalse(loaded.changed())
+
+   def test_legacy_migration(self):
+      with open(self.filename,'w') as legacy_file:
+         legacy_file.write("{'first':12,'second':'abc'}")
+      self.assertEqual(Counters.load(self.filename).first,12)
+      with open(self.filename,'r') as migrated_file:
+         self.assertEqual(json.loads(migrated_file.read()),{'first':12,'second':'abc'})
+
+   def test_corrupt_file(self):
+      with open(self.filename,'w') as partial_file:
+         partial_file.write("{'first':12,'sec")
+
+      loaded = Counters.load(self.filename)
+      self.assertEqual(loaded.first,None)
+      self.assertFalse(os.path.exists(self.filename))
+      self.assertTrue(os.path.exists(self.filename + ".corrupt"))
+
+if __name__ == "__main__":
+   # run unit tests
+   unittest.main()
@@ -0,0 +1,287 @@
+'''
+Reader for the twitter streaming API: one long-lived connection delivering line-delimited JSON.
+'''
+
+import json
+import threading
+
+import requests
+import twitter
+
+import botlog
+import duration
+
+# user stream of the authenticated user: its mentions, direct messages and home timeline
+USER_STREAM_URL='https://userstream.twitter.com/1.1/user.json'
+# HTTP statuses meaning the client is reconnecting too often
+RATE_LIMITED_STATUSES=set([420,429])
+
+class StreamError(Exception):
+   '''Base class for streaming errors'''
+
+   @property
+   def message(self):
+      '''Returns the first argument used to construct this error.'''
+      return self.args[0]
+
+class StreamHTTPError(StreamError):
+   '''Raised when the stream endpoint answers with an HTTP error'''
+
+   def __init__(self,status,reason=""):
+      super(StreamHTTPError,self).__init__("HTTP error {0} {1}".format(status,reason).strip())
+      self.status=status
+
+class LineDecoder(object):
+   '''
+   Decodes a stream of line-delimited JSON incrementally.  Chunks of bytes are fed in as they
+   arrive, in whatever sizes the connection delivers them; each complete line is decoded as soon as
+   its newline arrives, and a partial line is kept until the rest of it does.  Blank lines are
+   keep-alives, and are counted rather than decoded.
+   '''
+
+   def __init__(self,log=None):
+      # botlog.Logger for malformed messages
+      self._log=log or botlog.default_logger()
+      # start of a line whose newline has not arrived yet
+      self._partial=b''
+      # number of keep-alive lines seen
+      self.keepalives=0
+
+   def feed(self,chunk):
+      '''
+      Returns the list of messages completed by a chunk of bytes.
+      '''
+      if self._partial:
+         chunk=self._partial+chunk
+      lines=chunk.split(b'\n')
+      self._partial=lines.pop()
+      messages=[]
+      for line in lines:
+         line=line.strip()
+         if not line:
+            self.keepalives+=1
+            continue
+         try:
+            messages.append(json.loads(line))
+         except ValueError:
+            self._log.warning('stream_malformed_message',"skipping malformed stream message",
+               line=line[:80])
+      return messages
+
+class HTTPStream(object):
+   '''
+   Iterable over the chunks of bytes of a streaming HTTP response (a requests.Response opened with
+   stream=True), yielded as soon as they arrive.  close() may be called from another thread to
+   interrupt a blocked read.
+   '''
+
+   def __init__(self,response):
+      if response.status_code != 200:
+         response.close()
+         raise StreamHTTPError(response.status_code,response.reason or "")
+      self._response=response
+
+   def __iter__(self):
+      if self._response.headers.get('transfer-encoding','').lower() == 'chunked':
+         # a chunk size of None yields each chunk the server sends, without waiting for more
+         return self._response.iter_content(chunk_size=None)
+      return iter(self._response.raw.readline,b'')
+
+   def close(self):
+      self._response.close()
+
+def api_connect(api,url=USER_STREAM_URL,**params):
+   '''
+   Returns a connect function for StreamReader that opens a stream (by default the user stream)
+   through a twitter.Api object, with its authentication.
+   '''
+   def connect():
+      try:
+         return HTTPStream(api._RequestStream(url,'POST',data=params))
+      except twitter.TwitterError,te:
+         raise StreamError(te.message)
+   return connect
+
+def http_connect(url,params=None,timeout=(10,90)):
+   '''
+   Returns a connect function for StreamReader that opens an unauthenticated stream (e.g. from a
+   local stand-in server).  timeout is the (connect, read) timeout in seconds; the streaming API
+   sends a keep-alive every 30 seconds, so a read timeout of 90 seconds detects a stalled stream.
+   '''
+   def connect():
+      try:
+         return HTTPStream(requests.post(url,data=params or {},stream=True,timeout=timeout))
+      except requests.RequestException,e:
+         raise StreamError(str(e))
+   return connect
+
+class ReconnectBackoff(object):
+   '''
+   Delays between reconnection attempts, as the streaming API asks clients to back off: linearly
+   for network errors (which are usually brief), exponentially for HTTP errors, and exponentially
+   from a longer start when the client is rate limited for reconnecting too often.  reset() is
+   called once a connection succeeds.
+   '''
+
+   def __init__(self,network_step=duration.Duration(milliseconds=250),
+         network_max=duration.Duration(seconds=16),http_initial=duration.Duration(seconds=5),
+         http_max=duration.Duration(seconds=320),rate_limited_initial=duration.Duration(minutes=1)):
+      self._network_step=network_step.seconds
+      self._network_max=network_max.seconds
+      self._http_initial=http_initial.seconds
+      self._http_max=http_max.seconds
+      self._rate_limited_initial=rate_limited_initial.seconds
+      self.reset()
+
+   def reset(self):
+      # delay (seconds) before the next attempt, and the kind of error it backs off from
+      self.delay=0.0
+      self._kind=None
+
+   def network_error(self):
+      if self._kind != 'network':
+         self._kind,self.delay='network',0.0
+      self.delay=min(self.delay+self._network_step,self._network_max)
+      return self.delay
+
+   def http_error(self,status):
+      kind,initial='http',self._http_initial
+      if status in RATE_LIMITED_STATUSES:
+         kind,initial='rate_limited',self._rate_limited_initial
+      if self._kind != kind:
+         self._kind,self.delay=kind,initial
+      else:
+         self.delay=min(self.delay*2,max(self._http_max,initial))
+      return self.delay
+
+class StreamReader(object):
+   '''
+   Keeps a streaming connection open on a background thread, calling on_message(message) on that
+   thread for each decoded message.
+
+   connect() opens the stream and returns an iterable of chunks of bytes (e.g. an HTTPStream, see
+   api_connect and http_connect), or raises an error.  on_connect() is called each time a
+   connection is established, so that the caller can fill in what it missed while disconnected.
+   When the connection fails or ends, the reader reconnects after a delay given by its
+   ReconnectBackoff.
+   '''
+
+   def __init__(self,connect,on_message,on_connect=None,backoff=None,log=None):
+      self._connect=connect
+      self._on_message=on_message
+      self._on_connect=on_connect
+      self._backoff=backoff or ReconnectBackoff()
+      # botlog.Logger for connection errors
+      self._log=log or botlog.default_logger()
+      self._stopping=threading.Event()
+      self._lock=threading.Lock()
+      # open stream, if any
+      self._stream=None
+      self._thread=None
+      # number of connections established, and of messages and keep-alives received
+      self.connections=0
+      self.messages=0
+      self.keepalives=0
+
+   @property
+   def connected(self):
+      with self._lock:
+         return self._stream is not None
+
+   def start(self):
+      self._stopping.clear()
+      self._thread=threading.Thread(target=self._run,name="stream reader")
+      self._thread.daemon=True
+      self._thread.start()
+
+   def stop(self,timeout=None):
+      '''
+      Closes the connection and waits up to timeout seconds for the reader thread to finish.
+      '''
+      self._stopping.set()
+      with self._lock:
+         stream=self._stream
+      if stream is not None and hasattr(stream,'close'):
+         try:
+            stream.close()
+         except Exception:
+            pass
+      if self._thread is not None:
+         self._thread.join(timeout)
+         self._thread=None
+
+   def _run(self):
+      while not self._stopping.is_set():
+         try:
+            self._read(self._connect())
+            # the server ended the stream; reconnect right away, but back off if it keeps happening
+            delay=self._backoff.network_error()
+         except StreamHTTPError,e:
+            delay=self._backoff.http_error(e.status)
+            self._log.warning('stream_refused',"stream connection refused; reconnecting",
+               error=e.message,status=e.status,retry_seconds=delay)
+         except Exception,e:
+            if self._stopping.is_set():
+               break
+            delay=self._backoff.network_error()
+            self._log.warning('stream_lost',"stream connection lost; reconnecting",error=e,
+               retry_seconds=delay)
+         self._stopping.wait(delay)
+
+   def _read(self,stream):
+      with self._lock:
+         self._stream=stream
+      try:
+         self.connections+=1
+         self._backoff.reset()
+         if self._on_connect is not None:
+            self._on_connect()
+         decoder=LineDecoder(self._log)
+         keepalives=self.keepalives
+         for chunk in stream:
+            if self._stopping.is_set():
+               break
+            for message in decoder.feed(chunk):
+               self.messages+=1
+               try:
+                  self._on_message(message)
+               except Exception:
+                  self._log.exception('stream_message_failed',
+                     "exception handling a stream message")
+            self.keepalives=keepalives+decoder.keepalives
+      finally:
+         with self._lock:
+            self._stream=None
+         if hasattr(stream,'close'):
+            stream.close()
+
+def user_stream_events(message,me,feeds,log=None):
+   '''
+   Returns the (feed, status) events carried by a user stream message for the given feeds ('home',
+   'mentions', 'dms'), where me is the bot's twitter.User.  Control messages (friend lists,
+   deletions, limit notices, etc.) carry no events; disconnect and warning notices are logged to
+   log (a botlog.Logger).
+   '''
+   if 'direct_message' in message:
+      if 'dms' not in feeds:
+         return []
+      dm=twitter.DirectMessage.NewFromJsonDict(message['direct_message'])
+      # the bot's own messages are not in the direct messages feed
+      if dm.sender_id == me.id:
+         return []
+      return [('dms',dm)]
+
+   if 'text' not in message or 'user' not in message:
+      if 'disconnect' in message or 'warning' in message:
+         (log or botlog.default_logger()).warning('stream_notice',notice=message)
+      return []
+
+   status=twitter.Status.NewFromJsonDict(message)
+   events=[]
+   if 'home' in feeds:
+      events.append(('home',status))
+   if 'mentions' in feeds and status.user.id != me.id and any(mention.id == me.id or
+         (mention.screen_name or '').lower() == me.screen_name.lower()
+         for mention in status.user_mentions or ()):
+      events.append(('mentions',status))
+   return events
@@ -0,0 +1,147 @@
+'''
+Benchmark of the delay between a mention being posted and the bot's process_commands seeing it, for
+a streaming bot (through a local stand-in stream server and the bot's process_stream) against a bot
+polling the fake API with tick() on a fixed check period.
+
+Polling delay is dominated by the check period (on average half of it), so the polling bot ticks on
+a shortened period and the result scales with the period; with the default check period of 90
+seconds, the average polling delay is about 45 seconds.
+'''
+
+import contextlib
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import benchutils
+import botlog
+import fakeapi
+import streaming
+import streamserver
+from StringIO import StringIO
+from testutils import make_bot
+from twitterbot import TwitterBot
+
+class TimingBot(TwitterBot):
+   '''
+   Bot that records when process_commands sees each mention, and stops once it has seen count of
+   them.
+   '''
+   def on_subclass_init(self,**kwargs):
+      self.count = kwargs['count']
+      self.seen = {}
+      self.done = threading.Event()
+
+   def process_commands(self,mentions):
+      now = time.time()
+      for status in mentions:
+         self.seen.setdefault(status.id,now)
+      if len(self.seen) >= self.count:
+         self.done.set()
+
+class ArrivalApi(fakeapi.FakeApi):
+   '''
+   Fake API that records when each mention arrived.
+   '''
+   def __init__(self,**kwargs):
+      fakeapi.FakeApi.__init__(self,**kwargs)
+      self.arrivals = {}
+
+   def _status(self,user,text,created_at,*args,**kwargs):
+      status = fakeapi.FakeApi._status(self,user,text,created_at,*args,**kwargs)
+      self.arrivals[status.id] = created_at
+      return status
+
+@contextlib.contextmanager
+def running_bot(api,count,step,**kwargs):
+   '''
+   Context manager running a TimingBot on api in the background, calling step(bot) over and over.
+   On exit, waits until the bot has seen count mentions (or for at most a minute), then stops it.
+   '''
+   directory = tempfile.mkdtemp()
+   try:
+      bot = make_bot(TimingBot,api,directory,count=count,log=botlog.open_log(StringIO()),
+         **kwargs)
+      stop = threading.Event()
+      def drive():
+         bot.start()
+         try:
+            while not stop.is_set():
+               step(bot)
+         finally:
+            bot.shutdown()
+      thread = threading.Thread(target=drive)
+      thread.start()
+      try:
+         yield bot
+         bot.done.wait(60)
+      finally:
+         stop.set()
+         thread.join()
+   finally:
+      shutil.rmtree(directory)
+
+def handle_stream(bot):
+   # what the bot does between checks while streaming: handle each delivery as soon as it arrives
+   if bot._stream_wakeup.wait(0.1):
+      bot._stream_wakeup.clear()
+      bot.process_stream()
+
+def stream_delays(count,spacing,generator):
+   '''
+   Returns the delay (seconds) with which each of count mentions, posted at random intervals,
+   reaches a streaming bot's process_commands.
+   '''
+   # frequent keep-alives, so that the bot's stream reader notices quickly when it is stopped
+   server = streamserver.StreamServer(keepalive=0.1)
+   api = fakeapi.FakeApi(rates={'home':0,'mentions':0},seed=1)
+   me = api.VerifyCredentials()
+   posted = {}
+   try:
+      with running_bot(api,count,handle_stream,streaming=True,
+            stream_connect=streaming.http_connect(server.url)) as bot:
+         server.wait_for_clients()
+         for index in range(count):
+            time.sleep(generator.uniform(0,spacing))
+            id = 10**9+index
+            posted[id] = time.time()
+            server.send({'id':id,'text':"@fakebot ctl status",
+               'created_at':fakeapi.format_timestamp(posted[id]),
+               'user':{'id':me.id+1,'screen_name':"boss"},
+               'entities':{'user_mentions':[{'id':me.id,'screen_name':me.screen_name,
+                  'indices':[0,8]}]}})
+   finally:
+      server.close()
+   return [bot.seen[id]-posted[id] for id in posted if id in bot.seen]
+
+def poll_delays(count,spacing,period):
+   '''
+   Returns the delay (seconds) with which each of count mentions, arriving at random intervals
+   spacing/2 seconds apart on average, reaches the process_commands of a bot polling every period
+   seconds.
+   '''
+   api = ArrivalApi(rates={'home':0,'mentions':2.0/spacing},seed=1)
+   def poll(bot):
+      bot.tick()
+      time.sleep(period)
+   with running_bot(api,count,poll) as bot:
+      pass
+   return [bot.seen[id]-api.arrivals[id] for id in bot.seen]
+
+def run(count=20,period=0.5):
+   '''
+   Runs the benchmark, returning a list of (name, seconds, baseline seconds) giving the mean and
+   worst delays of the streaming bot against a bot polling every period seconds.
+   '''
+   stream = stream_delays(count,period,random.Random(1))
+   poll = poll_delays(count,period,period)
+   return [("mean delay (poll every {0}s)".format(period),sum(stream)/len(stream),
+            sum(poll)/len(poll)),
+           ("worst delay (poll every {0}s)".format(period),max(stream),max(poll))]
+
+if __name__ == "__main__":
+   period = float(sys.argv[1]) if len(sys.argv) > 1 else 0.5
+   benchutils.print_results("streaming",run(period=period))
@@ -0,0 +1,207 @@
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import twitter
+import fakeapi
+import streaming
+import streamserver
+from duration import Duration
+from testutils import FakeClock, make_bot
+from twitterbot import TwitterBot
+
+def fast_backoff():
+   return streaming.ReconnectBackoff(network_step=Duration(milliseconds=10),
+      http_initial=Duration(milliseconds=20),rate_limited_initial=Duration(milliseconds=50))
+
+def status(id,text,screen_name="someone",mentions=(),created_at="Mon Oct 05 12:00:00 +0000 2026"):
+   return {'id':id,'text':text,'created_at':created_at,
+           'user':{'id':id+1000,'screen_name':screen_name},
+           'entities':{'user_mentions':[{'id':user_id,'screen_name':name,'indices':[0,0]}
+              for user_id,name in mentions]}}
+
+class Collector(object):
+   def __init__(self):
+      self.messages = []
+      self.connects = 0
+      self.condition = threading.Condition()
+
+   def on_message(self,message):
+      with self.condition:
+         self.messages.append(message)
+         self.condition.notify_all()
+
+   def on_connect(self):
+      with self.condition:
+         self.connects += 1
+         self.condition.notify_all()
+
+   def wait_for(self,predicate,timeout=5.0):
+      deadline = time.time()+timeout
+      with self.condition:
+         while not predicate() and time.time() < deadline:
+            self.condition.wait(0.05)
+         return predicate()
+
+class TestLineDecoder(unittest.TestCase):
+   def test_split_chunks(self):
+      decoder = streaming.LineDecoder()
+      data = b'{"id":1}\r\n\r\n{"id":2,"text":"a\\nb"}\r\n{"id":3}\r\n'
+      messages = []
+      # feed the stream one byte at a time, as the worst case of chunking
+      for i in range(len(data)):
+         messages.extend(decoder.feed(data[i:i+1]))
+      self.assertEqual(messages,[{'id':1},{'id':2,'text':'a\nb'},{'id':3}])
+      self.assertEqual(decoder.keepalives,1)
+      self.assertEqual(decoder.feed(b'{"id":'),[])
+      self.assertEqual(decoder.feed(b'4}\r\nnot json\r\n'),[{'id':4}])
+
+class TestReconnectBackoff(unittest.TestCase):
+   def test_schedules(self):
+      backoff = streaming.ReconnectBackoff()
+      self.assertEqual([backoff.network_error() for _ in range(3)],[0.25,0.5,0.75])
+      for _ in range(100):
+         backoff.network_error()
+      self.assertEqual(backoff.delay,16.0)
+      self.assertEqual([backoff.http_error(503) for _ in range(8)],
+         [5.0,10.0,20.0,40.0,80.0,160.0,320.0,320.0])
+      self.assertEqual([backoff.http_error(420) for _ in range(3)],[60.0,120.0,240.0])
+      backoff.reset()
+      self.assertEqual(backoff.network_error(),0.25)
+
+class TestUserStreamEvents(unittest.TestCase):
+   def test_classify(self):
+      me = twitter.User(id=1,screen_name="Bot")
+      feeds = ['home','mentions','dms']
+      mention = status(5,"@bot hi",mentions=[(1,"bot")])
+      self.assertEqual([feed for feed,_ in streaming.user_stream_events(mention,me,feeds)],
+         ['home','mentions'])
+      self.assertEqual(streaming.user_stream_events(mention,me,['mentions'])[0][1].id,5)
+      self.assertEqual([feed for feed,_ in streaming.user_stream_events(status(6,"hi"),me,feeds)],
+         ['home'])
+      dm = {'direct_message':{'id':7,'text':"ctl x",'sender_id':2,'sender_screen_name':"boss"}}
+      self.assertEqual([feed for feed,_ in streaming.user_stream_events(dm,me,feeds)],['dms'])
+      self.assertEqual(streaming.user_stream_events(dm,me,['home']),[])
+      self.assertEqual(streaming.user_stream_events({'friends':[1,2]},me,feeds),[])
+      self.assertEqual(streaming.user_stream_events({'delete':{'status':{'id':5}}},me,feeds),[])
+
+class TestStreamReader(unittest.TestCase):
+   def setUp(self):
+      self.server = streamserver.StreamServer(keepalive=0.05)
+      self.collector = Collector()
+      self.reader = streaming.StreamReader(streaming.http_connect(self.server.url),
+         self.collector.on_message,self.collector.on_connect,fast_backoff())
+
+   def tearDown(self):
+      self.reader.stop(5)
+      self.server.close()
+
+   def test_messages_and_reconnect(self):
+      self.reader.start()
+      self.assertTrue(self.server.wait_for_clients())
+      self.server.send({'id':1})
+      self.server.send({'id':2})
+      self.assertTrue(self.collector.wait_for(lambda: len(self.collector.messages) == 2))
+      self.assertTrue(self.reader.connected)
+
+      # a dropped connection is re-established, and on_connect is called again for the gap fill
+      self.server.disconnect()
+      self.assertTrue(self.collector.wait_for(lambda: self.collector.connects == 2))
+      self.assertTrue(self.server.wait_for_clients())
+      self.server.send({'id':3})
+      self.assertTrue(self.collector.wait_for(lambda: len(self.collector.messages) == 3))
+      self.assertEqual([m['id'] for m in self.collector.messages],[1,2,3])
+      self.assertTrue(self.collector.wait_for(lambda: self.reader.keepalives > 0))
+
+   def test_refused_connections(self):
+      self.server.refuse(503,2)
+      self.reader.start()
+      self.assertTrue(self.collector.wait_for(lambda: self.collector.connects == 1))
+      self.assertEqual(self.server.refused,2)
+      self.assertEqual(self.reader.connections,1)
+
+   def test_stop_interrupts_read(self):
+      self.reader.start()
+      self.assertTrue(self.server.wait_for_clients())
+      start = time.time()
+      self.reader.stop(5)
+      self.assertLess(time.time()-start,2.0)
+      self.assertFalse(self.reader.connected)
+
+class StreamingBot(TwitterBot):
+   '''
+   Bot that records the IDs of the mentions given to process_commands.
+   '''
+   def on_subclass_init(self,**kwargs):
+      self.commands = []
+
+   def process_commands(self,mentions):
+      self.commands.extend(status.id for status in mentions)
+
+class TestBotStreaming(unittest.TestCase):
+   def setUp(self):
+      self.directory = tempfile.mkdtemp()
+      self.server = streamserver.StreamServer(keepalive=0.05)
+      self.clock = FakeClock(time.time())
+      self.api = fakeapi.FakeApi(rates={'home':0,'mentions':0,'commands':1},commands=["status"],
+         seed=1,clock=self.clock)
+      self.bot = make_bot(StreamingBot,self.api,self.directory,streaming=True,
+         stream_connect=streaming.http_connect(self.server.url))
+
+   def tearDown(self):
+      self.bot.shutdown()
+      self.server.close()
+      shutil.rmtree(self.directory)
+
+   def wait_for_stream(self,gap=False,events=0):
+      # waits until the stream has delivered what the bot is expected to handle next
+      deadline = time.time()+5
+      while time.time() < deadline:
+         with self.bot._stream_lock:
+            if self.bot._stream_gap == gap and len(self.bot._stream_events) == events:
+               return
+         time.sleep(0.01)
+      self.fail("the stream did not deliver the expected events")
+
+   def streamed(self,mention):
+      # the user stream message for a mention of the bot
+      return status(mention.id,mention.text,mention.user.screen_name,
+         [(user.id,user.screen_name) for user in mention.user_mentions],mention.created_at)
+
+   def test_streamed_mentions(self):
+      me = self.api.VerifyCredentials()
+      self.bot.start()
+      self.assertTrue(self.server.wait_for_clients())
+
+      # connecting fills the gap with a poll of the streamed feeds
+      self.wait_for_stream(gap=True)
+      self.bot.process_stream()
+      self.assertEqual(self.api.calls['GetMentions'],1)
+      self.assertEqual(self.bot.commands,[])
+
+      # a streamed mention runs the commands once, without polling
+      created_at = fakeapi.format_timestamp(self.clock())
+      self.server.send(status(1,"@fakebot ctl status","boss",[(me.id,"fakebot")],created_at))
+      self.wait_for_stream(events=1)
+      self.bot.process_stream()
+      self.bot.process_stream()
+      self.assertEqual(self.bot.commands,[1])
+      self.assertEqual(self.api.calls['GetMentions'],1)
+
+      # mentions arrive while the stream is down, and one of them is also streamed on reconnect;
+      # the gap is filled by polling again, and each mention runs its commands once
+      self.server.disconnect()
+      self.clock.now += 10.0
+      mentions = self.api.GetMentions(count=200)
+      self.assertTrue(len(mentions) > 1)
+      self.assertTrue(self.server.wait_for_clients())
+      self.server.send(self.streamed(mentions[0]))
+      self.wait_for_stream(gap=True,events=1)
+      self.bot.process_stream()
+      self.assertEqual(self.api.calls['GetMentions'],3)
+      self.assertEqual(self.bot.commands,[1]+[mention.id for mention in mentions])
+
+if __name__ == "__main__":
+   # run unit tests
+   unittest.main()
@@ -0,0 +1,151 @@
+'''
+Local stand-in for the twitter streaming API, for tests and benchmarks.
+'''
+
+import BaseHTTPServer
+import json
+import Queue
+import SocketServer
+import threading
+
+import timeutils
+
+class StreamServer(object):
+   '''
+   HTTP server on a local port that streams line-delimited JSON messages, using chunked transfer
+   encoding as the streaming API does, to every client connected to it.
+
+   send(message) delivers a message to the connected clients, disconnect() drops them, and
+   refuse(status, count) makes the next count connection attempts fail with an HTTP error.
+   '''
+
+   def __init__(self,keepalive=30.0,port=0):
+      # seconds between the keep-alive newlines sent to each client
+      self.keepalive=keepalive
+      self._lock=threading.Condition()
+      # queue of messages for each connected client
+      self._clients=[]
+      # HTTP status to refuse connections with, and how many more to refuse
+      self._refuse_status=None
+      self._refuse_count=0
+      # number of connections accepted, and of attempts refused
+      self.connections=0
+      self.refused=0
+
+      server=self
+      class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+         protocol_version='HTTP/1.1'
+         # send each message as soon as it is written
+         disable_nagle_algorithm=True
+
+         def do_GET(self):
+            server._serve(self)
+
+         def do_POST(self):
+            length=int(self.headers.get('Content-Length') or 0)
+            if length:
+               self.rfile.read(length)
+            server._serve(self)
+
+         def log_message(self,format,*args):
+            pass
+
+      self._httpd=ThreadingHTTPServer(('127.0.0.1',port),Handler)
+      self._thread=threading.Thread(target=self._httpd.serve_forever,name="stream server")
+      self._thread.daemon=True
+      self._thread.start()
+      # the client threads block on their queues without a timeout (which python 2 implements by
+      # polling), and keep-alives are queued by a thread of their own
+      self._closed=threading.Event()
+      self._keepalive_thread=threading.Thread(target=self._send_keepalives,name="keep-alives")
+      self._keepalive_thread.daemon=True
+      self._keepalive_thread.start()
+
+   @property
+   def url(self):
+      return "http://127.0.0.1:{0}/1.1/user.json".format(self._httpd.server_address[1])
+
+   def send(self,message):
+      '''
+      Sends a message (anything JSON serializable) to every connected client.
+      '''
+      self._send_line(json.dumps(message)+"\r\n")
+
+   def _send_line(self,line):
+      with self._lock:
+         for client in self._clients:
+            client.put(line)
+
+   def _send_keepalives(self):
+      while not self._closed.wait(self.keepalive):
+         self._send_line("\r\n")
+
+   def disconnect(self):
+      with self._lock:
+         for client in self._clients:
+            client.put(None)
+
+   def refuse(self,status,count=1):
+      with self._lock:
+         self._refuse_status=status
+         self._refuse_count=count
+
+   def wait_for_clients(self,count=1,timeout=5.0):
+      '''
+      Waits up to timeout seconds until at least count clients are connected; returns whether they
+      are.
+      '''
+      deadline=timeutils.monotonic()+timeout
+      with self._lock:
+         while len(self._clients) < count and timeutils.monotonic() < deadline:
+            self._lock.wait(deadline-timeutils.monotonic())
+         return len(self._clients) >= count
+
+   def close(self):
+      self._closed.set()
+      self.disconnect()
+      self._httpd.shutdown()
+      self._httpd.server_close()
+      self._thread.join()
+
+   def _serve(self,request):
+      with self._lock:
+         if self._refuse_count > 0:
+            self._refuse_count-=1
+            self.refused+=1
+            status=self._refuse_status
+         else:
+            status=None
+      if status is not None:
+         request.send_response(status)
+         request.send_header('Content-Length','0')
+         request.end_headers()
+         return
+
+      client=Queue.Queue()
+      request.send_response(200)
+      request.send_header('Content-Type','application/json')
+      request.send_header('Transfer-Encoding','chunked')
+      request.end_headers()
+      with self._lock:
+         self._clients.append(client)
+         self.connections+=1
+         self._lock.notify_all()
+      try:
+         while True:
+            line=client.get()
+            if line is None:
+               break
+            request.wfile.write("{0:x}\r\n{1}\r\n".format(len(line),line))
+            request.wfile.flush()
+         request.wfile.write("0\r\n\r\n")
+      except Exception:
+         # the client went away
+         pass
+      finally:
+         with self._lock:
+            self._clients.remove(client)
+         request.close_connection=True
+
+class ThreadingHTTPServer(SocketServer.ThreadingMixIn,BaseHTTPServer.HTTPServer):
+   daemon_threads=True
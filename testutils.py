@@ -0,0 +1,63 @@
+'''
+Helpers shared by the unit tests and benchmarks: stand-ins for twitter objects, a fake clock, and
+bots whose state lives in a scratch directory.
+'''
+
+import os.path
+
+import storage
+from duration import Duration
+
+class Mention(object):
+   '''
+   Stand-in for the twitter.User of a user mention, with the mention's position in the text.
+   '''
+   def __init__(self,indices):
+      self._json = {'indices':indices}
+
+class Status(object):
+   '''
+   Stand-in for a twitter.Status with only the attributes a test needs.
+   '''
+   def __init__(self,id=None,text=None,created_at=None,mention_indices=()):
+      self.id = id
+      self.text = text
+      self.created_at = created_at
+      self.user_mentions = [Mention(indices) for indices in mention_indices]
+
+class FakeClock(object):
+   '''
+   Clock (in seconds) that only moves when told to, or when sleep() is called.
+   '''
+   def __init__(self,now=1500000000.0):
+      self.now = now
+
+   def __call__(self):
+      return self.now
+
+   def sleep(self,seconds):
+      self.now += seconds
+
+def bot_files(directory,bosses=("boss",)):
+   '''
+   Returns the TwitterBot keyword arguments that keep all of a bot's state files in directory, and
+   saves the allowed bosses file there.
+   '''
+   location = lambda filename: os.path.join(directory,filename)
+   storage.save_list(list(bosses),location("allowed_bosses.dat"))
+   return {'last_id_file':location("last_ids.dat"),
+           'processed_id_file':location("processed_ids.dat"),
+           'post_queue_file':location("post_queue.dat"),
+           'media_cache_file':location("media_cache.dat"),
+           'allowed_bosses_file':location("allowed_bosses.dat"),
+           'media_spool_directory':location("media_spool")}
+
+def make_bot(bot_class,api,directory,bosses=("boss",),**kwargs):
+   '''
+   Creates a bot of the given class on an API backend (e.g. a fakeapi.FakeApi), with its state in
+   directory and posts sent without pacing.  kwargs override any of the bot's arguments.
+   '''
+   arguments = bot_files(directory,bosses)
+   arguments['post_interval'] = Duration()
+   arguments.update(kwargs)
+   return bot_class(api_backend=api,**arguments)
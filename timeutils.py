@@ -1,32 +1,173 @@
 import datetime as dt
 import time
+import calendar
 import email.utils as eu
 import os
+import sys
+from array import array
 
-def time_since_file(timestamp_filename):
+import lru
+
+# clock_gettime clock ID of the monotonic clock, by platform
+CLOCK_MONOTONIC={'linux':1,'darwin':6,'freebsd':4,'openbsd':3,'netbsd':3}
+
+def _clock_gettime_monotonic():
+   '''
+   Returns a function reading CLOCK_MONOTONIC through clock_gettime (via ctypes), or None if this
+   platform does not have it.
+   '''
+   platform=sys.platform.rstrip('0123456789')
+   if platform.startswith('linux'):
+      platform='linux'
+   clock_id=CLOCK_MONOTONIC.get(platform)
+   if clock_id is None:
+      return None
+   try:
+      import ctypes
+      import ctypes.util
+      # older glibc versions keep clock_gettime in librt
+      library=ctypes.CDLL(ctypes.util.find_library('rt') or ctypes.util.find_library('c'),
+         use_errno=True)
+      clock_gettime=library.clock_gettime
+   except (ImportError,OSError,AttributeError):
+      return None
+
+   class timespec(ctypes.Structure):
+      _fields_=[('tv_sec',ctypes.c_long),('tv_nsec',ctypes.c_long)]
+   clock_gettime.argtypes=[ctypes.c_int,ctypes.POINTER(timespec)]
+   clock_gettime.restype=ctypes.c_int
+
+   def monotonic():
+      '''
+      Returns the time of the system's monotonic clock, in seconds.
+      '''
+      spec=timespec()
+      if clock_gettime(clock_id,ctypes.byref(spec)) != 0:
+         errno=ctypes.get_errno()
+         raise OSError(errno,os.strerror(errno))
+      return spec.tv_sec+spec.tv_nsec*1e-9
+
+   try:
+      monotonic()
+   except OSError:
+      return None
+   return monotonic
 
-   if not os.path.isfile(timestamp_filename):
-      # file doesn't exist; assume infinite time
-      return dt.timedelta.max
+def _elapsed_monotonic():
+   '''
+   Returns the time elapsed since an arbitrary point in the past (e.g. system boot), in seconds, as
+   counted by os.times().  It is monotonic, but only has a resolution of a clock tick (usually 10
+   milliseconds).
+   '''
+   return os.times()[4]
+
+try:
+   monotonic = time.monotonic
+except AttributeError:
+   # python 2 has no monotonic clock in the standard library.  Wall-clock time would let a clock
+   # adjustment move every deadline, so read the system's monotonic clock instead
+   monotonic = _clock_gettime_monotonic() or _elapsed_monotonic
+
+# month numbers by the abbreviated (English) month names used in twitter timestamps
+MONTHS=dict((name,number) for number,name in enumerate(
+   ['Jan','Feb','Mar','Apr','May','Jun','Jul','Aug','Sep','Oct','Nov','Dec'],1))
 
-   with open(timestamp_filename,'r') as timestamp_file:
-      timestamp="".join(timestamp_file.readlines())
-      ts=dt.datetime.fromtimestamp(time.mktime(eu.parsedate(timestamp)))
-      return dt.datetime.utcnow()-ts
+def parse_rfc2822(timestamp):
+   '''
+   Parses an RFC 2822 timestamp (e.g. as written by save_now_to_file) and returns it as epoch
+   seconds.
+   '''
+   parsed=eu.parsedate_tz(timestamp)
+   if parsed is None:
+      raise ValueError("Invalid timestamp: {0!r}".format(timestamp))
+   return eu.mktime_tz(parsed)
 
-   return dt.timedelta.max
+def parse_twitter_timestamp(timestamp):
+   '''
+   Parses a twitter timestamp of the fixed format 'Thu Jul 23 20:44:28 +0000 2015' (as found in
+   created_at) and returns it as epoch seconds, taking the UTC offset into account.  Other RFC 2822
+   timestamps are parsed more slowly.
+   '''
+   try:
+      if len(timestamp) != 30:
+         raise ValueError(timestamp)
+      offset=int(timestamp[21:23])*3600+int(timestamp[23:25])*60
+      if timestamp[20] == '-':
+         offset=-offset
+      elif timestamp[20] != '+':
+         raise ValueError(timestamp)
+      return calendar.timegm((int(timestamp[26:30]),MONTHS[timestamp[4:7]],int(timestamp[8:10]),
+         int(timestamp[11:13]),int(timestamp[14:16]),int(timestamp[17:19])))-offset
+   except (ValueError,KeyError):
+      return parse_rfc2822(timestamp)
+
+@lru.lru_cached(4096)
+def created_at_seconds(timestamp):
+   '''
+   Returns a twitter created_at timestamp as epoch seconds.  Statuses are seen over and over (every
+   update sees the newest statuses of each timeline again), so parsed timestamps are cached.
+   '''
+   return parse_twitter_timestamp(timestamp)
+
+def time_since_file(timestamp_filename):
+   '''
+   Returns the time elapsed since the timestamp saved by save_now_to_file.  The timestamp file can
+   also be a storage location (e.g. in a sqlitestore.SqliteStore).
+   '''
+   if hasattr(timestamp_filename,'load_data'):
+      timestamp=timestamp_filename.load_data()
+      if timestamp is None:
+         return dt.timedelta.max
+   else:
+      if not os.path.isfile(timestamp_filename):
+         # file doesn't exist; assume infinite time
+         return dt.timedelta.max
+
+      with open(timestamp_filename,'r') as timestamp_file:
+         timestamp="".join(timestamp_file.readlines())
+
+   return dt.timedelta(seconds=time.time()-parse_rfc2822(timestamp))
 
 def save_now_to_file(timestamp_filename):
+   if hasattr(timestamp_filename,'save_data'):
+      timestamp_filename.save_data(eu.formatdate())
+      return
    with open(timestamp_filename,'w') as timestamp_file:
       timestamp_file.write(eu.formatdate())
 
-def time_since(timestamp):
+def time_since(timestamp,now=None):
    '''
    Parses timestamp of format 'Thu Jul 23 20:44:28 +0000 2015' and provides the time that has
-   elapsed since that timestamp.
+   elapsed since that timestamp (or since now, in epoch seconds, if given).
+
+   Returns a timedelta object
+   '''
+   if now is None:
+      now = time.time()
+   return dt.timedelta(seconds=now-created_at_seconds(timestamp))
 
-   Returns a datetime object
+def ages(statuses,now=None):
+   '''
+   Returns the ages in seconds of a list of statuses (the time elapsed since their created_at, or
+   since now if given), as an array of doubles in the same order.
+   '''
+   if now is None:
+      now = time.time()
+   parse = created_at_seconds
+   return array('d',[now-parse(s.created_at) for s in statuses])
+
+def newer_than(statuses,cutoff):
+   '''
+   Returns the statuses created at or after cutoff (epoch seconds), given a list of statuses sorted
+   newest first (as the API returns them).  These are a prefix of the list, found by binary search,
+   so only O(log n) timestamps are parsed.
    '''
-   now = dt.datetime.utcnow()
-   ts = dt.datetime.fromtimestamp(time.mktime(eu.parsedate(timestamp)))
-   return now-ts
+   parse = created_at_seconds
+   low,high = 0,len(statuses)
+   while low < high:
+      middle = (low+high)//2
+      if parse(statuses[middle].created_at) >= cutoff:
+         low = middle+1
+      else:
+         high = middle
+   return statuses[:low]
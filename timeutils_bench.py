@@ -0,0 +1,49 @@
+'''
+Benchmarks of created_at timestamp parsing against the original email.utils based implementation.
+'''
+
+import datetime as dt
+import email.utils as eu
+import random
+import time
+
+import benchutils
+import timeutils
+
+def legacy_time_since(timestamp):
+   # the original implementation (which also treated the UTC timestamp as local time)
+   now = dt.datetime.utcnow()
+   ts = dt.datetime.fromtimestamp(time.mktime(eu.parsedate(timestamp)))
+   return now-ts
+
+class Status(object):
+   def __init__(self,created_at):
+      self.created_at = created_at
+
+def timestamps(count,seed=1):
+   generator = random.Random(seed)
+   now = time.time()
+   return [time.strftime('%a %b %d %H:%M:%S +0000 %Y',time.gmtime(now-generator.uniform(0,86400)))
+      for _ in range(count)]
+
+def run():
+   '''
+   Runs the benchmarks, returning a list of (name, seconds per call, baseline seconds per call).
+   '''
+   results = []
+   timestamp = timestamps(1)[0]
+
+   results.append(("parse created_at",
+      benchutils.best_time(lambda: timeutils.parse_twitter_timestamp(timestamp)),
+      benchutils.best_time(lambda: time.mktime(eu.parsedate(timestamp)))))
+   results.append(("time_since (cached)",
+      benchutils.best_time(lambda: timeutils.time_since(timestamp)),
+      benchutils.best_time(lambda: legacy_time_since(timestamp))))
+
+   statuses = [Status(t) for t in timestamps(200)]
+   results.append(("ages of 200 statuses",benchutils.best_time(lambda: timeutils.ages(statuses)),
+      benchutils.best_time(lambda: [legacy_time_since(s.created_at) for s in statuses])))
+   return results
+
+if __name__ == "__main__":
+   benchutils.print_results("timeutils",run())
@@ -0,0 +1,106 @@
+import calendar
+import datetime as dt
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import fakeapi
+import timeutils
+from testutils import Status, make_bot
+from twitterbot import TwitterBot
+
+class TestTimeUtils(unittest.TestCase):
+   def test_parse_twitter_timestamp(self):
+      epoch = calendar.timegm((2015,7,23,20,44,28))
+      self.assertEqual(timeutils.parse_twitter_timestamp('Thu Jul 23 20:44:28 +0000 2015'),epoch)
+      self.assertEqual(timeutils.parse_twitter_timestamp('Thu Jul 23 21:44:28 +0100 2015'),epoch)
+      self.assertEqual(timeutils.parse_twitter_timestamp('Thu Jul 23 19:14:28 -0130 2015'),epoch)
+      self.assertEqual(timeutils.parse_twitter_timestamp('Thu Feb 29 00:00:00 +0000 2024'),
+         calendar.timegm((2024,2,29,0,0,0)))
+      # other RFC 2822 timestamps still parse
+      self.assertEqual(timeutils.parse_twitter_timestamp('Thu, 23 Jul 2015 20:44:28 -0000'),epoch)
+      self.assertRaises(ValueError,timeutils.parse_twitter_timestamp,'not a timestamp')
+
+   def test_time_since_is_utc(self):
+      now = time.time()
+      created_at = time.strftime('%a %b %d %H:%M:%S +0000 %Y',time.gmtime(now-3600))
+      self.assertAlmostEqual(timeutils.time_since(created_at,now).total_seconds(),3600,delta=1)
+      self.assertTrue(abs(timeutils.time_since(created_at).total_seconds()-3600) < 60)
+
+   def test_ages(self):
+      now = calendar.timegm((2015,7,23,20,44,28))
+      statuses = [Status(created_at='Thu Jul 23 20:44:28 +0000 2015'),
+         Status(created_at='Thu Jul 23 20:43:28 +0000 2015')]
+      self.assertEqual(list(timeutils.ages(statuses,now)),[0.0,60.0])
+
+   def test_newer_than(self):
+      now = calendar.timegm((2015,7,23,20,44,28))
+      statuses = [Status(created_at=time.strftime('%a %b %d %H:%M:%S +0000 %Y',
+         time.gmtime(now-age))) for age in [0,10,20,30,40,50]]
+      self.assertEqual(timeutils.newer_than(statuses,now-25),statuses[:3])
+      self.assertEqual(timeutils.newer_than(statuses,now-20),statuses[:3])
+      self.assertEqual(timeutils.newer_than(statuses,now+1),[])
+      self.assertEqual(timeutils.newer_than(statuses,now-60),statuses)
+      self.assertEqual(timeutils.newer_than([],now),[])
+
+   def test_time_since_file(self):
+      directory = tempfile.mkdtemp()
+      try:
+         filename = os.path.join(directory,"last_tweet.dat")
+         self.assertEqual(timeutils.time_since_file(filename),dt.timedelta.max)
+         timeutils.save_now_to_file(filename)
+         self.assertTrue(abs(timeutils.time_since_file(filename).total_seconds()) < 60)
+      finally:
+         shutil.rmtree(directory)
+
+   def test_monotonic(self):
+      self.assertIsNot(timeutils.monotonic,time.time)
+      for clock in (timeutils.monotonic,timeutils._elapsed_monotonic):
+         readings = [clock() for i in range(1000)]
+         self.assertEqual(readings,sorted(readings))
+         started = clock()
+         time.sleep(0.05)
+         self.assertTrue(0.02 < clock()-started < 5)
+
+class MentionsBot(TwitterBot):
+   '''
+   Bot that records the IDs of the mentions given to its hooks.
+   '''
+   def on_subclass_init(self,**kwargs):
+      self.commands = []
+      self.mentions = []
+
+   def process_commands(self,mentions):
+      self.commands.append([status.id for status in mentions])
+
+   def on_mentions(self,statuses):
+      self.mentions.append([status.id for status in statuses])
+
+class TestActionableStatuses(unittest.TestCase):
+   def setUp(self):
+      self.directory = tempfile.mkdtemp()
+      self.bot = make_bot(MentionsBot,fakeapi.FakeApi(seed=1),self.directory)
+      self.bot.start()
+
+   def tearDown(self):
+      self.bot.shutdown()
+      shutil.rmtree(self.directory)
+
+   def test_mixed_batch(self):
+      now = time.time()
+      # newest first, as the API returns them; anything older than six hours is stale
+      ages = [0,60,3600,6*3600+600,7*3600,30*3600]
+      statuses = [Status(id=100-index,created_at=time.strftime('%a %b %d %H:%M:%S +0000 %Y',
+         time.gmtime(now-age))) for index,age in enumerate(ages)]
+      self.assertEqual(self.bot.handle_mentions(statuses,None),100)
+      self.assertEqual(self.bot.commands,[[100,99,98]])
+      self.assertEqual(self.bot.mentions,[[100,99,98]])
+
+      # the stale statuses were claimed along with the fresh ones, so none are acted on again
+      self.bot.handle_mentions(statuses,None)
+      self.assertEqual(self.bot.commands,[[100,99,98]])
+
+if __name__ == "__main__":
+   # run unit tests
+   unittest.main()
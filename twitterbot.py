@@ -1,10 +1,50 @@
+import functools
+import os.path
+import tempfile
+import threading
 import time
 import twitter
+from multiprocessing.pool import ThreadPool
 
 import timeutils
 import duration
 import storage
 import command
+import scheduler
+import ratelimit
+import statusindex
+import postqueue
+import mediacache
+import mediabuffer
+import streaming
+import backend
+import metrics
+import botlog
+
+# twitter API error codes
+ERROR_RATE_LIMIT_EXCEEDED=88
+ERROR_DM_ACCESS_DENIED=93
+ERROR_INVALID_MEDIA=324
+# post errors that will not go away by trying again: status too long, duplicate status, reply to a
+# deleted or invisible status
+PERMANENT_POST_ERRORS=set([186,187,385])
+# largest file (in bytes) uploaded in a single request; larger files are uploaded in chunks
+MAX_SIMPLE_UPLOAD_SIZE=5*1024*1024
+# feeds that the user stream delivers, in the order their hooks are triggered
+STREAM_FEEDS=('home','mentions','dms')
+# names of the metrics the bot records (see metrics.Registry)
+UPDATE_SECONDS='twitterbot_update_seconds'
+STAGE_SECONDS='twitterbot_stage_seconds'
+API_SECONDS='twitterbot_api_seconds'
+API_ERRORS='twitterbot_api_errors_total'
+API_DEFERRED='twitterbot_api_deferred_total'
+HOOK_SECONDS='twitterbot_hook_seconds'
+HOOK_ERRORS='twitterbot_hook_errors_total'
+COMMAND_SECONDS='twitterbot_command_seconds'
+COMMANDS='twitterbot_commands_total'
+STATUSES_SEEN='twitterbot_statuses_seen_total'
+STATUSES_NEW='twitterbot_statuses_new_total'
+POSTS='twitterbot_posts_total'
 
 class TwitterBotError(Exception):
    '''Base class for twitterbot errors'''
@@ -14,6 +54,43 @@ class TwitterBotError(Exception):
       '''Returns the first argument used to construct this error.'''
       return self.args[0]
 
+def stage(method):
+   '''
+   Decorator for TwitterBot methods that make up a stage of an update, timing each call into the
+   bot's STAGE_SECONDS timer, labelled with the method name.
+   '''
+   name=method.__name__
+   @functools.wraps(method)
+   def timed(self,*args,**kwargs):
+      with self._metrics.timer(STAGE_SECONDS,stage=name):
+         return method(self,*args,**kwargs)
+   return timed
+
+def command_name(command_words):
+   '''
+   Returns the name a command (given as its list of words) is registered under, which is used to
+   label its metrics; 'unknown' for a command that is not registered, or for no words at all
+   ('@bot ctl', which the command engine answers with an error).
+   '''
+   if not command_words:
+      return 'unknown'
+   command_class = command.CommandFactory.commands.get(command_words[0])
+   if command_class is None:
+      return 'unknown'
+   # commands registered by adding them to CommandFactory.commands directly have no name
+   return command_class.name or command_words[0]
+
+def twitter_error_code(error):
+   '''
+   Returns the code of the first error reported in a TwitterError, or None if there is none.
+   '''
+   if len(error.args) == 0:
+      return None
+   error_args = error.args[0]
+   if isinstance(error_args,list) and len(error_args) > 0 and isinstance(error_args[0],dict):
+      return error_args[0].get('code')
+   return None
+
 class LastIds(storage.StorageMixin):
    '''
    Storage object for the IDs of the last tweets seen on various feeds
@@ -33,22 +110,141 @@ class TwitterBot(object):
                 oauth_config_file="",
                 oauth_config={},
                 check_period=duration.Duration(seconds=90),
+                check_jitter=duration.Duration(),
+                coalesce_missed_checks=True,
+                max_poll_interval=None,
+                poll_backoff=2.0,
                 last_id_file="last_ids.dat",
+                fetch_workers=4,
+                allowed_bosses_file="allowed_bosses.dat",
+                rate_limits=None,
+                fsync_state=False,
+                state_store=None,
+                processed_id_file="processed_ids.dat",
+                processed_index_capacity=5000,
+                post_queue_file="post_queue.dat",
+                post_workers=1,
+                post_interval=duration.Duration(seconds=1),
+                post_max_attempts=5,
+                post_drain_timeout=duration.Duration(seconds=30),
+                media_cache_file="media_cache.dat",
+                media_upload_workers=4,
+                media_spool_directory="media_spool",
+                command_workers=4,
+                command_timeout=duration.Duration(seconds=30),
+                streaming=False,
+                stream_connect=None,
+                api_backend=None,
+                metrics_registry=None,
+                metrics_port=None,
+                log=None,
                 **kwargs):
       '''
       The twitter bot constructor takes ...(TODO)
       '''
-      if len(oauth_config_file) > 0:
+      if len(oauth_config_file) > 0 and api_backend is None:
          oauth_config = storage.load_data(oauth_config_file)
 
-      # twitter API object
-      self._api = twitter.Api(**oauth_config)
+      # registry (a metrics.Registry) the bot records its metrics into: the time spent in each
+      # stage of an update, in each API call, hook and command, and counts of statuses, commands,
+      # posts and errors.  By default nothing is recorded.  If metrics_port is set, the metrics are
+      # served over HTTP on that local port (in the Prometheus text format) while the bot runs, from
+      # a registry of the bot's own unless one is given
+      if metrics_registry is None:
+         metrics_registry = metrics.NULL_REGISTRY if metrics_port is None else metrics.Registry()
+      self._metrics=metrics_registry
+      self._metrics_port=metrics_port
+      # server of the metrics endpoint (started when the bot starts running)
+      self._metrics_server=None
+
+      # twitter API object: api_backend if given (a backend.Backend subclass declaring its
+      # capabilities, e.g. a fakeapi.FakeApi to run the bot offline), or else a twitter.Api using
+      # the oauth config
+      self._api = backend.create(oauth_config,api_backend)
+      # budget of API calls within each endpoint's rate limit window.  rate_limits can override
+      # the default (calls per window, window seconds) of any resource in ratelimit.DEFAULT_LIMITS
+      self._budgeter = ratelimit.RequestBudgeter(rate_limits)
       # the user for this bot
       self._me = self._api.VerifyCredentials()
+      # structured logger (a botlog.Logger, by default JSON lines on standard output written by a
+      # background thread); every record carries the bot's screen name
+      self._log = (log or botlog.default_logger()).bind(bot=self._me.screen_name)
+      # store (e.g. a sqlitestore.SqliteStore) that holds this bot's state instead of separate files
+      self._state_store=state_store
       # duration between checking feed, timeline, replies, etc.
       self._check_period=check_period
-      # filename to store last IDs
-      self._last_id_filename=last_id_file
+      # maximum random delay added to each scheduled check
+      self._check_jitter=check_jitter
+      # whether checks missed because of a slow update are merged into one immediate check (True)
+      # or skipped (False)
+      self._coalesce_missed_checks=coalesce_missed_checks
+      # schedules the checks on fixed deadlines; its next_deadline and overrun counters can be read
+      # by subclasses (created when the bot starts running)
+      self._scheduler=None
+      # adaptive polling: if set, each feed and watched timeline is polled on its own interval,
+      # which backs off (by the poll_backoff factor, up to this duration) while the feed is quiet
+      # and drops back to the check period when something new shows up
+      self._max_poll_interval=max_poll_interval
+      self._poll_backoff=poll_backoff
+      # adaptive polling interval of each feed, keyed by feed name or ('watched',screen name)
+      self._poll_intervals={}
+      # newest status ID seen on each watched timeline
+      self._watched_newest_ids={}
+      # filename (or state store location) to store last IDs
+      self._last_id_filename=self.state_location(last_id_file)
+      # last IDs, kept in memory while the bot runs (loaded when the bot starts)
+      self._last_ids=None
+      # filename (or state store location) of the index of statuses already handled, and the number
+      # of IDs the index keeps for each feed
+      self._processed_filename=self.state_location(processed_id_file)
+      self._processed_index_capacity=processed_index_capacity
+      # index of statuses already handled (loaded when the bot starts)
+      self._processed=None
+      # statuses created before this time (epoch seconds) are too old to act on; set at the start of
+      # each update from the maximum actionable age
+      self._actionable_cutoff=None
+      # queue of outbound posts, sent by background workers with retries and paced to start at least
+      # post_interval apart.  Posts not yet sent are saved to the post queue file, so they survive a
+      # restart.  When the bot stops, it waits up to post_drain_timeout for the queue to empty.
+      self._post_queue=postqueue.PostQueue(self.send_post,workers=post_workers,
+         min_interval=post_interval,max_attempts=post_max_attempts,
+         persist_file=self.state_location(post_queue_file),is_retryable=self.post_error_retryable,
+         spool=self.spool_post,log=self._log)
+      self._post_drain_timeout=post_drain_timeout
+      # media IDs of uploaded images, keyed by image contents, so an image posted again within a day
+      # is not uploaded again.  The images of a post are uploaded in parallel.  Only used with APIs
+      # that upload media separately from posting (python-twitter 3.0+).
+      self._media_cache=mediacache.MediaCache(self.upload_media,workers=media_upload_workers,
+         persist_file=self.state_location(media_cache_file),log=self._log)
+      # directory where images held in memory are written if their post has to wait in the queue
+      self._media_spool_directory=media_spool_directory
+      # runs the commands sent to the bot on command_workers threads, stopping any command that runs
+      # longer than command_timeout (unless the command sets its own timeout)
+      self._command_engine=command.CommandEngine(command_workers,command_timeout,self._log)
+      # streaming ingestion: if set, mentions, direct messages and the home timeline are read from
+      # one long-lived user stream connection as they happen, instead of being polled every check
+      # period.  stream_connect opens the stream (see streaming.StreamReader); by default it opens
+      # the user stream through the API.  While the stream is down these feeds are polled as usual,
+      # and each time it connects they are polled once to fill in what was missed
+      self._streaming=streaming
+      self._stream_connect=stream_connect
+      # reader of the stream (created when the bot starts running)
+      self._stream=None
+      # (feed, status) events read from the stream and not handled yet, and whether the streamed
+      # feeds need polling to fill a gap in the stream
+      self._stream_lock=threading.Lock()
+      self._stream_events=[]
+      self._stream_gap=False
+      # set when the stream has something for the bot to handle
+      self._stream_wakeup=threading.Event()
+      # whether state files are flushed to disk (fsync) when saved
+      self._fsync_state=fsync_state
+      # number of worker threads used to fetch feeds and watched timelines concurrently
+      self._fetch_workers=fetch_workers
+      # worker pool used during the fetch phase of each update (created when the bot starts running)
+      self._fetch_pool=None
+      # whether the fetch pool was created by (and should be shut down with) this bot
+      self._owns_fetch_pool=False
       # timelines to watch, and the number of statuses from the timeline to view.  If the count is
       # set to '0', the default number of timelines will be returned.  This can be overwritten in
       # a subclass to watch additional timelines.  If this list is empty, no timelines will be
@@ -65,11 +261,11 @@ class TwitterBot(object):
       self._do_process_mentions=True
       # whether or not bot should keep running
       self._running=False
-      # whether or not to have extra printouts
+      # whether or not to log every status seen (as debug records, see log_statuses)
       self._DEBUG=False
 
       # list of screen names allowed to send commands
-      self._allowed_bosses_filename="allowed_bosses.dat"
+      self._allowed_bosses_filename=self.state_location(allowed_bosses_file)
       self._allowed_bosses=storage.load_list(self._allowed_bosses_filename)
 
       # only respond to actions that are newer than this duration
@@ -84,6 +280,30 @@ class TwitterBot(object):
       # implemented in subclass
       pass
 
+   def state_location(self,filename):
+      '''
+      Returns where the state that would normally be kept in the given file is stored: the file
+      itself or, if the bot has a state store, the location for this bot and filename in the store.
+      Data already in the file is copied into the store the first time.  The result can be passed to
+      any storage function or to timeutils.time_since_file / save_now_to_file.
+      '''
+      if self._state_store is None:
+         return filename
+      location = self._state_store.location(self._me.screen_name,filename)
+      if not location.exists() and os.path.isfile(filename):
+         location.save_data(storage.load_data(filename,migrate=False))
+      return location
+
+   def state_files(self):
+      '''
+      Returns a dictionary of description -> filename (or state store location) of the state this
+      bot writes, which must not be shared with other bots.
+      '''
+      return {'last IDs':self._last_id_filename,
+              'processed status index':self._processed_filename,
+              'post queue':self._post_queue.persist_file,
+              'media cache':self._media_cache.persist_file}
+
    def add_self_to_watched_timelines(self,count=1):
       '''
       Helper function to add this bot's own user to watched timelines list
@@ -91,37 +311,106 @@ class TwitterBot(object):
       self._watched_timelines.append((self._me.screen_name,count))
 
    def run(self):
+      self.start()
+      try:
+         while self._running:
+            self.tick()
+
+            if self._running:
+               self.schedule_next_tick()
+               self.sleep()
+      finally:
+         self.shutdown()
 
+   def start(self,fetch_pool=None):
+      '''
+      Prepares the bot to run updates.  If a fetch pool is given (e.g. by a BotHost), it is used for
+      the fetch phase instead of a pool owned by this bot.
+      '''
       self._running = True
-      print "Running with user {0}".format(self._me.screen_name)
+      self._log.info('bot_started')
+
+      self._owns_fetch_pool = fetch_pool is None
+      if self._owns_fetch_pool:
+         fetch_pool = ThreadPool(self._fetch_workers)
+      self._fetch_pool = fetch_pool
+
+      self._scheduler = scheduler.TickScheduler(self._check_period,jitter=self._check_jitter,
+         coalesce=self._coalesce_missed_checks)
+      self._scheduler.reset()
+
+      if self._last_ids is None:
+         self._last_ids = LastIds.load(self._last_id_filename)
+      if self._processed is None:
+         self._processed = statusindex.ProcessedIndex.load(self._processed_filename,
+            self._processed_index_capacity)
 
-      while self._running:
+      self._post_queue.start()
 
+      if self._metrics_port is not None and self._metrics_server is None:
+         self._metrics_server = metrics.MetricsServer(self._metrics,self._metrics_port)
+         self._log.info('metrics_serving',url=self._metrics_server.url)
+
+      if self._streaming and self._stream is None:
+         connect = self._stream_connect or streaming.api_connect(self._api)
+         self._stream = streaming.StreamReader(connect,self.on_stream_message,
+            self.on_stream_connect,log=self._log)
+         self._stream.start()
+
+   def tick(self):
+      '''
+      Runs a single update: fetches all feeds, triggers the hooks and saves the last IDs.
+      '''
+      # all state written during the update is committed together (if the state store supports it)
+      with self._metrics.timer(UPDATE_SECONDS),storage.batch(self._last_id_filename):
          # trigger automatic hook
          self.on_update_start()
 
-         last_ids = LastIds.load(self._last_id_filename)
+         # handle anything the stream delivered since the last update (e.g. when run by a BotHost)
+         self.process_stream()
 
-         self.process_watched_timelines()
+         last_ids = self._last_ids
+         self._actionable_cutoff = self.actionable_cutoff()
 
-         if self._do_process_home_timeline:
-            last_ids.home = self.process_home_timeline(last_ids.home)
+         # fetch all feeds at once, then trigger the hooks in a fixed order
+         watched,feeds = self.fetch_feeds(last_ids)
 
-         if self._do_process_replies:
-            last_ids.replies = self.process_replies(last_ids.replies)
+         self.handle_watched_timelines(watched)
 
-         if self._do_process_mentions:
-           last_ids.mentions = self.process_mentions(last_ids.mentions)
+         if 'home' in feeds:
+            last_ids.home = self.handle_home_timeline(feeds['home'],last_ids.home)
 
-         if self._do_process_direct_messages:
-            last_ids.dms = self.process_dms(last_ids.dms)
+         if 'replies' in feeds:
+            last_ids.replies = self.handle_replies(feeds['replies'],last_ids.replies)
 
-         last_ids.save(self._last_id_filename)
+         if 'mentions' in feeds:
+            last_ids.mentions = self.handle_mentions(feeds['mentions'],last_ids.mentions)
+
+         if 'dms' in feeds:
+            last_ids.dms = self.handle_dms(feeds['dms'],last_ids.dms)
+
+         self.save_last_ids()
 
          self.on_update_end()
 
-         if self._running:
-            self.sleep()
+   def shutdown(self):
+      '''
+      Releases the resources used while running.  Called once the bot stops running.
+      '''
+      self._running = False
+      if self._owns_fetch_pool and self._fetch_pool is not None:
+         self._fetch_pool.terminate()
+      self._fetch_pool = None
+      if self._stream is not None:
+         self._stream.stop(self._post_drain_timeout.seconds)
+         self._stream = None
+      # commands still running may reply, so they finish before the post queue is closed
+      self._command_engine.close(self._post_drain_timeout.seconds)
+      self._post_queue.close(self._post_drain_timeout.seconds)
+      self._media_cache.close()
+      if self._metrics_server is not None:
+         self._metrics_server.close()
+         self._metrics_server = None
 
    def on_update_start(self):
       # implemented in subclass
@@ -130,37 +419,246 @@ class TwitterBot(object):
       # implemented in subclass
       pass
 
+   @stage
+   def save_last_ids(self):
+      # only touch the file when an ID actually moved
+      self._last_ids.save_if_changed(self._last_id_filename,self._fsync_state)
+
+   def dispatch_hook(self,feed,hook,*args):
+      '''
+      Runs a hook (or command processing) for the named feed.  The base bot runs the hook inline;
+      subclasses can override this to change where and when hooks are run, and call run_hook to
+      run them.
+      '''
+      self.run_hook(hook,*args)
+
+   def run_hook(self,hook,*args):
+      '''
+      Runs a hook, timing it into the HOOK_SECONDS timer and counting any exception it raises in
+      HOOK_ERRORS.
+      '''
+      with self._metrics.timer(HOOK_SECONDS,hook=hook.__name__):
+         try:
+            hook(*args)
+         except Exception:
+            self._metrics.count(HOOK_ERRORS,hook=hook.__name__)
+            raise
+
+   def call_api(self,method,*args,**kwargs):
+      '''
+      Calls the named method of the twitter API object, if the rate limit budget allows it.  If it
+      does not, the call is not made and None is returned; the caller should try again later.
+
+      The priority keyword argument (ratelimit.PRIORITY_POLL by default, or
+      ratelimit.PRIORITY_POST) is used for budgeting and is not passed on to the API.
+      '''
+      priority = kwargs.pop('priority',ratelimit.PRIORITY_POLL)
+      if not self._budgeter.acquire(method,priority):
+         self._metrics.count(API_DEFERRED,method=method)
+         if priority == ratelimit.PRIORITY_POST:
+            self._log.warning('api_deferred',"rate limit budget is used up; call deferred",
+               method=method)
+         return None
+
+      try:
+         with self._metrics.timer(API_SECONDS,method=method):
+            return getattr(self._api,method)(*args,**kwargs)
+      except twitter.TwitterError,te:
+         code = twitter_error_code(te)
+         self._metrics.count(API_ERRORS,method=method,code=code)
+         if code == ERROR_RATE_LIMIT_EXCEEDED:
+            self._budgeter.exhausted(method)
+         raise
+      finally:
+         self._budgeter.update_from_api(method,self._api)
+
+   @stage
+   def fetch_feeds(self,last_ids):
+      '''
+      Fetches the watched timelines and every enabled feed concurrently on the fetch worker pool.
+
+      Returns a tuple of (watched timelines, feeds).  The watched timelines are a dictionary of
+      screen name -> statuses; timelines that failed to load or are not due to be polled (see
+      poll_due) are left out.  The feeds are a dictionary of feed name ('home', 'replies',
+      'mentions', 'dms') -> statuses, containing only the feeds that are enabled, due and fetched
+      (a fetch that failed, or was deferred by the rate limit budget, is left out and does not
+      count as a quiet poll).
+      '''
+      now = timeutils.monotonic()
+
+      pending_watched = []
+      for screenname,count in self._watched_timelines:
+         if self.poll_due(('watched',screenname),now):
+            pending_watched.append((screenname,
+               self._fetch_pool.apply_async(self.fetch_user_timeline,(screenname,count))))
+
+      pending_feeds = {}
+      if self._do_process_home_timeline and self.poll_due('home',now) and \
+            not self.streaming_feed('home'):
+         pending_feeds['home'] = self._fetch_pool.apply_async(self.fetch_home_timeline,
+            (last_ids.home,))
+      if self._do_process_replies and self.poll_due('replies',now):
+         pending_feeds['replies'] = self._fetch_pool.apply_async(self.fetch_replies,
+            (last_ids.replies,))
+      if self._do_process_mentions and self.poll_due('mentions',now) and \
+            not self.streaming_feed('mentions'):
+         pending_feeds['mentions'] = self._fetch_pool.apply_async(self.fetch_mentions,
+            (last_ids.mentions,))
+      if self._do_process_direct_messages and self.poll_due('dms',now) and \
+            not self.streaming_feed('dms'):
+         pending_feeds['dms'] = self._fetch_pool.apply_async(self.fetch_dms,(last_ids.dms,))
+
+      watched = {}
+      for screenname,result in pending_watched:
+         statuses = result.get()
+         if statuses is not None:
+            watched[screenname] = statuses
+            # a watched timeline is active if its newest status changed since the last poll
+            newest_id = self.extract_id_if_exists(statuses,None)
+            self.record_poll(('watched',screenname),
+               newest_id != self._watched_newest_ids.get(screenname),now)
+            self._watched_newest_ids[screenname] = newest_id
+
+      feeds = {}
+      for name,result in pending_feeds.items():
+         statuses = result.get()
+         if statuses is not None:
+            feeds[name] = statuses
+            self.record_poll(name,len(statuses) > 0,now)
+
+      return watched,feeds
+
+   def poll_due(self,feed,now):
+      '''
+      Returns whether a feed ('home', 'replies', 'mentions', 'dms', or ('watched',screen name))
+      should be polled at the given time.  Always true unless adaptive polling is enabled.
+      '''
+      if self._max_poll_interval is None or feed not in self._poll_intervals:
+         return True
+      # allow for updates starting a little early relative to the previous one
+      return self._poll_intervals[feed].due(now,slack=self._check_period.seconds/2.0)
+
+   def record_poll(self,feed,active,now):
+      '''
+      Records whether a poll of a feed found anything new, which drives the feed's adaptive
+      polling interval.
+      '''
+      if self._max_poll_interval is None:
+         return
+      if feed not in self._poll_intervals:
+         self._poll_intervals[feed] = scheduler.AdaptiveInterval(self._check_period,
+            self._max_poll_interval,self._poll_backoff)
+      self._poll_intervals[feed].record(active,now)
+
+   def streaming_feed(self,feed):
+      '''
+      Returns whether a feed is currently delivered by the stream, rather than polled.
+      '''
+      return feed in STREAM_FEEDS and self._stream is not None and self._stream.connected
+
+   def on_stream_connect(self):
+      # called on the stream reader thread; the gap is filled by the bot's own thread
+      with self._stream_lock:
+         self._stream_gap = True
+      self._stream_wakeup.set()
+
+   def on_stream_message(self,message):
+      # called on the stream reader thread for each message of the user stream
+      feeds = [feed for feed,enabled in (('home',self._do_process_home_timeline),
+         ('mentions',self._do_process_mentions),('dms',self._do_process_direct_messages))
+         if enabled]
+      events = streaming.user_stream_events(message,self._me,feeds,self._log)
+      if events:
+         with self._stream_lock:
+            self._stream_events.extend(events)
+         self._stream_wakeup.set()
+
+   @stage
+   def process_stream(self):
+      '''
+      Handles the statuses the stream delivered since the last call, through the same hooks (and
+      command processing) as polled statuses.  If the stream (re)connected, the streamed feeds are
+      first polled once, to fill in what was missed while it was down.
+
+      Only polls move the last IDs, so that the next gap fill starts from before the gap; a status
+      that is both polled and streamed is only handled once.
+      '''
+      with self._stream_lock:
+         gap,self._stream_gap = self._stream_gap,False
+         events,self._stream_events = self._stream_events,[]
+      if not gap and not events:
+         return
+
+      with storage.batch(self._last_id_filename):
+         self._actionable_cutoff = self.actionable_cutoff()
+         if gap:
+            last_ids = self._last_ids
+            if self._do_process_home_timeline:
+               last_ids.home = self.process_home_timeline(last_ids.home)
+            if self._do_process_mentions:
+               last_ids.mentions = self.process_mentions(last_ids.mentions)
+            if self._do_process_direct_messages:
+               last_ids.dms = self.process_dms(last_ids.dms)
+            self.save_last_ids()
+
+         handlers = {'home':self.handle_home_timeline,'mentions':self.handle_mentions,
+                     'dms':self.handle_dms}
+         for feed in STREAM_FEEDS:
+            # events arrive oldest first; feeds are handled newest first
+            statuses = [status for event_feed,status in reversed(events) if event_feed == feed]
+            if statuses:
+               handlers[feed](statuses,None)
+
+   @stage
    def process_watched_timelines(self):
       all_statuses = {}
       for screenname,count in self._watched_timelines:
-         try:
-            all_statuses[screenname] = self._api.GetUserTimeline(screen_name=screenname,count=count)
-         except twitter.TwitterError,te:
-            print "ERROR: {0}".format(te.message)
+         statuses = self.fetch_user_timeline(screenname,count)
+         if statuses is not None:
+            all_statuses[screenname] = statuses
+
+      self.handle_watched_timelines(all_statuses)
+
+   def fetch_user_timeline(self,screenname,count):
+      try:
+         return self.call_api('GetUserTimeline',screen_name=screenname,count=count)
+      except twitter.TwitterError,te:
+         self._log.error('fetch_failed',feed='watched',screen_name=screenname,error=te.message)
+      return None
 
-         if self._DEBUG:
-            self.print_statuses("Watched Timeline {0}".format(screenname),all_statuses[screenname])
+   @stage
+   def handle_watched_timelines(self,all_statuses):
+      if self._DEBUG:
+         for screenname in all_statuses:
+            self.log_statuses("Watched Timeline {0}".format(screenname),all_statuses[screenname])
 
       # trigger hook
-      self.on_watched_timelines(all_statuses)
+      self.dispatch_hook('watched',self.on_watched_timelines,all_statuses)
 
    def on_watched_timelines(self,statuses):
       # implemented in subclass
       pass
 
+   @stage
    def process_home_timeline(self,last_id):
-      statuses=[]
+      return self.handle_home_timeline(self.fetch_home_timeline(last_id) or [],last_id)
+
+   def fetch_home_timeline(self,last_id):
       try:
-         statuses = self._api.GetHomeTimeline(since_id=last_id)
+         return self.call_api('GetHomeTimeline',since_id=last_id)
       except twitter.TwitterError,te:
-         print "ERROR: {0}".format(te.message)
+         self._log.error('fetch_failed',feed='home',error=te.message)
+      return None
 
+   @stage
+   def handle_home_timeline(self,statuses,last_id):
       if self._DEBUG:
-         self.print_statuses("Home Timeline",statuses)
+         self.log_statuses("Home Timeline",statuses)
 
       # trigger hook
-      if self.actionable(statuses):
-        self.on_home_timeline(statuses)
+      new_statuses = self.actionable_statuses(self.claim_statuses('home',statuses))
+      if len(new_statuses) > 0:
+        self.dispatch_hook('home',self.on_home_timeline,new_statuses)
 
       return self.extract_id_if_exists(statuses,last_id)
 
@@ -168,19 +666,26 @@ class TwitterBot(object):
       # implemented in subclass
       pass
 
+   @stage
    def process_replies(self,last_id):
-      statuses=[]
+      return self.handle_replies(self.fetch_replies(last_id) or [],last_id)
+
+   def fetch_replies(self,last_id):
       try:
-         statuses = self._api.GetReplies(since_id=last_id)
+         return self.call_api('GetReplies',since_id=last_id)
       except twitter.TwitterError,te:
-         print "ERROR: {0}".format(te.message)
+         self._log.error('fetch_failed',feed='replies',error=te.message)
+      return None
 
+   @stage
+   def handle_replies(self,statuses,last_id):
       if self._DEBUG:
-         self.print_statuses("Replies",statuses)
+         self.log_statuses("Replies",statuses)
 
       # trigger hook
-      if self.actionable(statuses):
-        self.on_replies(statuses)
+      new_statuses = self.actionable_statuses(self.claim_statuses('replies',statuses))
+      if len(new_statuses) > 0:
+        self.dispatch_hook('replies',self.on_replies,new_statuses)
 
       return self.extract_id_if_exists(statuses,last_id)
 
@@ -188,78 +693,117 @@ class TwitterBot(object):
       # implemented in subclass
       pass
 
+   @stage
    def process_mentions(self,last_id):
-      statuses=[]
+      return self.handle_mentions(self.fetch_mentions(last_id) or [],last_id)
+
+   def fetch_mentions(self,last_id):
       try:
-         statuses = self._api.GetMentions(since_id=last_id)
+         return self.call_api('GetMentions',since_id=last_id)
       except twitter.TwitterError,te:
-         print "ERROR: {0}".format(te.message)
+         self._log.error('fetch_failed',feed='mentions',error=te.message)
+      return None
 
+   @stage
+   def handle_mentions(self,statuses,last_id):
       if self._DEBUG:
-         self.print_statuses("Mentions",statuses)
+         self.log_statuses("Mentions",statuses)
 
-      if self.actionable(statuses):
+      new_statuses = self.actionable_statuses(self.claim_statuses('mentions',statuses))
+      if len(new_statuses) > 0:
         # process the commands
-        self.process_commands(statuses)
+        self.dispatch_hook('mentions',self.process_commands,new_statuses)
 
         # trigger hook
-        self.on_mentions(statuses)
+        self.dispatch_hook('mentions',self.on_mentions,new_statuses)
 
       return self.extract_id_if_exists(statuses,last_id)
 
+   @stage
    def process_commands(self,mentions):
+      '''
+      Submits the commands found in mentions from allowed bosses to the command engine.  Commands
+      run in the background; the commands of each boss run (and are answered) in the order they
+      were sent.
+      '''
       # statuses come in most recent -> least recent order...we want to go the opposite direction
       for status in reversed(mentions):
          if status.user.screen_name in self._allowed_bosses:
             # user is valid, it can issue commands
 
-            # create copy for local processing
-            status_txt=status.text
-
-            # strip off the @mention part
-            status_txt=self.strip_at_symbols(status_txt)
-            print "Command: {0}".format(status_txt)
-            # check if first name is 'ctl
-            if len(status_txt) > 3 and status_txt[:4]=="ctl ":
-              # this is a command; strip off the 'ctl'
-              status_txt=" ".join(status_txt.split(" ")[1:])
-
-              try:
-                 cmnd=command.CommandFactory.create(status_txt,self)
-                 response = cmnd.run()
-                 if response is not None:
-                    self.reply(status,response)
-              except command.CommandError, ce:
-                 self.reply(status,"Error: {0}".format(ce.message))
+            # one scan strips the @mentions and checks for the 'ctl' keyword
+            command_words=command.tokenize(status.text,command.leading_mentions_end(status))
+            if command_words is not None:
+              self._log.info('command',words=command_words,user=status.user.screen_name,
+                 status_id=status.id)
+              respond=lambda response,error,status=status,name=command_name(command_words), \
+                 submitted=timeutils.monotonic(): \
+                 self.command_finished(status,name,submitted,response,error)
+              self._command_engine.submit(status.user.screen_name,command_words,self,respond)
+
+   def command_finished(self,status,name,submitted,response,error):
+      '''
+      Records the time a command took from submission until it finished (COMMAND_SECONDS) and its
+      outcome (COMMANDS), then responds to it.  Called by the command engine when the command
+      finishes.
+      '''
+      if isinstance(error,command.CommandTimeout):
+         outcome = 'timeout'
+      elif isinstance(error,command.CommandError):
+         outcome = 'error'
+      elif error is not None:
+         outcome = 'failed'
+      else:
+         outcome = 'ok'
+      self._metrics.observe(COMMAND_SECONDS,timeutils.monotonic()-submitted,command=name)
+      self._metrics.count(COMMANDS,command=name,outcome=outcome)
+      self.respond_to_command(status,response,error)
 
+   def respond_to_command(self,status,response,error):
+      '''
+      Replies to a command with its response, or with the error it failed with.  Called by the
+      command engine when the command finishes.
+      '''
+      if isinstance(error,command.CommandError):
+         self.reply(status,u"Error: {0}".format(error.message))
+      elif error is not None:
+         self._log.error('command_failed',text=status.text,error=error)
+      elif response is not None:
+         self.reply(status,response)
 
    def on_mentions(self,statuses):
       # implemented in subclass
       pass
 
+   @stage
    def process_dms(self,last_id):
-      statuses = []
+      return self.handle_dms(self.fetch_dms(last_id) or [],last_id)
+
+   def fetch_dms(self,last_id):
+      statuses = None
       try:
-         statuses = self._api.GetDirectMessages(since_id=last_id)
+         statuses = self.call_api('GetDirectMessages',since_id=last_id)
       except twitter.error.TwitterError, e:
-         error_args = e.args[0]
          # this can happen if the app is not configused to be able to access direct messages.
          # if this is the case, detect the error, display a warning, and stop trying to access those
          # messages
-         if len(error_args) > 0 and 'code' in error_args[0] and error_args[0]['code'] == 93:
-            print "WARNING: Access to direct messages denied for this user.  Turning off direct " \
-               "message processing."
+         if twitter_error_code(e) == ERROR_DM_ACCESS_DENIED:
+            self._log.warning('dm_access_denied',"access to direct messages denied for this "
+               "user; turning off direct message processing")
             self._do_process_direct_messages=False
-            statuses = []
          else:
-            print "ERROR: {0}".format(e.message)
+            self._log.error('fetch_failed',feed='dms',error=e.message)
+      return statuses
 
+   @stage
+   def handle_dms(self,statuses,last_id):
       if self._DEBUG:
-         self.print_statuses("DMs",statuses)
+         self.log_statuses("DMs",statuses)
 
       # trigger hook
-      if self.actionable(statuses):
-        self.on_dms(statuses)
+      new_statuses = self.actionable_statuses(self.claim_statuses('dms',statuses))
+      if len(new_statuses) > 0:
+        self.dispatch_hook('dms',self.on_dms,new_statuses)
 
       return self.extract_id_if_exists(statuses,last_id)
 
@@ -267,18 +811,69 @@ class TwitterBot(object):
       # implemented in subclass
       pass
 
+   def claim_statuses(self,feed,statuses):
+      '''
+      Returns the statuses of a feed that this bot has not handled before, and records them as
+      handled.  The record is saved right away, before any hook or command sees the statuses, so
+      that a crash part way through an update cannot make the bot handle them a second time.
+      '''
+      new_statuses = self._processed.claim(feed,statuses)
+      self._metrics.count(STATUSES_SEEN,len(statuses),feed=feed)
+      self._metrics.count(STATUSES_NEW,len(new_statuses),feed=feed)
+      if self._processed.save_if_changed(self._processed_filename,self._fsync_state):
+         storage.flush(self._processed_filename)
+      return new_statuses
+
+   def actionable_cutoff(self,now=None):
+      '''
+      Returns the creation time (epoch seconds) before which statuses are too old to act on.
+      '''
+      if now is None:
+         now = time.time()
+      return now-self._max_actionable_age.seconds
+
+   def actionable_statuses(self,statuses):
+      '''
+      Returns the statuses (sorted newest first) that are new enough to act on: those created within
+      the maximum actionable age, as of the start of the current update.  Older statuses are
+      dropped, so that the bot does not act on a backlog of old statuses (e.g. commands) after it
+      has been down for a while.
+      '''
+      cutoff = self._actionable_cutoff
+      if cutoff is None:
+         cutoff = self.actionable_cutoff()
+      return timeutils.newer_than(statuses,cutoff)
+
    def actionable(self,statuses):
-      if len(statuses) > 0:
-         most_recent_status=statuses[0]
-         td=timeutils.time_since(most_recent_status.created_at)
-         if td < self._max_actionable_age.timedelta:
-            return True
+      return len(self.actionable_statuses(statuses[:1])) > 0
 
-      return False
+   def schedule_next_tick(self):
+      '''
+      Schedules the next update after one has finished, and returns its deadline (on the
+      timeutils.monotonic clock).
+      '''
+      overruns = self._scheduler.overruns
+      # pick up any change to the check period made while running
+      self._scheduler.period = self._check_period
+      deadline = self._scheduler.advance()
+      if self._scheduler.overruns > overruns:
+         self._log.warning('update_overran',"update overran the check period",
+            overrun_seconds=self._scheduler.last_overrun)
+      return deadline
 
    def sleep(self):
-      # TODO: update this to only sleep remaining amount
-      time.sleep(self._check_period.seconds)
+      # only sleep until the next scheduled check
+      if self._stream is None:
+         self._scheduler.wait()
+         return
+      # while streaming, handle what the stream delivers as soon as it arrives
+      while True:
+         remaining = self._scheduler.time_until_next()
+         if remaining <= 0:
+            return
+         if self._stream_wakeup.wait(remaining):
+            self._stream_wakeup.clear()
+            self.process_stream()
 
    def extract_id_if_exists(self,statuses,default):
       if len(statuses) > 0:
@@ -286,60 +881,158 @@ class TwitterBot(object):
       else:
         return default
 
-   def print_statuses(self,header,statuses):
-      if len(header):
-         print "="*20,header,"="*20
-      if len(statuses) == 0:
-         print "No statuses."
-      index = 1
-      for s in statuses:
-         print u'{0} @{1},{2} -- {3}'.format(index,s.user.screen_name,s.id,s.text)
-         index += 1
+   def log_statuses(self,header,statuses):
+      '''
+      Logs a debug record with the number of statuses under a header (e.g. the feed they came from),
+      and one record for each status.  The per-status records have the event name 'status', so
+      that they can be sampled (see botlog.LogPipeline).
+      '''
+      self._log.debug('statuses',header=header,count=len(statuses))
+      for index,s in enumerate(statuses,1):
+         self._log.debug('status',header=header,index=index,user=s.user.screen_name,id=s.id,
+            text=s.text)
+
+   # the old name, for subclasses that call it
+   print_statuses = log_statuses
 
    def strip_at_symbols(self,status_txt):
       # strip off the @mention part
-      while len(status_txt) > 0 and status_txt[0]=='@':
-         status_txt=" ".join(status_txt.split(" ")[1:])
-      return status_txt
+      return command.strip_mentions(status_txt)
 
    def tweet(self,message):
       '''
-      Simple utility function to tweet a message.
+      Simple utility function to tweet a message.  The tweet is queued and sent in the background;
+      returns a postqueue.PostHandle whose wait() returns the posted status.
       '''
-      try:
-         self._api.PostUpdate(message)
-      except TwitterError,te:
-         print "ERROR: {0}".format(te.message)
+      return self.queue_post({'kind':'update','message':message})
 
    def reply(self,in_reply_to,response):
-      try:
-         self._api.PostUpdate("@{0} {1}".format(in_reply_to.user.screen_name,response),\
-            in_reply_to_status_id=in_reply_to.id)
-      except TwitterError,te:
-         print "ERROR: {0}".format(te.message)
+      return self.queue_post({'kind':'update',
+         'message':u"@{0} {1}".format(in_reply_to.user.screen_name,response),
+         'in_reply_to_status_id':in_reply_to.id})
 
    def tweet_image(self,image_filename,message):
-      try:
-         self._api.PostMedia(message,image_filename)
-      except twitter.TwitterError,te:
-        print "ERROR: {0}".format(te.message)
+      '''
+      Tweets an image with a message.  The image (in this and the other image helpers) is the name
+      of an image file or a mediabuffer.MediaBuffer holding an encoded image in memory, which is
+      uploaded without going through a file.
+      '''
+      return self.queue_post({'kind':'media','message':message,'media':image_filename})
 
    def tweet_multiple_images(self,image_filenames,message):
-      try:
-         self._api.PostMultipleMedia(message,image_filenames)
-      except twitter.TwitterError,te:
-         print "ERROR: {0}".format(te.message)
+      return self.queue_post({'kind':'multiple_media','message':message,
+         'media':list(image_filenames)})
 
    def reply_with_image(self,in_reply_to,image_filename,response):
-      try:
-         self._api.PostMedia("@{0} {1}".format(in_reply_to.user.screen_name,response),\
-            image_filename,in_reply_to_status_id=in_reply_to.id)
-      except TwitterError,te:
-         print "ERROR: {0}".format(te.message)
+      return self.queue_post({'kind':'media',
+         'message':u"@{0} {1}".format(in_reply_to.user.screen_name,response),
+         'media':image_filename,'in_reply_to_status_id':in_reply_to.id})
 
    def reply_with_multiple_images(self,in_reply_to,image_filenames,response):
+      return self.queue_post({'kind':'multiple_media',
+         'message':u"@{0} {1}".format(in_reply_to.user.screen_name,response),
+         'media':list(image_filenames),'in_reply_to_status_id':in_reply_to.id})
+
+   def queue_post(self,post):
+      '''
+      Adds a post (a dictionary with 'kind', 'message' and, depending on the kind, 'media' and
+      'in_reply_to_status_id') to the outbound post queue.  Returns its postqueue.PostHandle.
+      '''
+      media = post.get('media')
+      if any(isinstance(m,mediabuffer.MediaBuffer) for m in
+            (media if isinstance(media,list) else [media])):
+         post['in_memory'] = True
+      return self._post_queue.put(post)
+
+   def spool_post(self,post):
+      '''
+      Returns a copy of a post whose images in memory are written to files in the media spool
+      directory, so that the post can be saved in the post queue file.
+      '''
+      def spool(media):
+         if not isinstance(media,mediabuffer.MediaBuffer):
+            return media
+         fd,filename = tempfile.mkstemp(suffix=media.extension,dir=self._media_spool_directory)
+         with os.fdopen(fd,'wb') as spool_file:
+            spool_file.write(media.tobytes())
+            if self._fsync_state:
+               spool_file.flush()
+               os.fsync(spool_file.fileno())
+         return filename
+
+      if not os.path.isdir(self._media_spool_directory):
+         os.makedirs(self._media_spool_directory)
+      spooled = dict(post)
+      del spooled['in_memory']
+      spooled['spooled'] = True
+      if isinstance(post['media'],list):
+         spooled['media'] = [spool(m) for m in post['media']]
+      else:
+         spooled['media'] = spool(post['media'])
+      return spooled
+
+   def send_post(self,post):
+      '''
+      Sends a queued post.  Called by the post queue workers; returns the posted status, or None
+      if the rate limit budget does not allow the post yet.
+      '''
+      kwargs = {'priority':ratelimit.PRIORITY_POST}
+      if post.get('in_reply_to_status_id') is not None:
+         kwargs['in_reply_to_status_id'] = post['in_reply_to_status_id']
+
+      if post['kind'] == 'update':
+         status = self.call_api('PostUpdate',post['message'],**kwargs)
+         if status is not None:
+            self._metrics.count(POSTS,kind=post['kind'])
+         return status
+      if post['kind'] in ('media','multiple_media'):
+         filenames = post['media'] if post['kind'] == 'multiple_media' else [post['media']]
+         if backend.uploads_media(self._api):
+            status = self.send_media_post(post['message'],filenames,**kwargs)
+         elif post['kind'] == 'media':
+            status = self.call_api('PostMedia',post['message'],post['media'],**kwargs)
+         else:
+            status = self.call_api('PostMultipleMedia',post['message'],post['media'],**kwargs)
+         if status is not None:
+            self._metrics.count(POSTS,kind=post['kind'])
+            if post.get('spooled'):
+               for filename in filenames:
+                  if os.path.isfile(filename):
+                     os.remove(filename)
+         return status
+      raise TwitterBotError("Unknown post kind: {0}".format(post['kind']))
+
+   def send_media_post(self,message,filenames,**kwargs):
+      '''
+      Posts a status with images, uploading only the images that are not in the media cache.
+      Returns None if an upload or the post is deferred.
+      '''
+      media_ids = self._media_cache.media_ids(filenames)
+      if media_ids is None:
+         return None
       try:
-         self._api.PostMedia("@{0} {1}".format(in_reply_to.user.screen_name,response),\
-            image_filenames,in_reply_to_status_id=in_reply_to.id)
-      except TwitterError,te:
-         print "ERROR: {0}".format(te.message)
+         return self.call_api('PostUpdate',message,media=media_ids,**kwargs)
+      except twitter.TwitterError,te:
+         # the media expired or was removed; upload it again when the post is retried
+         if twitter_error_code(te) == ERROR_INVALID_MEDIA:
+            self._media_cache.forget(filenames)
+         raise
+
+   def upload_media(self,filename):
+      '''
+      Uploads an image file (or MediaBuffer) and returns its media ID (None if the upload is
+      deferred).  Large images are uploaded in chunks.
+      '''
+      if isinstance(filename,mediabuffer.MediaBuffer):
+         size = len(filename)
+      else:
+         size = os.path.getsize(filename)
+      if size > MAX_SIMPLE_UPLOAD_SIZE:
+         return self.call_api('UploadMediaChunked',filename,priority=ratelimit.PRIORITY_POST)
+      return self.call_api('UploadMediaSimple',filename,priority=ratelimit.PRIORITY_POST)
+
+   def post_error_retryable(self,error):
+      '''
+      Returns whether a failed post should be tried again.
+      '''
+      return twitter_error_code(error) not in PERMANENT_POST_ERRORS